@@ -0,0 +1,585 @@
+"""
+Benchmarks of the paths a node spends its time in: mining, verification, serving and sync.
+
+Each scenario takes parameters, runs warmup rounds, then timed rounds, and reports
+percentiles of the seconds per round and the rate of work units per second.
+Everything runs offline, nodes are served on free localhost ports.
+
+    python -m src.bench                                  run every scenario
+    python -m src.bench verify sync -s blocks=100,1000   run two scenarios with two chain sizes
+    python -m src.bench -o results.json                  save the results
+    python -m src.bench -b results.json                  compare with saved results, exit 1 on a regression
+"""
+
+import sys
+import gc
+import getopt
+import itertools
+import json
+import platform
+import random
+import statistics
+import string
+import threading
+import time
+import tracemalloc
+import requests
+from werkzeug.serving import WSGIRequestHandler, make_server
+from src import server, wire
+from src.difficulty import DifficultySchedule
+from src.miner import ParallelMiner
+from src.network import NDJSON
+from src.parallel_merkle import merkle_root
+from src.transaction import AccountTable, TransferColumns, TransferTxn
+from src.mempool import Mempool
+from src.util import Hasher, _fields_hash
+from src.zero_chain import BlockHeader, ZeroChain
+from src.light_chain import LightChain
+from src.zero_merkle import ROOT_VERSION, transaction_root
+from src.zero_merkle import BitcoinMerkleTree, LibraMerkleTree, ZeroMerkleTree
+from src.zero_merkle import BitcoinMerkleTreeLite, LibraMerkleTreeLite, ZeroMerkleTreeLite
+from src.zero_merkle import CompactMerkleTree, DigestMerkleTree
+
+# The format of the saved results, a baseline of another version is not compared
+RESULTS_VERSION = 1
+
+# name -> (scenario function, unit of work, default parameters)
+SCENARIOS = {}
+
+
+def scenario(name: str, unit: str, **defaults):
+    """
+    Registers a scenario. The function takes the parameters, prepares the data,
+    yields a function which runs one round and returns the number of work units
+    it did, then cleans up after the yield. A round which measures memory returns
+    (work units, bytes) instead.
+    """
+    def register(function):
+        SCENARIOS[name] = (function, unit, defaults)
+        return function
+    return register
+
+
+def fixed_schedule(difficulty: int):
+    """ A schedule which never retargets, so the work of a round does not depend on the clock. """
+    return DifficultySchedule(initial=difficulty, minimum=difficulty, maximum=difficulty)
+
+
+def build_chain(blocks: int, txns: int, difficulty: int, version: int = ROOT_VERSION):
+    """
+    Mines a chain of <blocks> blocks after the genesis block, each with <txns> transfers.
+    :param version: the version of the transaction roots
+    """
+    chain = ZeroChain(schedule=fixed_schedule(difficulty), mempool=Mempool(root_version=version))
+    for b in range(blocks):
+        chain.transfer_many((f"sender{b % 97}", f"receiver{i % 89}", b * txns + i + 1) for i in range(txns))
+        chain.create_block()
+    return chain
+
+
+def random_chain(blocks: int, txns: int):
+    """
+    Makes <blocks> blocks of <txns> random transfers each, without pow, for the scenarios which only decode or hash.
+    :return: the list of block headers and the list of transactions of each block
+    """
+    rng = random.Random(blocks * 7919 + txns)
+    names = ["".join(rng.choices(string.ascii_lowercase, k=8)) for i in range(100)]
+    block_headers, transactions = [], []
+    for h in range(blocks):
+        transactions.append([TransferTxn(rng.choice(names), rng.choice(names), rng.randint(1, 1 << 20))
+                             for i in range(txns)])
+        block_headers.append(BlockHeader(h, "%064x" % rng.getrandbits(256), "%064x" % rng.getrandbits(256),
+                                         2, rng.randint(0, 1 << 16)))
+    return block_headers, transactions
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    """ Does not log each request, which would take a part of the time being measured. """
+
+    def log_request(self, *args):
+        pass
+
+
+class LocalNode:
+    """ Serves a chain on a free localhost port from a thread. """
+
+    def __init__(self, chain):
+        self.chain = chain
+        self._previous = server.zeroChain
+        server.zeroChain = chain
+        self._server = make_server("127.0.0.1", 0, server.app, threaded=True,
+                                   request_handler=QuietRequestHandler)
+        self.address = f"127.0.0.1:{self._server.server_port}"
+        self._thread = threading.Thread(target=self._server.serve_forever, name="bench-node", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        self._server.shutdown()
+        self._thread.join()
+        server.zeroChain = self._previous
+
+
+@scenario("pow", "nonces", difficulty=12, workers=1)
+def pow_scenario(difficulty, workers):
+    """ Mines blocks with pow_add_block, the rate is the nonce rate. """
+    chain = ZeroChain(schedule=fixed_schedule(difficulty))
+    if workers > 1:
+        chain.miner = ParallelMiner(workers)
+
+    def run():
+        block_header, _, txids = chain.block_template()
+        chain.pow_add_block(block_header, txids)
+        return chain.miner.attempts if chain.miner is not None else block_header.nonce + 1
+
+    yield run
+    if chain.miner is not None:
+        chain.miner.close()
+
+
+@scenario("verify", "blocks", blocks=200, txns=20, difficulty=4, workers=1, version=ROOT_VERSION)
+def verify_scenario(blocks, txns, difficulty, workers, version):
+    """ Verifies a whole chain with verify_chain, in the process pool of the chain if workers > 1. """
+    chain = build_chain(blocks, txns, difficulty, version)
+    executor = chain.executor if workers > 1 else None
+
+    def run():
+        assert ZeroChain.verify_chain(chain.block_headers, chain.transactions, workers=workers,
+                                      schedule=chain.schedule, executor=executor)
+        return chain.block_height
+
+    yield run
+    chain.close()
+
+
+@scenario("merkle", "transactions", txns=1024, version=ROOT_VERSION)
+def merkle_scenario(txns, version):
+    """ Builds the transaction root of a block of transactions decoded from json, like a sync does. """
+    data = [{"sender": f"sender{i % 97}", "receiver": f"receiver{i % 89}", "amount": i + 1} for i in range(txns)]
+
+    def run():
+        transaction_root([TransferTxn.from_json(t) for t in data], version, workers=1)
+        return txns
+
+    yield run
+
+
+@scenario("fullnode", "blocks", blocks=200, txns=20, difficulty=4, format="json")
+def fullnode_scenario(blocks, txns, difficulty, format):
+    """ Serializes the whole chain through /fullnode, format is json, ndjson or wire. """
+    chain = build_chain(blocks, txns, difficulty)
+    accept = {"json": "application/json", "ndjson": NDJSON, "wire": wire.MIMETYPE}[format]
+    previous, server.zeroChain = server.zeroChain, chain
+    client = server.app.test_client()
+
+    def run():
+        response = client.get("/fullnode", headers={"Accept": accept})
+        # the body is streamed, so it is only serialized while it is read
+        assert response.status_code == 200 and response.get_data()
+        return chain.block_height
+
+    yield run
+    server.zeroChain = previous
+
+
+@scenario("sync", "blocks", blocks=200, txns=20, difficulty=4, version=ROOT_VERSION)
+def sync_scenario(blocks, txns, difficulty, version):
+    """ Syncs an empty node from a node on a localhost port with sync_self. """
+    node = LocalNode(build_chain(blocks, txns, difficulty, version))
+
+    def run():
+        chain = ZeroChain(schedule=fixed_schedule(difficulty))
+        chain.add_nodes([node.address], False)
+        assert chain.sync_self() and chain.block_height == node.chain.block_height
+        return node.chain.block_height
+
+    try:
+        yield run
+    finally:
+        node.close()
+
+
+@scenario("light_sync", "blocks", blocks=200, txns=20, difficulty=4, version=ROOT_VERSION)
+def light_sync_scenario(blocks, txns, difficulty, version):
+    """ Syncs the headers of a node on a localhost port into an empty LightChain. """
+    node = LocalNode(build_chain(blocks, txns, difficulty, version))
+
+    def run():
+        chain = LightChain(schedule=fixed_schedule(difficulty))
+        chain.add_nodes([node.address], False)
+        assert chain.sync_self() and chain.block_height == node.chain.block_height
+        return node.chain.block_height
+
+    try:
+        yield run
+    finally:
+        node.close()
+
+
+@scenario("create_transaction", "transactions", txns=500, batch=0)
+def create_transaction_scenario(txns, batch):
+    """
+    Submits transfers to a node on a localhost port, one per request with /create_transaction,
+    or batch transfers per request with /create_transactions.
+    """
+    node = LocalNode(ZeroChain(schedule=fixed_schedule(1)))
+    session = requests.Session()
+    rounds = itertools.count()
+
+    def run():
+        # the amounts are unique, so no transfer is a duplicate of an earlier round
+        first = next(rounds) * txns + 1
+        transfers = [{"sender": f"sender{i % 97}", "receiver": f"receiver{i % 89}", "amount": first + i}
+                     for i in range(txns)]
+        if batch:
+            for i in range(0, txns, batch):
+                response = session.post(f"http://{node.address}/create_transactions", json=transfers[i:i + batch])
+                assert response.status_code == 200
+        else:
+            for transfer in transfers:
+                assert session.post(f"http://{node.address}/create_transaction", data=transfer).status_code == 200
+        with node.chain.lock:
+            node.chain.mempool.remove(list(node.chain.mempool.transactions))
+        return txns
+
+    try:
+        yield run
+    finally:
+        session.close()
+        node.close()
+
+
+# The trees of the merkle tree study, the Lite ones hash bytes into raw digests
+MERKLE_TREES = {
+    "zero": ZeroMerkleTree, "bitcoin": BitcoinMerkleTree, "libra": LibraMerkleTree,
+    "zero_lite": ZeroMerkleTreeLite, "bitcoin_lite": BitcoinMerkleTreeLite, "libra_lite": LibraMerkleTreeLite,
+    "compact": CompactMerkleTree, "digest": DigestMerkleTree,
+}
+
+
+@scenario("merkle_tree", "leaves", tree="zero", leaves=2049, memory=0)
+def merkle_tree_scenario(tree, leaves, memory):
+    """
+    Builds a merkle tree of random 15 byte items, tree is one of MERKLE_TREES. A power of
+    two is the best case of the paddings, one more leaf the worst. With memory=1 the
+    bytes the tree allocates are measured too, which slows the rounds down.
+    """
+    build = MERKLE_TREES[tree]
+    rng = random.Random(leaves)
+    data = [bytes(rng.choices(b"ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789", k=15)) for i in range(leaves)]
+
+    def run():
+        if not memory:
+            build(data)
+            return leaves
+        tracemalloc.start()
+        try:
+            built = build(data)
+            size = tracemalloc.get_traced_memory()[0]
+        finally:
+            tracemalloc.stop()
+        del built
+        return leaves, size
+
+    yield run
+
+
+@scenario("decode", "transactions", blocks=100, txns=1000, format="wire")
+def decode_scenario(blocks, txns, format):
+    """ Decodes a /blocks reply into the transactions of its blocks, format is json or wire. """
+    block_headers, transactions = random_chain(blocks, txns)
+    if format == "wire":
+        data = wire.encode_blocks(0, block_headers, transactions)
+
+        def run():
+            wire.decode_blocks(data, TransferTxn)
+            return blocks * txns
+    else:
+        data = json.dumps({"block_headers": [h.to_json() for h in block_headers],
+                           "transactions": [[t.to_json() for t in ts] for ts in transactions]}).encode()
+
+        def run():
+            [[TransferTxn.from_json(t) for t in ts] for ts in json.loads(data)["transactions"]]
+            return blocks * txns
+
+    yield run
+
+
+@scenario("hash_cache", "blocks", blocks=2000, txns=10, decode="again")
+def hash_cache_scenario(blocks, txns, decode):
+    """
+    Decodes a chain from json and hashes its headers and transaction roots. decode is "cold"
+    for an empty hash LRU each round, "again" for the same headers decoded again like the
+    next sync, or "none" to hash the same objects each round without decoding.
+    """
+    block_headers, transactions = random_chain(blocks, txns)
+    data = json.dumps({"block_headers": [h.to_json() for h in block_headers],
+                       "transactions": [[t.to_json() for t in txs] for txs in transactions]})
+
+    def decoded():
+        chain = json.loads(data)
+        return ([BlockHeader.from_json(h) for h in chain["block_headers"]],
+                [[TransferTxn.from_json(t) for t in txs] for txs in chain["transactions"]])
+
+    same = decoded()
+
+    def run():
+        if decode == "cold":
+            _fields_hash.cache_clear()
+        headers, txs = same if decode == "none" else decoded()
+        for h in headers:
+            Hasher.object_hash(h)
+        for ts in txs:
+            merkle_root(ts, encoding="hex", workers=1)
+        return blocks
+
+    yield run
+
+
+class DictTransferTxn:
+    """ A TransferTxn with a __dict__, the layout before __slots__. """
+    def __init__(self, sender: str, receiver: str, amount: int):
+        self.sender = sender
+        self.receiver = receiver
+        self.amount = amount
+
+
+@scenario("history", "transactions", txns=100000, block_size=1000, form="columns")
+def history_scenario(txns, block_size, form):
+    """
+    Stores transfers decoded from json like a sync does, form is "dicts" for objects with
+    a __dict__, "objects" for slotted TransferTxn, or "columns" for TransferColumns.
+    Each round reports the bytes the stored transfers take.
+    """
+    rng = random.Random(txns)
+    names = ["".join(rng.choices(string.ascii_lowercase, k=12)) for i in range(10000)]
+    blocks = [json.dumps([{"sender": rng.choice(names), "receiver": rng.choice(names),
+                           "amount": rng.randint(1, 1 << 20)} for i in range(block_size)])
+              for b in range(8)]
+    accounts = AccountTable()
+    store = {
+        "dicts": lambda txs: [DictTransferTxn(**t) for t in txs],
+        "objects": lambda txs: [TransferTxn.from_json(t) for t in txs],
+        "columns": lambda txs: TransferColumns([TransferTxn.from_json(t) for t in txs], accounts),
+    }[form]
+
+    def run():
+        gc.collect()
+        tracemalloc.start()
+        try:
+            history = [store(json.loads(blocks[b % len(blocks)])) for b in range(txns // block_size)]
+            gc.collect()
+            size = tracemalloc.get_traced_memory()[0]
+        finally:
+            tracemalloc.stop()
+        del history
+        return txns, size
+
+    yield run
+
+
+@scenario("concurrency", "transactions", threads=8, txns=2000, miners=2)
+def concurrency_scenario(threads, txns, miners):
+    """
+    Submits <txns> transfers from each of <threads> threads while <miners> threads mine
+    blocks, and checks every accepted transfer is mined once. tests/test_concurrency.py
+    runs the same check with fewer transfers.
+    """
+    def run():
+        chain = ZeroChain(schedule=fixed_schedule(4))
+        accepted = [[] for t in range(threads)]
+        done = threading.Event()
+
+        def submit(t):
+            for i in range(0, txns, 10):
+                results = chain.transfer_many((f"s{t}", f"r{j % 7}", j + 1) for j in range(i, min(i + 10, txns)))
+                accepted[t].extend(txid for txid, error in results if error is None)
+
+        def mine():
+            while not done.is_set():
+                chain.create_block()
+
+        miner_threads = [threading.Thread(target=mine) for m in range(miners)]
+        submitters = [threading.Thread(target=submit, args=(t,)) for t in range(threads)]
+        for w in miner_threads + submitters:
+            w.start()
+        for w in submitters:
+            w.join()
+        done.set()
+        for w in miner_threads:
+            w.join()
+        while len(chain.mempool):
+            chain.create_block()
+        mined = sorted(Hasher.object_hash(t) for txs in chain.transactions for t in txs)
+        assert mined == sorted(txid for a in accepted for txid in a), "a transaction is lost or mined twice"
+        return threads * txns
+
+    yield run
+
+
+def percentile(values: list, q: float):
+    """ Returns the q-th percentile of sorted values, interpolated between the closest ranks. """
+    position = (len(values) - 1) * q / 100
+    low = int(position)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (position - low)
+
+
+def measure(name: str, params: dict, repeat: int = 10, warmup: int = 2):
+    """
+    Runs a scenario.
+    :param params: the parameters which differ from the defaults of the scenario
+    :param repeat: number of timed rounds
+    :param warmup: number of rounds before them which are not timed
+    :returns the result as a json dict
+    """
+    function, unit, defaults = SCENARIOS[name]
+    params = {**defaults, **params}
+    rounds = function(**params)
+    run = next(rounds)
+    try:
+        for _ in range(warmup):
+            run()
+        seconds, units, sizes = [], [], []
+        for _ in range(repeat):
+            gc.collect()
+            start = time.perf_counter()
+            done = run()
+            seconds.append(time.perf_counter() - start)
+            if isinstance(done, tuple):
+                done, size = done
+                sizes.append(size)
+            units.append(done)
+    finally:
+        rounds.close()
+
+    ordered = sorted(seconds)
+    result = {
+        "scenario": name,
+        "params": params,
+        "unit": unit,
+        "repeat": repeat,
+        "warmup": warmup,
+        "seconds": {
+            "min": ordered[0],
+            "p50": percentile(ordered, 50),
+            "p90": percentile(ordered, 90),
+            "p99": percentile(ordered, 99),
+            "max": ordered[-1],
+            "mean": statistics.mean(seconds),
+            "stdev": statistics.stdev(seconds) if len(seconds) > 1 else 0.0,
+        },
+        "rate": sum(units) / sum(seconds),
+    }
+    if sizes:
+        result["bytes"] = max(sizes)
+    return result
+
+
+def result_key(result: dict):
+    return result["scenario"], json.dumps(result["params"], sort_keys=True)
+
+
+def compare(results: list, baseline: dict, threshold: float = 0.1):
+    """
+    Compares the median seconds per round with a baseline.
+    :param baseline: the saved output of an earlier run
+    :param threshold: the fraction of slowdown which is a regression
+    :returns the results which regressed
+    """
+    if baseline.get("version") != RESULTS_VERSION:
+        raise ValueError("the baseline has another results version")
+    previous = {result_key(r): r for r in baseline["results"]}
+    regressions = []
+    print(f"{'scenario':<20} {'params':<50} {'baseline':>10} {'p50':>10} {'change':>8}")
+    for result in results:
+        before = previous.get(result_key(result))
+        params = " ".join(f"{k}={v}" for k, v in result["params"].items())
+        if before is None:
+            print(f"{result['scenario']:<20} {params:<50} {'-':>10} {result['seconds']['p50']:>10.4f}      new")
+            continue
+        change = result["seconds"]["p50"] / before["seconds"]["p50"] - 1
+        regressed = change > threshold
+        if regressed:
+            regressions.append(result)
+        print(f"{result['scenario']:<20} {params:<50} {before['seconds']['p50']:>10.4f} "
+              f"{result['seconds']['p50']:>10.4f} {change:>+8.1%}" + ("  REGRESSION" if regressed else ""))
+    return regressions
+
+
+def parse_value(value: str):
+    """ Parameters are ints where possible, strings otherwise. """
+    try:
+        return int(value)
+    except ValueError:
+        return value
+
+
+def parameter_sets(name: str, settings: dict):
+    """
+    Yields each combination of the values given for the parameters of a scenario.
+    :param settings: parameter -> list of values, parameters the scenario does not take are ignored
+    """
+    defaults = SCENARIOS[name][2]
+    keys = [k for k in settings if k in defaults]
+    for values in itertools.product(*(settings[k] for k in keys)):
+        yield dict(zip(keys, values))
+
+
+def main(argv):
+    usage = "bench.py [-r <repeat>] [-w <warmup>] [-s <param>=<value>[,<value>...]] [-o <output>] " \
+            "[-b <baseline>] [-t <threshold>] [-l] [scenario ...]"
+    try:
+        opts, args = getopt.gnu_getopt(argv, "hr:w:s:o:b:t:l")
+    except getopt.GetoptError:
+        print(usage)
+        sys.exit(2)
+    repeat, warmup, threshold = 10, 2, 0.1
+    settings, output, baseline = {}, None, None
+    for opt, arg in opts:
+        if opt == "-h":
+            print(usage)
+            sys.exit()
+        elif opt == "-r":
+            repeat = int(arg)
+        elif opt == "-w":
+            warmup = int(arg)
+        elif opt == "-s":
+            key, _, values = arg.partition("=")
+            settings[key] = [parse_value(v) for v in values.split(",")]
+        elif opt == "-o":
+            output = arg
+        elif opt == "-b":
+            with open(arg) as f:
+                baseline = json.load(f)
+        elif opt == "-t":
+            threshold = float(arg)
+        elif opt == "-l":
+            for name, (function, unit, defaults) in SCENARIOS.items():
+                print(name, unit, " ".join(f"{k}={v}" for k, v in defaults.items()))
+            sys.exit()
+    for name in args:
+        if name not in SCENARIOS:
+            print(f"unknown scenario {name}, one of {', '.join(SCENARIOS)}")
+            sys.exit(2)
+
+    results = []
+    for name in args or SCENARIOS:
+        for params in parameter_sets(name, settings):
+            result = measure(name, params, repeat, warmup)
+            results.append(result)
+            seconds = result["seconds"]
+            print(name, " ".join(f"{k}={v}" for k, v in result["params"].items()),
+                  f"p50 {seconds['p50'] * 1000:.2f}ms p90 {seconds['p90'] * 1000:.2f}ms "
+                  f"p99 {seconds['p99'] * 1000:.2f}ms", f"{result['rate']:.0f} {result['unit']}/s",
+                  f"{result['bytes'] / (1 << 20):.1f}MB" if "bytes" in result else "", flush=True)
+
+    if output is not None:
+        with open(output, "w") as f:
+            json.dump({"version": RESULTS_VERSION, "python": platform.python_version(),
+                       "machine": platform.machine(), "created": time.time(), "results": results}, f, indent=2)
+    if baseline is not None and compare(results, baseline, threshold):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
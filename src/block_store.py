@@ -0,0 +1,352 @@
+import json
+import mmap
+import os
+import struct
+import threading
+import zlib
+from collections import OrderedDict
+from src import wire
+from src.state import Snapshot
+from src.transaction import TransferTxn
+from src.zero_chain import BlockHeader
+
+# A record in a data file: payload length, crc32 of the payload, then the payload.
+_RECORD = struct.Struct(">II")
+# An entry in the index file: the offsets of the header record and of the transactions record of each block.
+_OFFSETS = struct.Struct(">QQ")
+
+
+class StoredSequence:
+    """ A read-only list-like view of one kind of item in a BlockStore. """
+
+    def __init__(self, store, read):
+        self.store = store
+        self.read = read
+
+    def __len__(self):
+        return len(self.store)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.read(i) for i in range(*index.indices(len(self.store)))]
+        if index < 0:
+            index += len(self.store)
+        if not 0 <= index < len(self.store):
+            raise IndexError("block index out of range")
+        return self.read(index)
+
+    def __iter__(self):
+        for i in range(len(self.store)):
+            yield self.read(i)
+
+
+class BlockStore:
+    """
+    Stores the chain in append-only data files and an index of the offsets of their records.
+
+    headers.dat holds one record per block, its header encoded by the wire format.
+    The transactions of the blocks are records in segment files, blocks-<n>.dat
+    holds the ones of the blocks [n * segment_blocks, (n + 1) * segment_blocks).
+    blocks.idx holds the 8 byte offsets of the header record and the transactions
+    record of each block, so the number of blocks and the position of any block
+    are known without reading the data files.
+    Records are written before their index entry, so after a crash only the tail
+    of the files has to be checked. Blocks are only appended after they are
+    verified, so they are not verified again when the store is opened.
+    The files are shared by all threads, so reads and writes hold a lock.
+
+    A pruned store keeps the snapshot of its pruned blocks in snapshot.json, and
+    deletes the segments whose blocks are all pruned, see prune().
+    """
+
+    HEADERS_FILE = "headers.dat"
+    SEGMENT_FILE = "blocks-{}.dat"
+    INDEX_FILE = "blocks.idx"
+    SNAPSHOT_FILE = "snapshot.json"
+    SEGMENT_BLOCKS = 1000  # number of blocks in a segment file
+    HEADER_CACHE = 1 << 12  # number of decoded headers kept in memory, the latest ones are read most
+    OPEN_SEGMENTS = 8  # number of segment files kept open
+
+    def __init__(self, path: str, fsync: bool = False, segment_blocks: int = SEGMENT_BLOCKS):
+        """
+        :param path: the directory of the store, created if it does not exist
+        :param fsync: fsync the files after each append, so blocks survive a power loss
+        :param segment_blocks: the number of blocks in a segment file, it must not change for a store
+        """
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.fsync = fsync
+        self.segment_blocks = segment_blocks
+        self.index = BlockStore._open(os.path.join(path, BlockStore.INDEX_FILE))
+        self.header_file = _DataFile(os.path.join(path, BlockStore.HEADERS_FILE))
+        self._segments = OrderedDict()  # segment number -> _DataFile, the least recently used first
+        self._lock = threading.RLock()  # the file positions and the memory maps are shared
+        self._headers = OrderedDict()  # decoded headers, the least recently used first
+        self.snapshot = self._read_snapshot()  # the Snapshot the blocks before it are pruned to
+        self.recover()
+        self.headers = StoredSequence(self, self.header)
+        self.transactions = StoredSequence(self, self.block_transactions)
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def pruned_segments(self):
+        """ The number of leading segments whose blocks are all pruned, their files are deleted. """
+        return self.snapshot.height // self.segment_blocks if self.snapshot is not None else 0
+
+    def recover(self):
+        """
+        Drops a partly written tail, indexes blocks which were written without their index entry,
+        and deletes the segments a crash left behind.
+        """
+        index_size = os.fstat(self.index.fileno()).st_size
+        self._count = index_size // _OFFSETS.size
+        if index_size % _OFFSETS.size:
+            self._truncate_index(self._count)
+
+        # drop the index entries of blocks whose records are not completely written
+        header_end, txs_end = 0, 0
+        while self._count > 0:
+            ends = self._check_block(self._count - 1)
+            if ends is not None:
+                header_end, txs_end = ends
+                break
+            self._truncate_index(self._count - 1)
+
+        # index the complete blocks after the last indexed one
+        while True:
+            if self._count % self.segment_blocks == 0:
+                txs_end = 0  # the block starts a new segment
+            header_next = self.header_file.check(header_end)
+            if header_next is None:
+                break
+            n = self._count // self.segment_blocks
+            if n < self.pruned_segments:
+                txs_next = 0  # the segment is deleted, only the header is left
+            else:
+                txs_next = self._segment(n).check(txs_end)
+                if txs_next is None:
+                    break
+            self._write_index(header_end, txs_end)
+            header_end, txs_end = header_next, txs_next
+        self.header_file.truncate(header_end)
+        tail = self._count // self.segment_blocks
+        self._segment(tail).truncate(txs_end)
+        for n in self._segment_numbers():
+            if n > tail or n < self.pruned_segments:
+                self._remove_segment(n)
+
+    def append(self, block_header, transactions: list):
+        """ Appends a verified block, transactions is None for a block synced without them, which is pruned next. """
+        header_payload, txs_payload = bytearray(), bytearray()
+        wire.encode_header(block_header.to_json(), header_payload)
+        wire.encode_transactions(transactions if transactions is not None else [], txs_payload)
+        with self._lock:
+            txs_offset = self._segment(self._count // self.segment_blocks).append(txs_payload, self.fsync)
+            header_offset = self.header_file.append(header_payload, self.fsync)
+            self._cache(self._count, block_header)
+            self._write_index(header_offset, txs_offset)
+
+    def truncate(self, height: int):
+        """ Removes all blocks from the given height on. """
+        with self._lock:
+            if height >= self._count:
+                return
+            header_offset, txs_offset = self._offsets(height)
+            last = (self._count - 1) // self.segment_blocks
+            self._truncate_index(height)
+            self.header_file.truncate(header_offset)
+            self._segment(height // self.segment_blocks).truncate(txs_offset)
+            for n in range(height // self.segment_blocks + 1, last + 1):
+                self._remove_segment(n)
+            for i in [i for i in self._headers if i >= height]:
+                del self._headers[i]
+
+    def prune(self, snapshot):
+        """
+        Drops the transactions of the blocks before the snapshot, the headers are kept.
+
+        The snapshot is written first, then the segments whose blocks are all before it
+        are deleted. A segment which is only partly pruned keeps its file until the
+        snapshot passes its end, the transactions of its pruned blocks are not read.
+        A crash leaves a complete store, the segments which were not deleted yet are
+        deleted when it is opened.
+        """
+        with self._lock:
+            start = self.pruned_segments
+            self._write_snapshot(snapshot)
+            self.snapshot = snapshot
+            for n in range(start, self.pruned_segments):
+                self._remove_segment(n)
+
+    def header(self, height: int):
+        with self._lock:
+            block_header = self._headers.get(height)
+            if block_header is None:
+                if height >= self._count:
+                    raise IndexError("block index out of range")
+                header, _ = wire.decode_header(self.header_file.read(self._offsets(height)[0]), 0)
+                block_header = BlockHeader.from_json(header)
+                self._cache(height, block_header)
+            else:
+                self._headers.move_to_end(height)
+            return block_header
+
+    def block_transactions(self, height: int):
+        """ :returns the transactions of the block, None if they are pruned """
+        if self.snapshot is not None and height < self.snapshot.height:
+            return None
+        with self._lock:
+            if height >= self._count:
+                raise IndexError("block index out of range")
+            payload = self._segment(height // self.segment_blocks).read(self._offsets(height)[1])
+        # we may need to take care of other types of transactions later
+        txs, _ = wire.decode_transactions(payload, 0, TransferTxn)
+        return txs
+
+    def close(self):
+        with self._lock:
+            for segment in self._segments.values():
+                segment.close()
+            self._segments.clear()
+            self.header_file.close()
+            self.index.close()
+
+    def _cache(self, height: int, block_header):
+        self._headers[height] = block_header
+        if len(self._headers) > self.HEADER_CACHE:
+            self._headers.popitem(last=False)
+
+    def _segment(self, n: int):
+        """ Returns segment n, its file is opened or created on demand, and closed when unused for long. """
+        segment = self._segments.get(n)
+        if segment is not None:
+            self._segments.move_to_end(n)
+            return segment
+        segment = self._segments[n] = _DataFile(os.path.join(self.path, BlockStore.SEGMENT_FILE.format(n)))
+        if len(self._segments) > self.OPEN_SEGMENTS:
+            self._segments.popitem(last=False)[1].close()
+        return segment
+
+    def _remove_segment(self, n: int):
+        segment = self._segments.pop(n, None)
+        if segment is not None:
+            segment.close()
+        filename = os.path.join(self.path, BlockStore.SEGMENT_FILE.format(n))
+        if os.path.exists(filename):
+            os.remove(filename)
+
+    def _segment_numbers(self):
+        """ :returns the numbers of the segment files on disk """
+        prefix, suffix = BlockStore.SEGMENT_FILE.split("{}")
+        return sorted(int(name[len(prefix):-len(suffix)]) for name in os.listdir(self.path)
+                      if name.startswith(prefix) and name.endswith(suffix) and name[len(prefix):-len(suffix)].isdigit())
+
+    def _check_block(self, height: int):
+        """ :returns the ends of the header and transactions records of a block, None if one is incomplete """
+        header_offset, txs_offset = self._offsets(height)
+        header_end = self.header_file.check(header_offset)
+        if header_end is None:
+            return None
+        if height // self.segment_blocks < self.pruned_segments:
+            return header_end, 0  # the segment is deleted, the next block starts a new one
+        txs_end = self._segment(height // self.segment_blocks).check(txs_offset)
+        if txs_end is None:
+            return None
+        return header_end, txs_end
+
+    def _read_snapshot(self):
+        filename = os.path.join(self.path, BlockStore.SNAPSHOT_FILE)
+        if not os.path.exists(filename):
+            return None
+        with open(filename) as f:
+            return Snapshot.from_json(json.load(f))
+
+    def _write_snapshot(self, snapshot):
+        """ Replaces the snapshot file in one step, so a crash leaves the old or the new snapshot. """
+        filename = os.path.join(self.path, BlockStore.SNAPSHOT_FILE)
+        with open(filename + ".tmp", "w") as f:
+            json.dump(snapshot.to_json(), f, sort_keys=True)
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+        os.replace(filename + ".tmp", filename)
+
+    @staticmethod
+    def _open(filename: str):
+        """ Opens a file for random reads and writes, creating it if it does not exist. """
+        return os.fdopen(os.open(filename, os.O_RDWR | os.O_CREAT, 0o644), "r+b")
+
+    def _offsets(self, height: int):
+        self.index.seek(height * _OFFSETS.size)
+        return _OFFSETS.unpack(self.index.read(_OFFSETS.size))
+
+    def _write_index(self, header_offset: int, txs_offset: int):
+        self.index.seek(self._count * _OFFSETS.size)
+        self.index.write(_OFFSETS.pack(header_offset, txs_offset))
+        self.index.flush()
+        if self.fsync:
+            os.fsync(self.index.fileno())
+        self._count += 1
+
+    def _truncate_index(self, count: int):
+        self.index.truncate(count * _OFFSETS.size)
+        self._count = count
+
+
+class _DataFile:
+    """ An append-only file of records, read through a memory map. The BlockStore lock guards it. """
+
+    def __init__(self, filename: str):
+        self.file = BlockStore._open(filename)
+        self.size = os.fstat(self.file.fileno()).st_size  # the end of the last record
+        self._map = None
+
+    def append(self, payload: bytes, fsync: bool):
+        """ :returns the offset of the new record """
+        offset = self.size
+        self.file.seek(offset)
+        self.file.write(_RECORD.pack(len(payload), zlib.crc32(payload)))
+        self.file.write(payload)
+        self.file.flush()
+        if fsync:
+            os.fsync(self.file.fileno())
+        self.size = offset + _RECORD.size + len(payload)
+        return offset
+
+    def read(self, offset: int):
+        """ :returns the payload of the record at offset """
+        if self._map is None or len(self._map) < offset + _RECORD.size:
+            # the file grew since it was mapped
+            self._close_map()
+            self._map = mmap.mmap(self.file.fileno(), self.size, access=mmap.ACCESS_READ)
+        size, _ = _RECORD.unpack_from(self._map, offset)
+        return self._map[offset + _RECORD.size:offset + _RECORD.size + size]
+
+    def check(self, offset: int):
+        """ :returns the end of the record at offset, None if it is incomplete or corrupt """
+        data_size = os.fstat(self.file.fileno()).st_size
+        if offset + _RECORD.size > data_size:
+            return None
+        self.file.seek(offset)
+        size, crc = _RECORD.unpack(self.file.read(_RECORD.size))
+        if offset + _RECORD.size + size > data_size:
+            return None
+        if zlib.crc32(self.file.read(size)) != crc:
+            return None
+        return offset + _RECORD.size + size
+
+    def truncate(self, size: int):
+        self._close_map()
+        self.file.truncate(size)
+        self.size = size
+
+    def close(self):
+        self._close_map()
+        self.file.close()
+
+    def _close_map(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
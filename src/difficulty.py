@@ -0,0 +1,84 @@
+import math
+import time
+
+
+def now_ms():
+    """ Returns the current time in milliseconds, the unit of block timestamps. """
+    return int(time.time() * 1000)
+
+
+class DifficultySchedule:
+    """
+    Retargets the pow difficulty of a chain toward a target block interval.
+
+    The difficulty is the number of leading zero bits of the block hash, so one
+    step doubles or halves the expected work. Every `window` blocks, the time
+    the last window of blocks took is compared with the target, and the
+    difficulty moves by the log2 of the ratio, at most max_step bits at once.
+    Other blocks keep the difficulty of the block before them. The difficulty
+    of every block follows from the blocks before it, so every node can check it.
+    """
+
+    def __init__(self, initial: int = 8, target_interval: float = 1.0, window: int = 16, max_step: int = 2,
+                 minimum: int = 1, maximum: int = 256, max_drift: float = 120.0):
+        """
+        :param initial: the difficulty of the blocks before the first retarget
+        :param target_interval: the target seconds between two blocks
+        :param window: number of blocks between two retargets
+        :param max_step: max number of bits the difficulty moves by at one retarget
+        :param minimum: the lowest difficulty
+        :param maximum: the highest difficulty
+        :param max_drift: max seconds a block timestamp may be ahead of the local clock
+        """
+        if window < 2:
+            raise ValueError("the window must have at least 2 blocks")
+        self.initial = initial
+        self.target_interval = target_interval
+        self.window = window
+        self.max_step = max_step
+        self.minimum = minimum
+        self.maximum = maximum
+        self.max_drift = max_drift
+
+    def difficulty(self, height: int, header_at):
+        """
+        Returns the difficulty the block at the given height must have.
+        :param header_at: a function that returns the header of the chain at a lower height
+        """
+        if height == 0:
+            return self.initial
+        previous = header_at(height - 1)
+        if height % self.window != 0:
+            return previous.difficulty
+        # the window has window - 1 intervals between its first and last block, the genesis block
+        # has a fixed timestamp so the first window starts after it
+        first = max(height - self.window, 1)
+        if first >= height - 1:
+            return previous.difficulty
+        timespan = previous.timestamp - header_at(first).timestamp
+        expected = (height - 1 - first) * self.target_interval * 1000
+        step = round(math.log2(expected / max(timespan, 1)))
+        step = max(-self.max_step, min(self.max_step, step))
+        return max(self.minimum, min(self.maximum, previous.difficulty + step))
+
+    def timestamp(self, previous_header=None):
+        """ Returns the timestamp of a new block, which is never before the previous block. """
+        if previous_header is None:
+            return now_ms()
+        return max(now_ms(), previous_header.timestamp)
+
+    def check(self, block_header, header_at, now: int = None):
+        """
+        Checks the difficulty and the timestamp of a block against the schedule.
+        :param header_at: a function that returns the header of the chain at a lower height
+        :param now: the current time in milliseconds
+        :returns why the block does not follow the schedule, "" if it does
+        """
+        height = block_header.height
+        if block_header.difficulty != self.difficulty(height, header_at):
+            return "difficulty does not follow the schedule"
+        if height > 0 and block_header.timestamp < header_at(height - 1).timestamp:
+            return "timestamp is before the previous block"
+        if block_header.timestamp > (now_ms() if now is None else now) + self.max_drift * 1000:
+            return "timestamp is too far in the future"
+        return ""
@@ -0,0 +1,127 @@
+from src import transaction
+from src.util import Hasher
+from src.zero_chain import ZeroChain
+from src.zero_merkle import verify_proof
+
+
+class LightChainError(Exception):
+    """ Raised for what only a full node can do, e.g. mining or reading balances. """
+    pass
+
+
+class HeaderStore(object):
+    """
+    Keeps only the block headers of a chain, the transactions of each block are dropped.
+    """
+    def __init__(self):
+        self.headers = []  # a list of BlockHeader objects, one for each block
+        self.snapshot = None  # a light chain is never pruned, it has no transactions to prune
+
+    def __len__(self):
+        return len(self.headers)
+
+    def append(self, block_header, transactions: list = ()):
+        self.headers.append(block_header)
+
+    def truncate(self, height: int):
+        """ Removes all blocks from the given height on. """
+        del self.headers[height:]
+
+
+class LightChain(ZeroChain):
+    """
+    A chain of block headers only, for nodes that do not need the whole history.
+
+    Syncing downloads and verifies the headers of the longest chain, i.e. their
+    heights, hash links, pows and difficulties, but no transactions. A transaction
+    is checked on demand instead: a full node sends it with a merkle proof, and
+    the proof must lead to the transaction_root of the verified header of its
+    block, so the full node does not have to be trusted. A light chain can not
+    mine blocks, take transfers or tell balances, which need every transaction.
+    """
+    light = True
+
+    def __init__(self, schedule=None):
+        """
+        :param schedule: the DifficultySchedule of the network the headers must follow
+        """
+        # the genesis block is replaced by the one of the network at the first sync
+        super().__init__(store=HeaderStore(), schedule=schedule)
+
+    def sync_self(self):
+        """
+        Replaces the headers with the longest valid chain of headers in the network.
+        Only the headers after the fork point are downloaded, from full or light nodes.
+        :return: True if current chain is replaced otherwise False
+        """
+        synced = self.sync_headers()
+        if synced is None:
+            return False
+        _, fork, headers = synced
+        with self.lock:
+            if not self.extends_chain(fork, headers):
+                return False
+            self.replace_blocks(fork, headers, [()] * len(headers))
+        return True
+
+    def update_state(self):
+        """ Indexes the block hashes of the headers that are not indexed yet, there are no transactions to index. """
+        with self.lock:
+            for height in range(self.index.height, self.block_height):
+                self.index.apply_block(self.block_headers[height], ())
+
+    def find_transaction(self, txid: str):
+        """
+        Asks the full nodes for a transaction, and verifies the merkle proof of the first one that has it.
+        :returns (height, position, transaction, merkle proof), None if no full node proves it is in the chain
+        """
+        nodes = self.full_nodes
+        if not nodes:
+            self.longest_node()  # learn which nodes are full nodes
+            nodes = self.full_nodes
+        for response in self.peers.get_all(nodes, f"/tx/{txid}").values():
+            if response is None:
+                continue
+            try:
+                found = response.json()
+                height, position, proof = found["height"], found["position"], found["proof"]
+                # we may need to take care of other types of transactions later
+                txn = transaction.TransferTxn.from_json(found["transaction"])
+                if self.verify_transaction(txid, txn, height, proof):
+                    return height, position, txn, proof
+            except (ValueError, KeyError, TypeError):
+                continue  # a malformed answer
+        return None
+
+    def verify_transaction(self, txid: str, txn, height: int, proof: list):
+        """
+        Checks that a transaction has the given hash, and is in the block at the given height of this chain.
+        :param proof: the merkle proof of the transaction, see zero_merkle.verify_proof
+        :returns True if the proof leads to the transaction_root of the block
+        """
+        if type(height) is not int:
+            return False
+        with self.lock:
+            if not 0 <= height < self.block_height:
+                return False
+            root = self.block_headers[height].transaction_root
+        return Hasher.object_hash(txn) == txid and verify_proof(txn, proof, root)
+
+    def block_template(self):
+        raise LightChainError("a light chain can not mine blocks")
+
+    def transfer(self, sender, receiver, amount):
+        raise LightChainError("a light chain does not take transfers")
+
+    def transfer_many(self, transfers):
+        raise LightChainError("a light chain does not take transfers")
+
+    def balance(self, account: str):
+        raise LightChainError("a light chain has no balances")
+
+    def history(self, account: str):
+        raise LightChainError("a light chain has no transactions")
+
+    @property
+    def transactions(self):
+        raise LightChainError("a light chain has no transactions")
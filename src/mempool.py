@@ -0,0 +1,219 @@
+import hashlib
+import heapq
+import itertools
+from collections import OrderedDict
+from src import wire
+from src.util import Hasher
+from src.zero_merkle import ROOT_VERSION, ZeroMerkleAccumulator, transaction_root
+
+
+class MempoolError(ValueError):
+    pass
+
+
+class MempoolFullError(MempoolError):
+    pass
+
+
+def amount_priority(txn):
+    """ Ranks transfers by their amount, as transactions carry no fee. An amount which is not a number ranks last. """
+    try:
+        return int(txn.amount)
+    except (TypeError, ValueError, OverflowError):
+        return float("-inf")
+
+
+class Mempool:
+    """
+    The pending transactions, deduplicated by hash and bounded in count and bytes.
+
+    Transactions are kept in arrival order. Without a priority function the
+    pool is first come first served: blocks take the oldest transactions and
+    a full pool evicts its oldest transaction for a new one, or rejects the
+    new one with eviction="reject". With a priority function blocks take the
+    highest priority transactions, and a full pool evicts its lowest priority
+    transaction for a higher priority one.
+    """
+
+    # what a full pool does without a priority function
+    EVICTIONS = ("oldest", "reject")
+
+    def __init__(self, max_count: int = 100000, max_bytes: int = 64 << 20, priority=None,
+                 root_version: int = ROOT_VERSION, max_txn_bytes: int = 4 << 20, eviction: str = "oldest"):
+        """
+        :param max_count: max number of pending transactions
+        :param max_bytes: max total size of the json of pending transactions
+        :param max_txn_bytes: max size of the json of a transaction, at most the max block size
+                              or the transaction could never be mined
+        :param priority: a function from a transaction to a number, higher is included first
+        :param root_version: the version of the transaction roots of new blocks
+        :param eviction: one of EVICTIONS, used when there is no priority function
+        """
+        if eviction not in Mempool.EVICTIONS:
+            raise ValueError(f"unknown eviction: {eviction}")
+        self.max_count = max_count
+        self.max_bytes = max_bytes
+        self.max_txn_bytes = max_txn_bytes
+        self.priority = priority
+        self.eviction = eviction
+        self.root_version = root_version
+        self.transactions = OrderedDict()  # txid -> transaction, in arrival order
+        self.sizes = {}  # txid -> size of the json of the transaction
+        self.size_bytes = 0
+        self._order = itertools.count()  # breaks priority ties by arrival
+        self._heap = []  # (priority, arrival, txid) of pending transactions, lowest first, with removed ones
+        # merkle root of all pending transactions in arrival order, None when it has to be rebuilt
+        self._tree = ZeroMerkleAccumulator(version=root_version)
+        # merkle root of the transactions which arrived since the whole pool was last put in a block,
+        # the root of the pool once that block removes the others, see remove()
+        self._tail = None
+        self._tail_first = None  # the txid of the first of them
+
+    def __len__(self):
+        return len(self.transactions)
+
+    def __iter__(self):
+        return iter(self.transactions.values())
+
+    def __contains__(self, txid: str):
+        return txid in self.transactions
+
+    def get(self, txid: str):
+        return self.transactions[txid]
+
+    def add(self, txn):
+        """
+        Adds a transaction to the pool.
+        :returns the hash of the transaction
+        :raises MempoolError if the transaction is a duplicate or can not be stored in a block,
+                MempoolFullError if the pool is full
+        """
+        data = Hasher.encode(txn)
+        txid = hashlib.sha256(data).hexdigest()
+        if txid in self.transactions:
+            raise MempoolError("duplicate transaction")
+        if len(data) > min(self.max_bytes, self.max_txn_bytes):
+            raise MempoolError("transaction too large")
+        try:
+            # blocks are sent and stored in the wire format, a transaction it can not hold would stall mining
+            wire.encode_transaction(txn.to_json(), bytearray())
+        except (wire.WireError, KeyError) as e:
+            raise MempoolError(f"transaction can not be encoded: {e}") from None
+
+        priority = self.priority(txn) if self.priority is not None else 0
+        while len(self.transactions) >= self.max_count or self.size_bytes + len(data) > self.max_bytes:
+            if not self._evict(priority):
+                raise MempoolFullError("mempool is full")
+
+        self.transactions[txid] = txn
+        self.sizes[txid] = len(data)
+        self.size_bytes += len(data)
+        if self.priority is not None:
+            heapq.heappush(self._heap, (priority, next(self._order), txid))
+        if self._tree is not None:
+            self._tree.append(txn)
+        if self._tail is not None:
+            if not self._tail:
+                self._tail_first = txid
+            self._tail.append(txn)
+        return txid
+
+    def add_many(self, txns):
+        """
+        Adds transactions to the pool, a rejected transaction does not stop the others.
+        :returns a list of (txid, None) for each added transaction, (None, error) for each rejected one
+        """
+        results = []
+        for txn in txns:
+            try:
+                results.append((self.add(txn), None))
+            except MempoolError as e:
+                results.append((None, str(e)))
+        return results
+
+    def _evict(self, priority):
+        """
+        Removes the lowest priority transaction if it is lower than the given priority,
+        or the oldest one without a priority function.
+        :returns False if no transaction may be evicted
+        """
+        if self.priority is None:
+            if self.eviction == "reject" or not self.transactions:
+                return False
+            self._discard(next(iter(self.transactions)))
+        else:
+            while self._heap and self._heap[0][2] not in self.transactions:
+                heapq.heappop(self._heap)  # drop the entries of removed transactions
+            if not self._heap or self._heap[0][0] >= priority:
+                return False
+            self._discard(heapq.heappop(self._heap)[2])
+        # a full pool is larger than a block, so its whole root is not needed until blocks take most of it
+        self._tree = None
+        return True
+
+    def select(self, max_count: int, max_bytes: int):
+        """
+        Picks the transactions of the next block, highest priority first.
+        :returns the list of txids, the transactions stay pending until removed
+        """
+        if self.priority is None:
+            candidates = iter(self.transactions)
+        else:
+            # highest priority first, earlier arrival first on ties
+            ranked = (((self.priority(txn), -i), txid) for i, (txid, txn) in enumerate(self.transactions.items()))
+            candidates = (txid for _, txid in heapq.nlargest(max_count, ranked))
+        selected = []
+        size = 0
+        for txid in candidates:
+            if len(selected) >= max_count:
+                break
+            if size + self.sizes[txid] > max_bytes:
+                continue  # a smaller one after it may still fit
+            selected.append(txid)
+            size += self.sizes[txid]
+        return selected
+
+    def root_hash(self, txids: list, executor = None):
+        """
+        Returns the transaction root of the given transactions.
+        The root of the whole pool in arrival order is maintained as transactions arrive.
+        :param executor: a long-lived process pool to hash a large tree in, see merkle_root
+        """
+        if len(txids) == len(self.transactions) and txids == list(self.transactions):
+            if self._tree is None:
+                self._tree = ZeroMerkleAccumulator(self.transactions.values(), self.root_version)
+            # the transactions arriving while the block is mined are the pool once the block is added
+            self._tail, self._tail_first = ZeroMerkleAccumulator(version=self.root_version), None
+            return self._tree.root_hash
+        return transaction_root([self.transactions[txid] for txid in txids], self.root_version, executor=executor)
+
+    def remove(self, txids: list):
+        """
+        Removes transactions, e.g. the ones included in a block.
+        When a block takes the whole pool, the root of the pool continues from the root of the
+        transactions which arrived meanwhile. When it takes part of a larger pool, the root of
+        the rest is rebuilt once a block takes the whole pool, not after every block.
+        """
+        removed = 0
+        for txid in txids:
+            if txid in self.transactions:
+                self._discard(txid)
+                removed += 1
+        if not removed:
+            return
+        tail = self._tail
+        if not self.transactions:
+            self._tree = ZeroMerkleAccumulator(version=self.root_version)
+        elif tail is not None and len(tail) == len(self.transactions) and \
+                next(iter(self.transactions)) == self._tail_first:
+            self._tree = tail  # the ones left are exactly the ones which arrived after the block was built
+        else:
+            self._tree = None
+        self._tail, self._tail_first = None, None
+        if len(self._heap) > 2 * len(self.transactions) + 64:
+            self._heap = [e for e in self._heap if e[2] in self.transactions]
+            heapq.heapify(self._heap)
+
+    def _discard(self, txid: str):
+        del self.transactions[txid]
+        self.size_bytes -= self.sizes.pop(txid)
@@ -0,0 +1,276 @@
+import sys
+import collections
+import math
+import threading
+import time
+
+# The content type of the Prometheus text format
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Latency buckets in seconds, from 100us to 30s
+LATENCY_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0)
+
+
+class Registry:
+    """
+    Holds the metrics of a node, and renders them in the Prometheus text format.
+
+    Metrics are disabled by default. While disabled, updating a metric only checks
+    the enabled flag, so the hot paths keep their instrumentation at no real cost.
+    Gauges with a function are read when the metrics are rendered, so they work either way.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.metrics = {}  # name -> metric, in registration order
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        """ Adds a metric, or returns the metric of the same name which is already registered. """
+        with self._lock:
+            return self.metrics.setdefault(metric.name, metric)
+
+    def render(self):
+        """ :returns the metrics in the Prometheus text format """
+        lines = []
+        for metric in list(self.metrics.values()):
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        for metric in self.metrics.values():
+            metric.reset()
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = ""):
+    pairs = [f'{n}="{_escape(str(v))}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    type = "untyped"
+
+    def __init__(self, registry: Registry, name: str, help: str, labels: tuple = ()):
+        """
+        :param labels: the names of the labels, each update gives their values in the same order
+        """
+        self.registry = registry
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.values = {}  # label values -> value
+
+
+class Counter(Metric):
+    """ A value which only goes up, e.g. the number of hashes tried. """
+    type = "counter"
+
+    def inc(self, amount=1, labels: tuple = ()):
+        if not self.registry.enabled:
+            return
+        with self._lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self.values)
+        return [f"{self.name}{_format_labels(self.labels, k)} {_format_value(v)}" for k, v in values.items()]
+
+
+class Gauge(Metric):
+    """ A value which goes up and down, set directly or read from a function when rendered. """
+    type = "gauge"
+
+    def __init__(self, registry: Registry, name: str, help: str, labels: tuple = (), function=None):
+        """
+        :param function: returns the value when the metrics are rendered
+        """
+        super().__init__(registry, name, help, labels)
+        self.function = function
+
+    def set(self, value, labels: tuple = ()):
+        if not self.registry.enabled:
+            return
+        self.values[labels] = value
+
+    def samples(self):
+        values = dict(self.values)
+        if self.function is not None:
+            try:
+                values = {(): self.function()}
+            except Exception:
+                values = {}  # a failing gauge must not break the whole page
+        return [f"{self.name}{_format_labels(self.labels, k)} {_format_value(v)}" for k, v in values.items()]
+
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class _Timer:
+    __slots__ = ("histogram", "labels", "start")
+
+    def __init__(self, histogram, labels: tuple):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, self.labels)
+        return False
+
+
+class Histogram(Metric):
+    """ Counts observed values, e.g. latencies, in buckets of upper bounds. """
+    type = "histogram"
+
+    def __init__(self, registry: Registry, name: str, help: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        super().__init__(registry, name, help, labels)
+
+    def observe(self, value: float, labels: tuple = ()):
+        if not self.registry.enabled:
+            return
+        with self._lock:
+            counts = self.values.get(labels)
+            if counts is None:
+                # a count for each bucket, then the sum of the values
+                counts = self.values[labels] = [0] * len(self.buckets) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            counts[-1] += value
+
+    def time(self, labels: tuple = ()):
+        """ Returns a context manager which observes the seconds its block takes. """
+        if not self.registry.enabled:
+            return _NULL_TIMER
+        return _Timer(self, labels)
+
+    def samples(self):
+        lines = []
+        with self._lock:
+            values = {k: list(v) for k, v in self.values.items()}
+        for key, counts in values.items():
+            total = 0
+            for bound, count in zip(self.buckets, counts):
+                total += count
+                le = 'le="' + _format_value(bound) + '"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, le)} {total}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {_format_value(counts[-1])}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {total}")
+        return lines
+
+
+# The metrics of this process
+REGISTRY = Registry()
+
+
+def counter(name: str, help: str, labels: tuple = ()):
+    return REGISTRY.register(Counter(REGISTRY, name, help, labels))
+
+
+def gauge(name: str, help: str, labels: tuple = (), function=None):
+    metric = REGISTRY.register(Gauge(REGISTRY, name, help, labels))
+    if function is not None:
+        metric.function = function
+    return metric
+
+
+def histogram(name: str, help: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+    return REGISTRY.register(Histogram(REGISTRY, name, help, labels, buckets))
+
+
+class SamplingProfiler:
+    """
+    Samples the stacks of all threads of a live process at a fixed interval.
+
+    The samples are counted by stack, and reported in the collapsed format of
+    flame graph tools: one line of "outer;inner;...;innermost count" per stack.
+    Nothing is traced between samples, so the node runs at full speed, and the
+    cost is one walk over the thread stacks per interval.
+    """
+
+    def __init__(self, interval: float = 0.005, max_depth: int = 64):
+        """
+        :param interval: seconds between two samples
+        :param max_depth: number of innermost frames kept of each stack
+        """
+        self.interval = interval
+        self.max_depth = max_depth
+        self.samples = 0
+        self.stacks = collections.Counter()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """ Starts sampling, does nothing if it is already running. Earlier samples are kept. """
+        if self.running:
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def clear(self):
+        self.samples = 0
+        self.stacks = collections.Counter()
+
+    def report(self, limit: int = None):
+        """ :returns the collapsed stacks, the most sampled first """
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common(limit))
+
+    def status(self):
+        return {"running": self.running, "interval": self.interval, "samples": self.samples,
+                "stacks": len(self.stacks)}
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stopping.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < self.max_depth:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
@@ -0,0 +1,228 @@
+import multiprocessing
+import os
+import threading
+import time
+from src.util import PrefixHasher
+
+
+def meets_difficulty(header_hash: str, difficulty: int):
+    """
+    Checks if a header hash satisfies the given pow difficulty.
+    :param header_hash: the hex digest of the block header
+    :param difficulty: number of leading zero bits required
+    :returns True if the hash is a valid pow.
+    """
+    # whole hex characters first, they reject most hashes without converting them
+    zeros, bits = divmod(difficulty, 4)
+    if header_hash[:zeros] != "0" * zeros:
+        return False
+    return bits == 0 or int(header_hash[zeros], 16) < (16 >> bits)
+
+
+# The following are executed inside the worker processes.
+
+_found = None   # the smallest valid nonce found so far, shared by all workers
+_cancel = None  # set by the parent process to abort the current search
+
+
+def _init_worker(found, cancel):
+    global _found, _cancel
+    _found = found
+    _cancel = cancel
+
+
+def _search_range(block_header, start: int, stop: int, check_every: int):
+    """
+    Searches [start, stop) for the first nonce that makes block_header a valid pow.
+    :returns (nonce or None, number of attempted nonces)
+    """
+    hasher = PrefixHasher(block_header)
+    difficulty = block_header.difficulty
+    nonce = start
+    while nonce < stop:
+        # a smaller valid nonce has been found by another worker, or the search is cancelled
+        if _found.value <= nonce or _cancel.is_set():
+            break
+        for nonce in range(nonce, min(nonce + check_every, stop)):
+            if meets_difficulty(hasher.hash(nonce), difficulty):
+                with _found.get_lock():
+                    if nonce < _found.value:
+                        _found.value = nonce
+                return nonce, nonce - start + 1
+        nonce += 1
+    return None, nonce - start
+
+
+class ParallelMiner:
+    """
+    Searches the nonce space of a block header with a pool of worker processes.
+
+    The nonce space is cut into chunks which are handed to the workers in order.
+    Workers stop as soon as a smaller valid nonce is known, so the result is
+    always the smallest valid nonce, i.e. the same one the serial loop finds.
+    """
+
+    # a nonce that is larger than any nonce we will ever search
+    NO_NONCE = (1 << 63) - 1
+
+    def __init__(self, workers: int = None, chunk_size: int = 1 << 14, check_every: int = 1 << 10):
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        self.check_every = check_every
+        self.attempts = 0  # number of nonces tried by the last search
+        self._found = multiprocessing.Value("q", self.NO_NONCE)
+        self._cancel = multiprocessing.Event()
+        self._pool = None
+        self.waiting = 0  # number of threads waiting for the running search to finish
+        self._lock = threading.Lock()  # one search at a time, the workers share _found
+        self._waiting_lock = threading.Lock()
+
+    @property
+    def pool(self):
+        if self._pool is None:
+            self._pool = multiprocessing.Pool(self.workers, initializer=_init_worker,
+                                              initargs=(self._found, self._cancel))
+        return self._pool
+
+    def mine(self, block_header, timeout: float = None, stop=None):
+        """
+        Runs pow on block_header, and sets block_header.nonce to the first valid nonce.
+        :param block_header: the header to mine, the search starts from block_header.nonce
+        :param timeout: seconds to search before giving up, None to search until found
+        :param stop: a function which is called after each chunk, the search is dropped if it returns True
+        :returns True if a valid nonce was found, False if cancelled, stopped or timed out.
+        Searches from several threads run one after another.
+        """
+        with self._waiting_lock:
+            self.waiting += 1
+        with self._lock:
+            with self._waiting_lock:
+                self.waiting -= 1
+            return self._mine(block_header, timeout, stop)
+
+    def _mine(self, block_header, timeout: float, stop):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        self._found.value = self.NO_NONCE
+        self._cancel.clear()
+        self.attempts = 0
+
+        start = block_header.nonce
+        pending = []  # the chunks submitted to the pool, in nonce order
+        while True:
+            # keep every worker busy with one more chunk in the queue
+            while len(pending) < self.workers * 2:
+                pending.append(self.pool.apply_async(
+                    _search_range, (block_header, start, start + self.chunk_size, self.check_every)))
+                start += self.chunk_size
+
+            result = pending.pop(0)
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                nonce, attempts = result.get(remaining)
+            except multiprocessing.TimeoutError:
+                self._stop([result] + pending)
+                return False
+            self.attempts += attempts
+
+            if nonce is not None:
+                # all earlier chunks are done without a valid nonce, so this is the smallest one
+                self._stop(pending)
+                block_header.nonce = nonce
+                return True
+            if self._cancel.is_set() or (stop is not None and stop()):
+                self._stop(pending)
+                return False
+
+    def cancel(self):
+        """ Aborts the running search, mine() returns False. """
+        self._cancel.set()
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+
+    def _stop(self, pending):
+        self._cancel.set()
+        for result in pending:
+            result.wait()
+            self.attempts += result.get()[1]
+
+
+class BackgroundMiner:
+    """
+    Mines blocks of the pending transactions of a ZeroChain in a thread, until stopped.
+
+    The nonce search is dropped as soon as the tip of the chain changes, since
+    the block could no longer be added. It is also dropped when a batch of
+    transactions arrives and the block being mined has all pending ones, so the
+    next round includes the new batch. A round also gives way to a block mined
+    by a request on the same ParallelMiner. Empty blocks are not mined unless asked.
+    """
+
+    def __init__(self, chain, mine_empty: bool = False, idle: float = 0.1):
+        """
+        :param chain: the ZeroChain to mine blocks for
+        :param mine_empty: mine blocks when there are no pending transactions
+        :param idle: seconds to wait before checking an empty pool again
+        """
+        self.chain = chain
+        self.mine_empty = mine_empty
+        self.idle = idle
+        self.blocks = 0  # number of blocks mined
+        self.dropped = 0  # number of searches dropped for a new tip or a new batch
+        self.error = None  # the last error a round failed with
+        self._stopping = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """ Starts mining in the background, does nothing if it is already running. """
+        if self.running:
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="background-miner", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = None):
+        """ Stops mining, the search in progress is dropped. """
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def status(self):
+        return {"running": self.running, "blocks": self.blocks, "dropped": self.dropped, "error": self.error}
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                self._round()
+            except Exception as e:
+                # e.g. a block that can not be stored, keep mining the next rounds
+                self.error = f"{type(e).__name__}: {e}"
+                self._stopping.wait(self.idle)
+
+    def _round(self):
+        """ Mines one block, or waits when there is nothing to mine. """
+        chain = self.chain
+        if not self.mine_empty and len(chain.mempool) == 0:
+            self._stopping.wait(self.idle)
+            return
+        tip_version, pool_version = chain.tip_version, chain.pool_version
+        block_header, transactions, txids = chain.block_template()
+        # when the block has every pending transaction, a new batch would be part of the next template
+        has_all = len(txids) == len(chain.mempool)
+
+        def stale():
+            return self._stopping.is_set() or chain.tip_version != tip_version or \
+                (has_all and chain.pool_version != pool_version) or \
+                (chain.miner is not None and chain.miner.waiting > 0)
+
+        if chain.run_pow(block_header, stop=stale) and chain.add_block(block_header, transactions, txids):
+            self.blocks += 1
+        elif not self._stopping.is_set():
+            self.dropped += 1
@@ -0,0 +1,92 @@
+import concurrent.futures
+import json
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from src import metrics
+
+# The media type of a stream of json values, one per line
+NDJSON = "application/x-ndjson"
+
+# the latency of each peer, recorded when metrics are enabled
+PEER_SECONDS = metrics.histogram("zerochain_peer_request_seconds", "Seconds until a peer answers a request",
+                                 ("peer", "path"))
+PEER_ERRORS = metrics.counter("zerochain_peer_errors_total", "Requests a peer did not answer with 200",
+                              ("peer", "path"))
+
+
+class PeerClient:
+    """
+    Sends requests to peers over one pooled HTTP session.
+
+    Every request has a timeout, and a failed or slow peer only fails its own
+    request. Requests to many peers are sent concurrently by a bounded thread pool.
+    """
+
+    def __init__(self, timeout: float = 5.0, max_workers: int = 16):
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+        self.session.mount("http://", adapter)
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers)
+
+    def get(self, node: str, path: str, params: dict = None, timeout: float = None, stream: bool = False,
+            headers: dict = None):
+        """
+        Sends a GET request to a peer.
+        :returns the response, None if the request failed or the status code is not 200
+        """
+        return self._request("GET", node, path, params=params, timeout=timeout, stream=stream, headers=headers)
+
+    def post(self, node: str, path: str, data: dict = None, timeout: float = None):
+        """
+        Sends a POST request to a peer.
+        :returns the response, None if the request failed or the status code is not 200
+        """
+        return self._request("POST", node, path, data=data, timeout=timeout)
+
+    def get_all(self, nodes, path: str, params: dict = None, timeout: float = None):
+        """
+        Sends a GET request to every peer concurrently.
+        :returns a dict from node to its response or None
+        """
+        return self._fan_out(nodes, lambda node: self.get(node, path, params, timeout))
+
+    def post_all(self, nodes, path: str, data: dict = None, timeout: float = None):
+        """
+        Sends a POST request to every peer concurrently.
+        :returns a dict from node to its response or None
+        """
+        return self._fan_out(nodes, lambda node: self.post(node, path, data, timeout))
+
+    @staticmethod
+    def json_lines(response):
+        """
+        Parses a response of one json value per line as the lines arrive, request it with stream=True.
+        :raises ValueError if the stream breaks or a line is not json
+        """
+        try:
+            for line in response.iter_lines():
+                if line:
+                    yield json.loads(line)
+        except requests.RequestException as e:
+            raise ValueError(f"broken stream: {e}") from e
+
+    def _fan_out(self, nodes, send):
+        nodes = list(nodes)
+        return dict(zip(nodes, self.executor.map(send, nodes)))
+
+    def _request(self, method: str, node: str, path: str, timeout: float = None, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = self.session.request(method, f"http://{node}{path}",
+                                            timeout=self.timeout if timeout is None else timeout, **kwargs)
+        except requests.RequestException:
+            PEER_ERRORS.inc(labels=(node, path))
+            return None
+        # a streamed response is timed until its headers arrive
+        PEER_SECONDS.observe(time.perf_counter() - start, (node, path))
+        if response.status_code != 200:
+            PEER_ERRORS.inc(labels=(node, path))
+            return None
+        return response
@@ -0,0 +1,88 @@
+import concurrent.futures
+import itertools
+import os
+from src.util import Hasher
+
+# Trees with fewer leaves than this are built in the calling thread.
+PARALLEL_THRESHOLD = 1 << 14
+
+
+# The hash functions of each encoding: (leaf hash, node hash, null node).
+# "raw" hashes bytes items into digests like the *MerkleTreeLite functions,
+# "hex" hashes any item into hex digests like the MerkleNode based trees.
+def _raw_node(left, right):
+    return Hasher.raw_hash(left, right)
+
+
+def _hex_node(left, right):
+    return Hasher.hash(left + right)
+
+
+ENCODINGS = {
+    "raw": (Hasher.raw_hash, _raw_node, b""),
+    "hex": (Hasher.object_hash, _hex_node, ""),
+}
+
+
+def _reduce(layer: list, padding: str, encoding: str, height: int = None):
+    """
+    Hashes a layer up into its root.
+    :param height: the number of layers to hash, None to hash until one node is left
+    """
+    _, node, null = ENCODINGS[encoding]
+    while len(layer) > 1 if height is None else height > 0:
+        odd = len(layer) & 1 == 1
+        if odd and padding == "bitcoin":  # duplicate the last odd item
+            layer.append(layer[-1])
+        elif odd and padding == "libra":  # add an extra null node
+            layer.append(null)
+        up_layer = [node(layer[i], layer[i + 1]) for i in range(0, len(layer) - 1, 2)]
+        if len(layer) & 1 == 1:  # move the last odd item to the upper layer
+            up_layer.append(layer[-1])
+        layer = up_layer
+        if height is not None:
+            height -= 1
+    return layer[0]
+
+
+def _subtree_root(items: list, padding: str, encoding: str, height: int):
+    leaf = ENCODINGS[encoding][0]
+    return _reduce([leaf(item) for item in items], padding, encoding, height)
+
+
+def merkle_root(items: list, size = None, padding: str = "zero", encoding: str = "raw",
+                workers: int = None, threshold: int = PARALLEL_THRESHOLD, executor = None):
+    """
+    Calculates a merkle root, splitting large trees across a process pool.
+
+    The leaves are cut into subtrees of 2^k leaves which are hashed by the
+    workers, then the subtree roots are hashed into the root. The last subtree
+    may be partial, it is padded up to height k by the same padding rule, so
+    the root is the same as the one of the serial tree.
+    :param padding: "zero", "bitcoin" or "libra"
+    :param encoding: "raw" or "hex", see ENCODINGS
+    :param workers: number of worker processes, defaults to the number of cpus
+    :param threshold: the number of leaves from which the tree is built in parallel
+    :param executor: a concurrent.futures executor to use instead of a new process pool
+    :returns the root, b"" or "" for an empty tree
+    """
+    if size is None:
+        size = len(items)
+    if size == 0:
+        return ENCODINGS[encoding][2]
+    workers = workers or os.cpu_count() or 1
+    if size < threshold or (workers == 1 and executor is None):
+        return _subtree_root(items[:size], padding, encoding, None)
+
+    # about 4 subtrees per worker, and at least 2 subtrees
+    chunk = 1 << max(0, (size // (workers * 4)).bit_length() - 1)
+    height = chunk.bit_length() - 1
+    chunks = [items[i:min(i + chunk, size)] for i in range(0, size, chunk)]
+
+    args = (chunks, itertools.repeat(padding), itertools.repeat(encoding), itertools.repeat(height))
+    if executor is not None:
+        roots = list(executor.map(_subtree_root, *args))
+    else:
+        with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+            roots = list(pool.map(_subtree_root, *args))
+    return _reduce(roots, padding, encoding)
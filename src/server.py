@@ -1,9 +1,24 @@
 
 import sys
+import functools
 import getopt
-from flask import Flask, jsonify, request, redirect, url_for, render_template
+import itertools
+import json
+import threading
+import collections.abc
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from flask import Flask, Response, jsonify, request, redirect, url_for, render_template
 
+from src import metrics, wire
 from src.zero_chain import ZeroChain
+from src.light_chain import LightChain
+from src.util import Hasher
+from src.miner import ParallelMiner, BackgroundMiner
+from src.block_store import BlockStore
+from src.mempool import Mempool, MempoolError, MempoolFullError, amount_priority
+from src.network import NDJSON
+from src.transaction import check_transfer
 
 
 app = Flask(__name__)
@@ -11,10 +26,63 @@ app = Flask(__name__)
 # Reload templates when they are changed
 app.config["TEMPLATES_AUTO_RELOAD"] = True
 
+# The max number of transfers in one /create_transactions request
+MAX_BATCH = 100000
+
+# The number of mining jobs whose status is kept
+MAX_JOBS = 1000
+
+# Streamed responses are written in chunks of about this many characters
+STREAM_CHUNK = 1 << 16
+
+# What a full mempool drops for a new transaction, set by -e: the oldest pending one,
+# the new one, or the one with the smallest amount
+EVICTIONS = {
+    "oldest": {"eviction": "oldest"},
+    "reject": {"eviction": "reject"},
+    "amount": {"priority": amount_priority},
+}
+
 
 # The instance of the ZeroChain, which contains the main chain logic
 zeroChain = ZeroChain()
 
+# Blocks are mined one at a time in a background thread, so pow never runs inside a request handler
+mining_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="mining")
+mining_jobs = OrderedDict()  # job id -> Future of the mined block header, the latest MAX_JOBS jobs
+mining_jobs_lock = threading.Lock()
+job_ids = itertools.count(1)
+
+# Mines blocks continuously when started by /miner/start
+background_miner = None
+
+# Samples the stacks of the node when started by /profiler/start
+profiler = metrics.SamplingProfiler()
+
+# The state of the node, read when /metrics is requested
+metrics.gauge("zerochain_block_height", "Number of blocks in the chain", function=lambda: zeroChain.block_height)
+metrics.gauge("zerochain_pending_transactions", "Transactions in the pending pool",
+              function=lambda: len(zeroChain.mempool))
+metrics.gauge("zerochain_pending_bytes", "Bytes of the transactions in the pending pool",
+              function=lambda: zeroChain.mempool.size_bytes)
+metrics.gauge("zerochain_nodes", "Number of known nodes", function=lambda: len(zeroChain.nodes))
+
+
+def pruned(height: int):
+    """ The response for blocks whose transactions are pruned. """
+    return jsonify({"error": f"the transactions of the blocks before {height} are pruned"}), 410
+
+
+def full_node_only(route):
+    """ Answers 400 on a light node, which has no transactions and does not mine. """
+    @functools.wraps(route)
+    def wrapper(*args, **kwargs):
+        if zeroChain.light:
+            return jsonify({"error": "not available on a light node"}), 400
+        return route(*args, **kwargs)
+    return wrapper
+
+
 @app.route('/favicon.ico')
 def favicon():
     return redirect(url_for('static', filename='favicon.ico'))
@@ -25,53 +93,467 @@ def index():
     return render_template("index.html", request=request)
 
 
+def submit_mining_job():
+    """ Queues the mining of a block. :returns (job id, Future of the block header) """
+    future = mining_executor.submit(lambda: zeroChain.create_block())
+    with mining_jobs_lock:
+        job_id = next(job_ids)
+        mining_jobs[job_id] = future
+        while len(mining_jobs) > MAX_JOBS:
+            mining_jobs.popitem(last=False)
+    return job_id, future
+
+
+def job_status(job_id: int, future):
+    response = {"job": job_id, "url": url_for("job", job_id=job_id)}
+    if not future.done():
+        response["status"] = "running" if future.running() else "queued"
+    elif future.exception() is not None:
+        response["status"] = "failed"
+        response["error"] = str(future.exception())
+    elif future.result() is None:
+        response["status"] = "cancelled"
+    else:
+        response["status"] = "done"
+        response["block_header"] = future.result().to_json()
+    return response
+
+
 @app.route("/mine", methods=["GET"])
+@full_node_only
 def mine():
+    """
+    Mines a block and responds with it, or with background=True responds
+    at once with the mining job, whose status is polled at /jobs/<job_id>.
+    """
+    job_id, future = submit_mining_job()
+    if request.args.get("background") == "True":
+        return jsonify(job_status(job_id, future)), 202
+    if future.exception() is not None:
+        return jsonify({"error": f"mining failed: {future.exception()}"}), 500
+    block_header = future.result()
+    if block_header is None:
+        return jsonify({"error": "mining was cancelled"}), 503
     response = {
-        "block_header" : zeroChain.create_block().to_json()
+        "block_header" : block_header.to_json()
     }
     return jsonify(response), 200
 
 
+@app.route("/jobs/<int:job_id>", methods=["GET"])
+def job(job_id):
+    with mining_jobs_lock:
+        future = mining_jobs.get(job_id)
+    if future is None:
+        return jsonify({"error": "job not found"}), 404
+    return jsonify(job_status(job_id, future)), 200
+
+
 @app.route("/create_transaction", methods=["POST"])
+@full_node_only
 def create_transaction():
-    sender = request.form["sender"]
-    receiver = request.form["receiver"]
-    amount = str(request.form["amount"])
-    txn = zeroChain.transfer(sender, receiver, amount)
+    try:
+        sender, receiver, amount = parse_transfer({"sender": request.form["sender"],
+                                                   "receiver": request.form["receiver"],
+                                                   "amount": str(request.form["amount"])})
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        txn = zeroChain.transfer(sender, receiver, amount)
+    except MempoolFullError as e:
+        return jsonify({"error": str(e)}), 503
+    except MempoolError as e:
+        return jsonify({"error": str(e)}), 400
     return jsonify(txn.to_json()), 200
 
 
-@app.route("/status", methods=["GET"])
-def status():
+def parse_transfer(item):
+    """
+    Validates one transfer of a batch.
+    :returns (sender, receiver, amount), raises ValueError if the transfer is invalid
+    """
+    if not isinstance(item, dict):
+        raise ValueError("transfer must be an object")
+    sender, receiver, amount = item.get("sender"), item.get("receiver"), item.get("amount")
+    check_transfer(sender, receiver, amount)
+    return sender, receiver, amount
+
+
+@app.route("/create_transactions", methods=["POST"])
+@full_node_only
+def create_transactions():
+    """
+    Adds many transfers: a json array, or one json object per line with content type application/x-ndjson.
+    """
+    if request.mimetype == NDJSON:
+        items = []
+        for line in request.get_data().splitlines():
+            if not line.strip():
+                continue
+            try:
+                items.append(json.loads(line))
+            except ValueError:
+                items.append(None)
+    else:
+        items = request.get_json(silent=True)
+        if not isinstance(items, list):
+            return jsonify({"error": "expected a json array of transfers"}), 400
+    if len(items) > MAX_BATCH:
+        return jsonify({"error": f"at most {MAX_BATCH} transfers per batch"}), 400
+
+    # validate all items first, then add the valid ones to the pool in one call
+    results = [None] * len(items)
+    transfers, positions = [], []
+    for i, item in enumerate(items):
+        try:
+            transfers.append(parse_transfer(item))
+            positions.append(i)
+        except ValueError as e:
+            results[i] = {"error": str(e)}
+    for i, (txid, error) in zip(positions, zeroChain.transfer_many(transfers)):
+        results[i] = {"txid": txid} if error is None else {"error": error}
+
     response = {
-        "block_height": zeroChain.block_height,
-        "block_headers": [h.to_json() for h in zeroChain.block_headers],
-        "pending_transactions": [t.to_json() for t in zeroChain.pending_transactions],
-        "nodes": [n for n in zeroChain.nodes],
+        "accepted": sum(1 for r in results if "txid" in r),
+        "results": results,
     }
     return jsonify(response), 200
 
 
+@app.route("/balance/<account>", methods=["GET"])
+@full_node_only
+def balance(account):
+    with zeroChain.lock:
+        response = {
+            "account": account,
+            "balance": zeroChain.balance(account),
+            "block_height": zeroChain.block_height,
+        }
+    return jsonify(response), 200
+
+
+@app.route("/history/<account>", methods=["GET"])
+@full_node_only
+def history(account):
+    response = {
+        "account": account,
+        "transactions": [{"height": height, "position": position, "transaction": txn.to_json()}
+                         for height, position, txn in zeroChain.history(account)],
+    }
+    return jsonify(response), 200
+
+
+def chain_tip():
+    """ Returns the height and the tip hash of the chain, which a streamed response sends the blocks of. """
+    with zeroChain.lock:
+        return zeroChain.block_height, Hasher.object_hash(zeroChain.latest_block)
+
+
+def read_blocks(start: int, stop: int, tip_hash: str = None, with_transactions: bool = True):
+    """
+    Yields (header, transactions or None) of the blocks [start, stop), read one at a time,
+    so a streamed response holds one block instead of the whole chain.
+    If the chain is replaced meanwhile, the blocks end early and the client sees an incomplete response.
+    :param tip_hash: the hash block stop - 1 must have, so every pass over the blocks sends the same chain
+    """
+    previous_hash = None
+    for height in range(start, stop):
+        with zeroChain.lock:
+            if height >= zeroChain.block_height:
+                return
+            block_header = zeroChain.block_headers[height]
+            txs = zeroChain.transactions[height] if with_transactions else None
+        if with_transactions and txs is None:
+            return  # pruned meanwhile
+        if previous_hash is not None and block_header.previous_hash != previous_hash:
+            return
+        previous_hash = Hasher.object_hash(block_header)
+        # the blocks are hash linked, so a matching last block means all blocks are from the same chain
+        if height == stop - 1 and tip_hash is not None and previous_hash != tip_hash:
+            return
+        yield block_header, txs
+
+
+def dumps(value):
+    return json.dumps(value, sort_keys=True, separators=(",", ":"))
+
+
+def stream_object(fields):
+    """
+    Yields the json of an object piece by piece.
+    :param fields: (key, value) in key order, a value that is an iterator is written as an array item by item
+    """
+    yield "{"
+    for i, (key, value) in enumerate(fields):
+        yield ("," if i else "") + dumps(key) + ":"
+        if isinstance(value, collections.abc.Iterator):
+            yield "["
+            for j, item in enumerate(value):
+                yield ("," if j else "") + dumps(item)
+            yield "]"
+        else:
+            yield dumps(value)
+    yield "}"
+
+
+def chunked(pieces):
+    """ Joins small pieces of a streamed response into chunks of about STREAM_CHUNK. """
+    buffer, size = [], 0
+    for piece in pieces:
+        buffer.append(piece)
+        size += len(piece)
+        if size >= STREAM_CHUNK:
+            yield piece[:0].join(buffer)
+            buffer, size = [], 0
+    if buffer:
+        yield buffer[0][:0].join(buffer)
+
+
+@app.route("/status", methods=["GET"])
+def status():
+    height, tip_hash = chain_tip()
+    pending = zeroChain.pending_transactions
+    response = stream_object([
+        ("block_headers", (h.to_json() for h, _ in read_blocks(0, height, tip_hash, with_transactions=False))),
+        ("block_height", height),
+        ("nodes", [n for n in zeroChain.nodes]),
+        ("pending_transactions", (t.to_json() for t in pending)),
+    ])
+    return Response(chunked(response), mimetype="application/json")
+
+
+def response_format():
+    """ Returns the media type the client prefers: json, the binary encoding or ndjson. """
+    return request.accept_mimetypes.best_match(["application/json", wire.MIMETYPE, NDJSON])
+
+
+def stream_wire(start: int, stop: int, tip_hash: str = None):
+    """ Yields the binary encoding of the blocks [start, stop) block by block. """
+    yield wire.encode_range(start, stop - start)
+    for block_header, txs in read_blocks(start, stop, tip_hash):
+        out = bytearray()
+        wire.encode_block(block_header, txs, out)
+        yield bytes(out)
+
+
+def stream_ndjson(start: int, stop: int, tip_hash: str = None):
+    """ Yields one line of json for each block of [start, stop). """
+    for height, (block_header, txs) in enumerate(read_blocks(start, stop, tip_hash), start):
+        yield dumps({"height": height, "block_header": block_header.to_json(),
+                     "transactions": [t.to_json() for t in txs]}) + "\n"
+
+
 @app.route("/fullnode", methods=["GET"])
+@full_node_only
 def fullnode():
+    if zeroChain.pruned_height > 0:
+        return pruned(zeroChain.pruned_height)
+    height, tip_hash = chain_tip()
+    media_type = response_format()
+    if media_type == wire.MIMETYPE:
+        return Response(chunked(stream_wire(0, height, tip_hash)), mimetype=wire.MIMETYPE)
+    if media_type == NDJSON:
+        return Response(chunked(stream_ndjson(0, height, tip_hash)), mimetype=NDJSON)
+    response = stream_object([
+        ("block_headers", (h.to_json() for h, _ in read_blocks(0, height, tip_hash, with_transactions=False))),
+        ("block_height", height),
+        ("nodes", [n for n in zeroChain.nodes]),
+        ("transactions", ([t.to_json() for t in txs] for _, txs in read_blocks(0, height, tip_hash))),
+    ])
+    return Response(chunked(response), mimetype="application/json")
+
+
+@app.route("/tip", methods=["GET"])
+def tip():
+    with zeroChain.lock:
+        response = {
+            "block_height": zeroChain.block_height,
+            "tip_hash": Hasher.object_hash(zeroChain.latest_block),
+            "light": zeroChain.light,
+            "pruned_height": zeroChain.pruned_height,
+        }
+    return jsonify(response), 200
+
+
+@app.route("/headers", methods=["GET"])
+def headers():
+    start = request.args.get("from", 0, type=int)
+    count = min(request.args.get("count", ZeroChain.HEADERS_PAGE, type=int), ZeroChain.HEADERS_PAGE)
+    if start < 0 or count < 0:
+        # a negative index would slice from the end of the chain
+        return jsonify({"error": "from and count must not be negative"}), 400
+    with zeroChain.lock:
+        response = {
+            "from": start,
+            "block_headers": [h.to_json() for h in zeroChain.block_headers[start:start + count]],
+        }
+    return jsonify(response), 200
+
+
+@app.route("/blocks", methods=["GET"])
+@full_node_only
+def blocks():
+    start = request.args.get("from", 0, type=int)
+    stop = request.args.get("to", type=int)
+    if start < 0 or (stop is not None and stop < 0):
+        # a negative index would slice from the end of the chain
+        return jsonify({"error": "from and to must not be negative"}), 400
+    media_type = response_format()
+    with zeroChain.lock:
+        if start < zeroChain.pruned_height:
+            return pruned(zeroChain.pruned_height)
+        stop = min(stop if stop is not None else zeroChain.block_height, start + ZeroChain.BLOCKS_PAGE)
+        if media_type == NDJSON:
+            stop = max(start, min(stop, zeroChain.block_height))
+            tip_hash = Hasher.object_hash(zeroChain.block_headers[stop - 1]) if stop > start else None
+            return Response(chunked(stream_ndjson(start, stop, tip_hash)), mimetype=NDJSON)
+        if media_type == wire.MIMETYPE:
+            return Response(wire.encode_blocks(start, zeroChain.block_headers[start:stop],
+                                               zeroChain.transactions[start:stop]),
+                            mimetype=wire.MIMETYPE)
+        response = {
+            "from": start,
+            "block_headers": [h.to_json() for h in zeroChain.block_headers[start:stop]],
+            "transactions": [[t.to_json() for t in ts] for ts in zeroChain.transactions[start:stop]],
+        }
+    return jsonify(response), 200
+
+
+@app.route("/block/<block_id>", methods=["GET"])
+@full_node_only
+def block(block_id):
+    with zeroChain.lock:
+        height = zeroChain.find_block(block_id)
+        if height is None:
+            return jsonify({"error": "block not found"}), 404
+        if height < zeroChain.pruned_height:
+            return pruned(zeroChain.pruned_height)
+        block_header = zeroChain.block_headers[height]
+        response = {
+            "height": height,
+            "hash": Hasher.object_hash(block_header),
+            "block_header": block_header.to_json(),
+            "transactions": [t.to_json() for t in zeroChain.transactions[height]],
+        }
+    return jsonify(response), 200
+
+
+@app.route("/tx/<txid>", methods=["GET"])
+def tx(txid):
+    """ A light node asks the full nodes for the transaction, and answers once its merkle proof is verified. """
+    # the search runs without the lock, since a light node waits for its peers
+    found = zeroChain.find_transaction(txid)
+    if found is None:
+        return jsonify({"error": "transaction not found"}), 404
+    height, position, txn, proof = found
+    with zeroChain.lock:
+        if height >= zeroChain.block_height:
+            return jsonify({"error": "transaction not found"}), 404  # the chain was replaced meanwhile
+        response = {
+            "txid": txid,
+            "height": height,
+            "position": position,
+            "transaction": txn.to_json(),
+            "transaction_root": zeroChain.block_headers[height].transaction_root,
+            "proof": proof,
+        }
+    return jsonify(response), 200
+
+
+@app.route("/snapshot", methods=["GET"])
+@full_node_only
+def snapshot():
+    """
+    The balances after the first height blocks, by default the snapshot the node is pruned to.
+    Only the pruned height and multiples of ZeroChain.PRUNE_EVERY are served, since each other height
+    would replay the blocks after the pruned height again.
+    With hash=True only the hash is sent, which a fast syncing node compares with the snapshot it downloaded.
+    """
+    height = request.args.get("height", zeroChain.pruned_height, type=int)
+    if not zeroChain.serves_snapshot(height):
+        return jsonify({"error": f"snapshots are only served at multiples of {zeroChain.PRUNE_EVERY}"}), 400
+    found = zeroChain.snapshot(height)
+    if found is None:
+        return jsonify({"error": "snapshot not available"}), 404
     response = {
-        "block_height": zeroChain.block_height,
-        "block_headers": [h.to_json() for h in zeroChain.block_headers],
-        "transactions": [[t.to_json() for t in ts] for ts in zeroChain.transactions],
-        "nodes": [n for n in zeroChain.nodes],
+        "height": found.height,
+        "block_hash": found.block_hash,
+        "hash": Hasher.object_hash(found),
     }
+    if request.args.get("hash") != "True":
+        response["snapshot"] = found.to_json()
     return jsonify(response), 200
 
 
+@app.route("/miner/start", methods=["POST"])
+@full_node_only
+def start_miner():
+    """ Starts mining blocks of the pending transactions continuously, with empty=True empty blocks too. """
+    global background_miner
+    if background_miner is None or not background_miner.running:
+        background_miner = BackgroundMiner(zeroChain, mine_empty=request.form.get("empty") == "True")
+        background_miner.start()
+    return jsonify(background_miner.status()), 200
+
+
+@app.route("/miner/stop", methods=["POST"])
+def stop_miner():
+    if background_miner is None:
+        return jsonify({"running": False}), 200
+    background_miner.stop()
+    return jsonify(background_miner.status()), 200
+
+
+@app.route("/miner", methods=["GET"])
+def miner_status():
+    if background_miner is None:
+        return jsonify({"running": False}), 200
+    return jsonify(background_miner.status()), 200
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics_page():
+    """ The metrics of the node in the Prometheus text format, counters stay at 0 unless started with -M. """
+    return Response(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
+
+
+@app.route("/profiler/start", methods=["POST"])
+def start_profiler():
+    """ Starts sampling the stacks of the node, every interval seconds. """
+    if not profiler.running:
+        profiler.interval = request.form.get("interval", profiler.interval, type=float)
+        profiler.start()
+    return jsonify(profiler.status()), 200
+
+
+@app.route("/profiler/stop", methods=["POST"])
+def stop_profiler():
+    profiler.stop()
+    return jsonify(profiler.status()), 200
+
+
+@app.route("/profiler", methods=["GET"])
+def profiler_report():
+    """ The sampled stacks in the collapsed format of flame graph tools, clear=True starts over. """
+    report = profiler.report(request.args.get("limit", type=int))
+    if request.args.get("clear") == "True":
+        profiler.clear()
+    return Response(report, mimetype="text/plain")
+
+
 # the following are network related functions.
 
 @app.route("/register_node", methods=["POST"])
 def register_node():
-    node = request.form["node"]
-    propagate = bool(request.form["propagate"])
-    zeroChain.add_node(node, propagate)
-    return "Node added: " + node
+    nodes = request.form.getlist("node")
+    propagate = request.form.get("propagate") == "True"
+    zeroChain.add_nodes(nodes, propagate)
+    return "Node added: " + ", ".join(nodes)
+
+
+@app.route("/nodes", methods=["GET"])
+def nodes():
+    return jsonify({"nodes": [n for n in zeroChain.nodes]}), 200
 
 
 @app.route("/sync", methods=["GET"])
@@ -85,23 +567,86 @@ def sync():
 
 
 def main(argv):
+    global zeroChain, background_miner
+    usage = "server.py -p <port_number> -w <mining_workers> -d <data_dir> -t <server_threads> -i <block_interval> " \
+            f"-P <prune_depth> -e <{'|'.join(EVICTIONS)}> [-m] [-M] [-l] [-c]"
     try:
-        opts, args = getopt.getopt(argv,"hp:",["port="])
+        opts, args = getopt.getopt(argv,"hp:w:d:t:mi:MlP:e:c",["port=", "workers=", "datadir=", "threads=", "mine",
+                                                            "interval=", "metrics", "light", "prune=", "evict=",
+                                                            "compact"])
     except getopt.GetoptError:
-        print("server.py -p <port_number>")
+        print(usage)
         sys.exit(2)
 
     port = 8900  # default port number 8900
+    threads = None  # serve with the flask development server by default
+    mine_continuously = False
+    light = False
+    datadir = None
+    prune_depth = None
+    eviction = "oldest"
+    compact_history = False
     for opt, arg in opts:
         if opt == "-h":
-            print("server.py -p <port_number>")
+            print(usage)
             sys.exit()
         elif opt in ("-p", "--port"):
             port = int(arg)
+        elif opt in ("-w", "--workers"):
+            zeroChain.miner = ParallelMiner(int(arg))
+        elif opt in ("-d", "--datadir"):
+            datadir = arg
+        elif opt in ("-t", "--threads"):
+            threads = int(arg)
+        elif opt in ("-m", "--mine"):
+            mine_continuously = True
+        elif opt in ("-i", "--interval"):
+            # the target seconds between blocks, all nodes of a network must use the same one
+            zeroChain.schedule.target_interval = float(arg)
+        elif opt in ("-M", "--metrics"):
+            # record the hot paths for /metrics
+            metrics.REGISTRY.enabled = True
+        elif opt in ("-l", "--light"):
+            # keep and verify the block headers only, transactions are checked by their merkle proofs
+            light = True
+        elif opt in ("-P", "--prune"):
+            # keep the transactions of the latest blocks only, the older ones are replaced by a snapshot
+            prune_depth = int(arg)
+        elif opt in ("-e", "--evict"):
+            if arg not in EVICTIONS:
+                print(usage)
+                sys.exit(2)
+            eviction = arg
+        elif opt in ("-c", "--compact"):
+            # keep the transactions of the blocks in memory as columns, a fraction of the memory of objects
+            compact_history = True
+    if light:
+        if datadir is not None or mine_continuously or prune_depth is not None or compact_history:
+            print("a light node keeps no blocks on disk or in memory, does not mine and has nothing to prune")
+            sys.exit(2)
+        zeroChain = LightChain(schedule=zeroChain.schedule)
+    else:
+        # keep the chain on disk if a data dir is given, and continue from it after a restart
+        store = BlockStore(datadir) if datadir is not None else None
+        mempool = Mempool(max_txn_bytes=ZeroChain.MAX_BLOCK_BYTES, **EVICTIONS[eviction])
+        zeroChain = ZeroChain(zeroChain.miner, compact_history, store=store, mempool=mempool,
+                              schedule=zeroChain.schedule, prune_depth=prune_depth)
     host="127.0.0.1"
     zeroChain.node_ipport = f"{host}:{port}"
+    if mine_continuously:
+        background_miner = BackgroundMiner(zeroChain)
+        background_miner.start()
     # start the web server
-    app.run(host="127.0.0.1", port=port)
+    if threads is not None:
+        # production mode, a pool of threads handles the requests
+        try:
+            import waitress
+        except ImportError:
+            print("waitress is not installed, serving with the threaded development server")
+        else:
+            waitress.serve(app, host=host, port=port, threads=threads)
+            return
+    app.run(host=host, port=port, threaded=True)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,223 @@
+import bisect
+from src.util import HashCached, Hasher
+
+
+class Snapshot(HashCached):
+    """
+    The balance of each account after the first `height` blocks of a chain.
+
+    A pruned chain keeps a snapshot instead of the transactions of its older
+    blocks. block_hash anchors it to the chain, it is the hash of block height - 1,
+    which the verified headers must have. The state is not part of the headers,
+    so nodes compare snapshots of the same height by their hash instead.
+    """
+    __slots__ = ("height", "block_hash", "balances")
+
+    def __init__(self, height: int = 0, block_hash: str = "", balances: dict = None):
+        self.height = height
+        self.block_hash = block_hash
+        self.balances = balances if balances is not None else {}  # account -> balance
+
+    @classmethod
+    def from_json(cls, json_data: dict):
+        """ :raises ValueError if a field has the wrong type, since snapshots arrive from peers """
+        snapshot = cls(**json_data)
+        if type(snapshot.height) is not int or snapshot.height < 0 or not isinstance(snapshot.block_hash, str) or \
+                not isinstance(snapshot.balances, dict) or \
+                not all(type(balance) is int for balance in snapshot.balances.values()):
+            raise ValueError("malformed snapshot")
+        return snapshot
+
+    def advance(self, block_hash: str, blocks: list):
+        """
+        Returns the snapshot after the transfers of the next blocks.
+        :param block_hash: the hash of the last of the blocks
+        """
+        balances = dict(self.balances)
+        for transactions in blocks:
+            for txn in transactions:
+                amount = BalanceIndex.amount(txn)
+                balances[txn.sender] = balances.get(txn.sender, 0) - amount
+                balances[txn.receiver] = balances.get(txn.receiver, 0) + amount
+        return Snapshot(self.height + len(blocks), block_hash, balances)
+
+
+class BalanceIndex:
+    """
+    The balance and transfer history of each account, updated block by block.
+
+    The changes of the latest UNDO_DEPTH blocks are kept, so a chain
+    replacement within that depth is undone block by block. Deeper
+    replacements reset the index to its base snapshot, and it is rebuilt
+    from the blocks after it.
+    """
+
+    UNDO_DEPTH = 1000
+
+    def __init__(self, base: Snapshot = None):
+        """
+        :param base: the snapshot of a pruned chain, the blocks after it are applied on top of it
+        """
+        self.base = base
+        self.height = base.height if base is not None else 0  # number of blocks applied
+        self.balances = dict(base.balances) if base is not None else {}  # account -> balance
+        self.history = {}  # account -> list of (height, position) of its transfers
+        self.undo = []  # (sender, receiver, amount) of the transfers of the latest blocks
+
+    @staticmethod
+    def amount(txn):
+        """ Returns the amount of a transfer as an int, amounts may arrive as strings. """
+        try:
+            return int(txn.amount)
+        except (TypeError, ValueError, OverflowError):
+            return 0  # an invalid amount, e.g. a float infinity, does not move any balance
+
+    def apply_block(self, transactions: list):
+        """ Applies the transfers of the next block, all of them or none. """
+        # read every transfer before changing anything, so a bad one can not leave a half applied block
+        changes = [(txn.sender, txn.receiver, BalanceIndex.amount(txn)) for txn in transactions]
+        for position, (sender, receiver, amount) in enumerate(changes):
+            self.balances[sender] = self.balances.get(sender, 0) - amount
+            self.balances[receiver] = self.balances.get(receiver, 0) + amount
+            self.history.setdefault(sender, []).append((self.height, position))
+            if receiver != sender:
+                self.history.setdefault(receiver, []).append((self.height, position))
+        self.undo.append(changes)
+        if len(self.undo) > BalanceIndex.UNDO_DEPTH:
+            del self.undo[0]
+        self.height += 1
+
+    def rollback(self, height: int):
+        """
+        Removes the blocks from the given height on.
+        :returns False if they are too deep to undo and the index is reset to its base instead
+        """
+        if height >= self.height:
+            return True
+        if self.height - height > len(self.undo):
+            self.__init__(self.base)
+            return False
+        while self.height > height:
+            self.height -= 1
+            for sender, receiver, amount in reversed(self.undo.pop()):
+                self.balances[sender] += amount
+                self.balances[receiver] -= amount
+                if receiver != sender:
+                    self.history[receiver].pop()
+                self.history[sender].pop()
+        return True
+
+    def update(self, transactions):
+        """ Applies the blocks of a chain which are not applied yet. """
+        for height in range(self.height, len(transactions)):
+            self.apply_block(transactions[height])
+
+    def prune(self, base: Snapshot, blocks: list):
+        """
+        Makes a snapshot the base of the index, and drops the history of the blocks before it.
+        :param blocks: the transactions of the pruned blocks, None for a block the index has not applied
+        """
+        if self.height < base.height:
+            self.__init__(base)  # the blocks were synced without their transactions
+            return
+        self.base = base
+        accounts = {account for txs in blocks if txs is not None for txn in txs
+                    for account in (txn.sender, txn.receiver)}
+        for account in accounts:
+            history = self.history.get(account)
+            if history:
+                del history[:bisect.bisect_left(history, (base.height,))]
+                if not history:
+                    del self.history[account]
+
+    def balance(self, account: str):
+        return self.balances.get(account, 0)
+
+    def account_history(self, account: str):
+        """ Returns the (height, position) of each transfer of the account, oldest first. """
+        return self.history.get(account, [])
+
+
+class ChainIndex:
+    """
+    Finds blocks by hash and transactions by hash, updated block by block.
+
+    Like BalanceIndex, replacements within UNDO_DEPTH blocks are undone,
+    deeper ones clear the index so it is rebuilt from the chain. The
+    transactions of pruned blocks are not indexed.
+    """
+
+    UNDO_DEPTH = 1000
+
+    def __init__(self):
+        self.block_hashes = []  # the hash of each block, by height
+        self.blocks = {}  # block hash -> height
+        self.txs = {}  # transaction hash -> list of (height, position), the same transfer may repeat
+        self.undo = []  # the transaction hashes of the latest blocks
+
+    @property
+    def height(self):
+        return len(self.block_hashes)
+
+    def apply_block(self, block_header, transactions: list):
+        """ Adds the next block, transactions is None if they are pruned. """
+        height = len(self.block_hashes)
+        block_hash = Hasher.object_hash(block_header)
+        self.block_hashes.append(block_hash)
+        self.blocks[block_hash] = height
+        txids = [Hasher.object_hash(txn) for txn in transactions] if transactions is not None else []
+        for position, txid in enumerate(txids):
+            self.txs.setdefault(txid, []).append((height, position))
+        self.undo.append(txids)
+        if len(self.undo) > ChainIndex.UNDO_DEPTH:
+            del self.undo[0]
+
+    def rollback(self, height: int):
+        """
+        Removes the blocks from the given height on.
+        :returns False if they are too deep to undo and the index is cleared instead
+        """
+        if height >= self.height:
+            return True
+        if self.height - height > len(self.undo):
+            self.__init__()
+            return False
+        while self.height > height:
+            del self.blocks[self.block_hashes.pop()]
+            for txid in self.undo.pop():
+                locations = self.txs[txid]
+                locations.pop()
+                if not locations:
+                    del self.txs[txid]
+        return True
+
+    def update(self, block_headers, transactions):
+        """ Adds the blocks of a chain which are not added yet. """
+        for height in range(self.height, len(block_headers)):
+            self.apply_block(block_headers[height], transactions[height])
+
+    def prune(self, start: int, blocks: list):
+        """
+        Drops the transactions of pruned blocks from the index.
+        :param start: the height of the first block
+        :param blocks: the transactions of each block, None for a block which was not indexed with them
+        """
+        for height, transactions in enumerate(blocks, start):
+            if transactions is None or height >= self.height:
+                continue
+            for position, txn in enumerate(transactions):
+                txid = Hasher.object_hash(txn)
+                locations = self.txs.get(txid)
+                if locations and (height, position) in locations:
+                    locations.remove((height, position))
+                    if not locations:
+                        del self.txs[txid]
+
+    def find_block(self, block_hash: str):
+        """ Returns the height of the block, None if it is not in the chain. """
+        return self.blocks.get(block_hash)
+
+    def find_transaction(self, txid: str):
+        """ Returns the (height, position) of the latest transfer with the hash, None if there is none. """
+        locations = self.txs.get(txid)
+        return locations[-1] if locations else None
@@ -1,15 +1,119 @@
-from src.util import JsonSerializable
+import json
+from array import array
+from src.util import HashCached, _set_slot
 
+# escapes a string like json.dumps does
+_json_string = json.encoder.encode_basestring_ascii
+
+# Bounds of a transfer from a client, so every accepted transfer fits the wire format and the block store
+MAX_ACCOUNT_BYTES = 256  # max utf-8 size of a sender or receiver
+MAX_AMOUNT_CHARS = 32  # max length of an amount given as a string
+MIN_AMOUNT, MAX_AMOUNT = -(1 << 63), (1 << 63) - 1  # amounts are int64
+
+
+def check_transfer(sender, receiver, amount):
+    """
+    Validates the fields of a transfer from a client.
+    :raises ValueError if a field has the wrong type or is out of bounds
+    """
+    if not isinstance(sender, str) or not isinstance(receiver, str):
+        raise ValueError("sender and receiver must be strings")
+    if len(sender.encode()) > MAX_ACCOUNT_BYTES or len(receiver.encode()) > MAX_ACCOUNT_BYTES:
+        raise ValueError(f"sender and receiver must be at most {MAX_ACCOUNT_BYTES} bytes")
+    if type(amount) not in (int, str) or (type(amount) == str and len(amount) > MAX_AMOUNT_CHARS):
+        raise ValueError("amount must be an integer")
+    try:
+        value = int(amount)
+    except ValueError:
+        raise ValueError("amount must be an integer") from None
+    if not MIN_AMOUNT <= value <= MAX_AMOUNT:
+        raise ValueError("amount is out of range")
+
+
+class Transaction(HashCached):
+    __slots__ = ("sender",)
 
-class Transaction(JsonSerializable):
     def __intit__(self, sender: str):
         self.sender = sender
 
 
 # This is the balance transfer transaction, we could support more other types of transaction later.
 class TransferTxn(Transaction):
+    __slots__ = ("receiver", "amount")
+
     def __init__(self, sender: str, receiver: str, amount: int):
-        super().__intit__(sender)
-        self.receiver = receiver
-        self.amount = amount
+        # a new transaction has no cached hash to clear, so the fields skip HashCached.__setattr__,
+        # which would triple the cost of decoding the transactions of a sync
+        _set_slot(self, "sender", sender)
+        _set_slot(self, "receiver", receiver)
+        _set_slot(self, "amount", amount)
+
+    def canonical_json(self):
+        """
+        Formats the canonical json directly, the same bytes json.dumps gives for the sorted fields
+        in a fifth of the time, since every transaction is hashed for its txid and its merkle leaf.
+        """
+        amount = self.amount
+        if type(self) is not TransferTxn or type(self.sender) is not str or type(self.receiver) is not str or \
+                type(amount) not in (int, str, float, bool):
+            return super().canonical_json()
+        amount = str(amount) if type(amount) is int else json.dumps(amount)
+        return ('{"amount": %s, "receiver": %s, "sender": %s}' %
+                (amount, _json_string(self.receiver), _json_string(self.sender))).encode()
+
+
+class AccountTable:
+    """
+    Maps account names to small integer ids, so every name is stored once.
+    """
+
+    def __init__(self):
+        self.names = []
+        self.ids = {}
+
+    def id(self, name: str):
+        account_id = self.ids.get(name)
+        if account_id is None:
+            account_id = self.ids[name] = len(self.names)
+            self.names.append(name)
+        return account_id
+
+    def __len__(self):
+        return len(self.names)
+
+
+class TransferColumns:
+    """
+    The transfers of one block stored as columns instead of TransferTxn objects.
+
+    Senders and receivers are ids in a shared AccountTable, and amounts are a
+    packed array when they are all ints. Items are read back as TransferTxn
+    objects with the same fields, so their json and hashes do not change.
+    """
+
+    __slots__ = ("accounts", "senders", "receivers", "amounts")
+
+    def __init__(self, transactions: list, accounts: AccountTable):
+        self.accounts = accounts
+        self.senders = array("I", [accounts.id(t.sender) for t in transactions])
+        self.receivers = array("I", [accounts.id(t.receiver) for t in transactions])
+        amounts = [t.amount for t in transactions]
+        # amounts arrive as strings from /create_transaction, keep them as they are
+        if all(type(a) == int and MIN_AMOUNT <= a <= MAX_AMOUNT for a in amounts):
+            self.amounts = array("q", amounts)
+        else:
+            self.amounts = amounts
+
+    def __len__(self):
+        return len(self.senders)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        names = self.accounts.names
+        return TransferTxn(names[self.senders[index]], names[self.receivers[index]], self.amounts[index])
 
+    def __iter__(self):
+        names = self.accounts.names
+        for s, r, a in zip(self.senders, self.receivers, self.amounts):
+            yield TransferTxn(names[s], names[r], a)
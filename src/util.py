@@ -1,16 +1,82 @@
 
+import functools
 import json
 import hashlib
 
+# The number of hashes kept by field values, see HashCached
+HASH_CACHE_SIZE = 1 << 15
+
 class JsonSerializable:
+    # Subclasses list their fields in __slots__, so instances have no __dict__.
+    # Slots starting with "_" are not part of the json.
+    __slots__ = ()
+
     @classmethod
     def from_json(cls, json_data: dict):
         return cls(**json_data)
 
+    @classmethod
+    def json_fields(cls):
+        """ Returns the names of the fields in the json of this class. """
+        fields = cls.__dict__.get("_json_fields")
+        if fields is None:
+            fields = tuple(name for c in reversed(cls.__mro__) for name in c.__dict__.get("__slots__", ())
+                           if not name.startswith("_"))
+            cls._json_fields = fields
+        return fields
+
     def to_json(self):
         #return json.dumps(self, default=lambda o: o.__dict__, sort_keys=True)
         #return json.dumps(self.__dict__, sort_keys=True)
-        return self.__dict__
+        return {name: getattr(self, name) for name in self.json_fields()}
+
+    def canonical_json(self):
+        """ Returns the canonical json bytes of the object, the object hash is their sha256. """
+        return json.dumps(self.to_json(), sort_keys=True).encode()
+
+
+@functools.lru_cache(maxsize=HASH_CACHE_SIZE)
+def _fields_hash(fields: tuple, values: tuple, types: tuple):
+    """ The hash of the json of an object with the given field values, types tell 1, 1.0 and True apart. """
+    return hashlib.sha256(json.dumps(dict(zip(fields, values)), sort_keys=True).encode()).hexdigest()
+
+
+class HashCached(JsonSerializable):
+    """
+    A JsonSerializable that keeps its hash until one of its fields changes.
+
+    Setting any field clears the cached hash, so a header whose nonce is still
+    being changed by the miner is hashed again. Classes with LRU_BY_VALUE also
+    keep their hashes in a bounded LRU by field values, so an object that is
+    decoded again from a peer, e.g. the same headers in every sync, is not
+    serialized again. Looking up the LRU costs about half a hash, so it only
+    pays off for objects that are often decoded again.
+    """
+    __slots__ = ("_hash",)
+    LRU_BY_VALUE = False
+
+    def __setattr__(self, name, value):
+        _set_slot(self, name, value)
+        _set_slot(self, "_hash", None)
+
+    def hash(self):
+        cached = getattr(self, "_hash", None)
+        if cached is None and not self.LRU_BY_VALUE:
+            cached = hashlib.sha256(self.canonical_json()).hexdigest()
+            _set_slot(self, "_hash", cached)
+        elif cached is None:
+            fields = self.json_fields()
+            values = tuple([getattr(self, name) for name in fields])
+            try:
+                cached = _fields_hash(fields, values, tuple(map(type, values)))
+            except TypeError:
+                # a field value is a list or dict, which can not be a key of the LRU
+                cached = hashlib.sha256(self.canonical_json()).hexdigest()
+            _set_slot(self, "_hash", cached)
+        return cached
+
+
+_set_slot = object.__setattr__
 
 
 class Hasher:
@@ -19,12 +85,22 @@ class Hasher:
         """
         Calculates the hash of a given object.
         """
+        if isinstance(obj, HashCached):
+            return obj.hash()
         if type(obj) == bytes:
             return hashlib.sha256(obj).hexdigest()
         if type(obj) == str:
             return hashlib.sha256(obj.encode()).hexdigest()
-        obj_string = json.dumps(obj.to_json(), sort_keys=True).encode()
-        return hashlib.sha256(obj_string).hexdigest()
+        return hashlib.sha256(Hasher.encode(obj)).hexdigest()
+
+    @staticmethod
+    def encode(obj):
+        """
+        Returns the canonical json bytes of an object, which object_hash hashes.
+        """
+        if isinstance(obj, JsonSerializable):
+            return obj.canonical_json()
+        return json.dumps(obj.to_json(), sort_keys=True).encode()
 
     @staticmethod
     def hash(data: str):
@@ -42,3 +118,33 @@ class Hasher:
         h.update(data1)
         if data2 is not None: h.update(data2)
         return h.digest()
+
+
+class PrefixHasher:
+    """
+    Hashes an object that only differs in one integer field between attempts.
+
+    The canonical json of the object is split around the field once, the part
+    before the field is fed into a sha256 state (midstate), and each attempt only
+    formats the field value and the part after it. The result equals
+    Hasher.object_hash(obj) with the field set to the given value.
+    """
+
+    # a placeholder that can not appear in the json of the object
+    MARKER = "\x00PrefixHasher\x00"
+
+    def __init__(self, obj, field: str = "nonce"):
+        json_data = dict(obj.to_json())
+        json_data[field] = PrefixHasher.MARKER
+        obj_string = json.dumps(json_data, sort_keys=True)
+        prefix, suffix = obj_string.split(json.dumps(PrefixHasher.MARKER))
+        self.midstate = hashlib.sha256(prefix.encode())
+        self.suffix = suffix.encode()
+
+    def hash(self, value: int):
+        """
+        Calculates the hash of the object with the field set to value.
+        """
+        h = self.midstate.copy()
+        h.update(b"%d%s" % (value, self.suffix))
+        return h.hexdigest()
@@ -0,0 +1,171 @@
+import concurrent.futures
+import os
+from src.difficulty import now_ms
+from src.miner import meets_difficulty
+from src.util import Hasher
+from src.zero_merkle import root_version, transaction_root
+
+# Chains with fewer new blocks than this are verified in the calling thread.
+PARALLEL_BLOCKS = 64
+
+
+class VerificationReport:
+    """
+    The result of verifying a chain, evaluates to True if the chain is valid.
+    """
+
+    def __init__(self, valid: bool, height: int = None, reason: str = "", common_prefix: int = 0, verified: int = 0):
+        self.valid = valid
+        self.height = height  # the height of the first invalid block
+        self.reason = reason  # why the block is invalid
+        self.common_prefix = common_prefix  # number of leading blocks that equal the trusted chain
+        self.verified = verified  # number of blocks that were verified
+
+    def __bool__(self):
+        return self.valid
+
+    def to_json(self):
+        return self.__dict__
+
+    def __repr__(self):
+        if self.valid:
+            return f"VerificationReport(valid, common_prefix={self.common_prefix}, verified={self.verified})"
+        return f"VerificationReport(invalid block {self.height}: {self.reason})"
+
+
+def common_prefix(trusted_headers: list, block_headers: list):
+    """
+    Finds the number of leading headers that block_headers shares with trusted_headers.
+    Both chains must be hash linked, so if two headers are equal all headers before them
+    are equal too, and the boundary can be found by binary search. The links of
+    block_headers have to be checked before, see verify_headers.
+    """
+    low, high = 0, min(len(trusted_headers), len(block_headers))
+    while low < high:
+        middle = (low + high + 1) >> 1
+        if trusted_headers[middle - 1].to_json() == block_headers[middle - 1].to_json():
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+def verify_headers(block_headers: list, trusted_headers: list = None, previous_header = None,
+                   schedule = None, ancestors: list = None):
+    """
+    Verifies the heights, hash links and pows of a chain of headers. The heights and
+    links of all headers are checked in one cheap pass first, then the pows and the
+    schedule of the headers it does not share with a trusted chain.
+    :param block_headers: list of block headers
+    :param trusted_headers: the headers of an already verified chain, e.g. the local one
+    :param previous_header: the verified header block_headers[0] links to, if it is not the genesis block
+    :param schedule: the DifficultySchedule the difficulty and timestamp of each block must follow
+    :param ancestors: the verified headers by height, which the schedule may look up below previous_header
+    :returns a VerificationReport
+    """
+    if len(block_headers) == 0:
+        return VerificationReport(False, reason="the chain is empty")
+
+    base = previous_header.height + 1 if previous_header is not None else 0  # the height of block_headers[0]
+
+    def header_at(height: int):
+        if height >= base:
+            return block_headers[height - base]
+        if height == base - 1:
+            return previous_header
+        return ancestors[height]
+
+    hashes = []
+    previous_hash = Hasher.object_hash(previous_header) if previous_header is not None else None
+    for i, block_header in enumerate(block_headers):
+        if block_header.height != base + i:
+            return VerificationReport(False, i, "height mismatch")
+        # check if the block links to the previous block, except the genesis block
+        if (i > 0 or previous_hash is not None) and block_header.previous_hash != previous_hash:
+            return VerificationReport(False, i, "previous hash mismatch")
+        previous_hash = Hasher.object_hash(block_header)
+        hashes.append(previous_hash)
+
+    # the headers are linked now, so the shared ones can be found by bisection
+    start = common_prefix(trusted_headers, block_headers) if trusted_headers else 0
+    now = now_ms()
+    for i in range(start, len(block_headers)):
+        if not meets_difficulty(hashes[i], block_headers[i].difficulty):
+            return VerificationReport(False, i, "invalid proof of work", start)
+        if schedule is not None:
+            reason = schedule.check(block_headers[i], header_at, now)
+            if reason:
+                return VerificationReport(False, i, reason, start)
+    return VerificationReport(True, common_prefix=start, verified=len(block_headers) - start)
+
+
+def _verify_roots(start: int, block_headers: list, transactions: list):
+    for i in range(len(block_headers)):
+        if transactions[i] is None:
+            continue  # a block of the trusted chain, whose transactions the caller keeps
+        # the root is checked in the version it was built with, so blocks of older versions still verify
+        root = block_headers[i].transaction_root
+        version = root_version(root)
+        if version is None or root != transaction_root(transactions[i], version, workers=1):
+            return start + i
+    return None
+
+
+def verify_transactions(block_headers: list, transactions: list, start: int = 0, workers: int = None,
+                        executor = None):
+    """
+    Verifies the transaction roots of blocks, in a process pool for long chains.
+    :param transactions: the transactions of each block, the ones before start may be None
+    :param start: the number of leading blocks shared with a trusted chain, whose
+                  transactions are only verified if they are given
+    :param workers: number of worker processes, defaults to the number of cpus
+    :param executor: a long-lived process pool to use instead of a new one, e.g. ZeroChain.executor
+    :returns a VerificationReport
+    """
+    if len(block_headers) != len(transactions) or any(txs is None for txs in transactions[start:]):
+        return VerificationReport(False, reason="the chain is incomplete", common_prefix=start)
+
+    workers = workers or os.cpu_count() or 1
+    count = sum(1 for txs in transactions if txs is not None)
+    if count < PARALLEL_BLOCKS or (workers == 1 and executor is None):
+        failure = _verify_roots(0, block_headers, transactions)
+    else:
+        size = -(-len(block_headers) // (workers * 4))
+        batches = range(0, len(block_headers), size)
+        args = (batches, [block_headers[b:b + size] for b in batches], [transactions[b:b + size] for b in batches])
+        if executor is not None:
+            failure = next((r for r in executor.map(_verify_roots, *args) if r is not None), None)
+        else:
+            with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+                failure = next((r for r in pool.map(_verify_roots, *args) if r is not None), None)
+
+    if failure is not None:
+        return VerificationReport(False, failure, "transaction root mismatch", start)
+    return VerificationReport(True, common_prefix=start, verified=count)
+
+
+def verify_chain(block_headers: list, transactions: list, trusted_headers: list = None, workers: int = None,
+                 schedule = None, executor = None):
+    """
+    Verifies a chain, skipping the pows of the blocks it shares with a trusted chain.
+
+    The heights and hash links of all headers are checked in one pass first, then the
+    pows and difficulties of the new blocks, then the transaction roots of every block
+    whose transactions are given, in a process pool for long chains.
+    :param block_headers: list of block headers
+    :param transactions: list of transactions of each block, None for a block shared with the
+                         trusted chain, whose transactions the caller keeps. Transactions given
+                         for shared blocks are verified, since they may differ from the trusted ones.
+    :param trusted_headers: the headers of an already verified chain, e.g. the local one
+    :param workers: number of worker processes, defaults to the number of cpus
+    :param schedule: the DifficultySchedule the blocks must follow, None to only check the pows
+    :param executor: a long-lived process pool to use instead of a new one
+    :returns a VerificationReport
+    """
+    if len(block_headers) != len(transactions) or len(block_headers) == 0:
+        return VerificationReport(False, reason="the chain is empty or incomplete")
+
+    report = verify_headers(block_headers, trusted_headers, schedule=schedule)
+    if not report:
+        return report
+    return verify_transactions(block_headers, transactions, report.common_prefix, workers, executor)
@@ -0,0 +1,266 @@
+import struct
+
+# The media type of the binary encoding, JSON stays the default.
+MIMETYPE = "application/x-zerochain"
+
+# Block header: height, difficulty, nonce, timestamp, then previous_hash and transaction_root.
+_HEADER = struct.Struct(">QIQQ")
+_U8 = struct.Struct(">B")
+_U16 = struct.Struct(">H")
+_U32 = struct.Struct(">I")
+_I64 = struct.Struct(">q")
+_F64 = struct.Struct(">d")
+
+# tags of hash fields, a versioned digest is "v<version>:<hex digest>" like the transaction roots of version 1
+_EMPTY, _DIGEST, _TEXT, _VERSIONED = 0, 1, 2, 3
+# tags of amount fields
+_INT, _STR, _FLOAT, _BOOL = 0, 1, 2, 3
+
+
+class WireError(ValueError):
+    pass
+
+
+# The following encode the json dict of an object, so decoding gives the same dict back.
+
+def _encode_text(value: str, out: bytearray):
+    data = value.encode()
+    if len(data) > 0xFFFF:
+        raise WireError(f"text of {len(data)} bytes is too long")
+    out += _U16.pack(len(data))
+    out += data
+
+
+def _decode_text(data, offset: int):
+    size, = _U16.unpack_from(data, offset)
+    offset += 2
+    return bytes(data[offset:offset + size]).decode(), offset + size
+
+
+def _digest(value: str):
+    """ Returns the 32 bytes of a hex digest, None if the value is not one in its canonical form. """
+    if len(value) != 64:
+        return None
+    try:
+        digest = bytes.fromhex(value)
+    except ValueError:
+        return None
+    return digest if digest.hex() == value else None
+
+
+def _encode_hash(value: str, out: bytearray):
+    """ A hex digest is sent as 32 raw bytes, a versioned one with its version first, anything else as text. """
+    if value == "":
+        out += _U8.pack(_EMPTY)
+        return
+    digest = _digest(value)
+    if digest is not None:
+        out += _U8.pack(_DIGEST)
+        out += digest
+        return
+    version, separator, rest = value[1:].partition(":")
+    if value.startswith("v") and separator and version.isascii() and version.isdigit() and str(int(version)) == version \
+            and int(version) < 256:
+        digest = _digest(rest)
+        if digest is not None:
+            out += _U8.pack(_VERSIONED)
+            out += _U8.pack(int(version))
+            out += digest
+            return
+    out += _U8.pack(_TEXT)
+    _encode_text(value, out)
+
+
+def _decode_hash(data, offset: int):
+    tag = data[offset]
+    offset += 1
+    if tag == _EMPTY:
+        return "", offset
+    if tag == _DIGEST:
+        return bytes(data[offset:offset + 32]).hex(), offset + 32
+    if tag == _TEXT:
+        return _decode_text(data, offset)
+    if tag == _VERSIONED:
+        return f"v{data[offset]}:{bytes(data[offset + 1:offset + 33]).hex()}", offset + 33
+    raise WireError(f"unknown hash tag {tag}")
+
+
+def encode_header(header: dict, out: bytearray):
+    fields = header["height"], header["difficulty"], header["nonce"], header["timestamp"]
+    # a bool is an int to struct, but it would come back as an int with another hash
+    if not all(type(field) is int for field in fields):
+        raise WireError("header fields must be integers")
+    try:
+        out += _HEADER.pack(*fields)
+    except struct.error as e:
+        raise WireError(f"can not encode header: {e}") from e
+    _encode_hash(header["previous_hash"], out)
+    _encode_hash(header["transaction_root"], out)
+
+
+def decode_header(data, offset: int):
+    """ :returns (the json dict of the header, offset after it) """
+    height, difficulty, nonce, timestamp = _HEADER.unpack_from(data, offset)
+    previous_hash, offset = _decode_hash(data, offset + _HEADER.size)
+    transaction_root, offset = _decode_hash(data, offset)
+    return {"height": height, "previous_hash": previous_hash, "transaction_root": transaction_root,
+            "difficulty": difficulty, "nonce": nonce, "timestamp": timestamp}, offset
+
+
+def can_encode(txn) -> bool:
+    """ :returns True if the transaction can be held by the wire format """
+    try:
+        encode_transaction(txn.to_json(), bytearray())
+    except (WireError, KeyError):
+        return False
+    return True
+
+
+def encode_transaction(txn: dict, out: bytearray):
+    _encode_text(txn["sender"], out)
+    _encode_text(txn["receiver"], out)
+    # amount is an int, but the type is kept since it is part of the transaction hash
+    amount = txn["amount"]
+    if type(amount) == int:
+        if not -(1 << 63) <= amount < (1 << 63):
+            raise WireError(f"amount {amount} does not fit in 64 bits")
+        out += _U8.pack(_INT)
+        out += _I64.pack(amount)
+    elif type(amount) == str:
+        out += _U8.pack(_STR)
+        _encode_text(amount, out)
+    elif type(amount) == float:
+        out += _U8.pack(_FLOAT)
+        out += _F64.pack(amount)
+    elif type(amount) == bool:
+        out += _U8.pack(_BOOL)
+        out += _U8.pack(amount)
+    else:
+        raise WireError(f"can not encode amount of type {type(amount).__name__}")
+
+
+def _decode_amount(data, offset: int):
+    tag = data[offset]
+    offset += 1
+    if tag == _INT:
+        amount, = _I64.unpack_from(data, offset)
+        return amount, offset + 8
+    if tag == _STR:
+        return _decode_text(data, offset)
+    if tag == _FLOAT:
+        amount, = _F64.unpack_from(data, offset)
+        return amount, offset + 8
+    if tag == _BOOL:
+        return data[offset] != 0, offset + 1
+    raise WireError(f"unknown amount tag {tag}")
+
+
+def decode_transaction(data, offset: int):
+    """ :returns (the json dict of the transaction, offset after it) """
+    sender, offset = _decode_text(data, offset)
+    receiver, offset = _decode_text(data, offset)
+    amount, offset = _decode_amount(data, offset)
+    return {"sender": sender, "receiver": receiver, "amount": amount}, offset
+
+
+def encode_block(block_header, transactions: list, out: bytearray):
+    """
+    Encodes one block: the header, its number of transactions and the transactions.
+    :raises WireError if a field can not be represented, out may then hold part of the block
+    """
+    encode_header(block_header.to_json(), out)
+    encode_transactions(transactions, out)
+
+
+def encode_transactions(transactions: list, out: bytearray):
+    """ Encodes the transactions of a block: their number, then each transaction. """
+    out += _U32.pack(len(transactions))
+    for txn in transactions:
+        encode_transaction(txn.to_json(), out)
+
+
+def _transfer_json(sender: str, receiver: str, amount):
+    return {"sender": sender, "receiver": receiver, "amount": amount}
+
+
+def decode_block(data: bytes, offset: int, transaction=_transfer_json):
+    """
+    Decodes the output of encode_block.
+    :param transaction: a function from (sender, receiver, amount) to a transaction, e.g. TransferTxn
+                        to skip the json dicts, json dicts by default
+    :returns (header json dict, list of transactions, offset after the block)
+    """
+    header, offset = decode_header(data, offset)
+    txs, offset = decode_transactions(data, offset, transaction)
+    return header, txs, offset
+
+
+def decode_transactions(data: bytes, offset: int, transaction=_transfer_json):
+    """
+    Decodes the output of encode_transactions.
+    :param transaction: makes each transaction, see decode_block
+    :returns (list of transactions, offset after them)
+    """
+    u16 = _U16.unpack_from
+    size, = _U32.unpack_from(data, offset)
+    offset += 4
+    txs = []
+    # transactions are decoded inline, this is the hot loop of a bulk sync
+    for _ in range(size):
+        n, = u16(data, offset)
+        sender = data[offset + 2:offset + 2 + n].decode()
+        offset += 2 + n
+        n, = u16(data, offset)
+        receiver = data[offset + 2:offset + 2 + n].decode()
+        offset += 2 + n
+        tag = data[offset]
+        if tag == _INT:
+            amount, = _I64.unpack_from(data, offset + 1)
+            offset += 9
+        else:
+            amount, offset = _decode_amount(data, offset)
+        txs.append(transaction(sender, receiver, amount))
+    return txs, offset
+
+
+def encode_range(start: int, count: int):
+    """ Encodes the start of encode_blocks, so a stream can send the blocks one by one after it. """
+    return _U32.pack(start) + _U32.pack(count)
+
+
+def encode_blocks(start: int, block_headers: list, transactions: list):
+    """
+    Encodes a range of blocks: start, number of blocks, then each block.
+    :param block_headers: list of BlockHeader
+    :param transactions: list of transactions of each block
+    :returns the encoded bytes
+    """
+    out = bytearray(encode_range(start, len(block_headers)))
+    for header, txs in zip(block_headers, transactions):
+        encode_block(header, txs, out)
+    return bytes(out)
+
+
+def decode_blocks(data, transaction=_transfer_json):
+    """
+    Decodes the output of encode_blocks.
+    :param transaction: makes each transaction, see decode_block
+    :returns (start, list of header json dicts, list of lists of transactions)
+    """
+    data = bytes(data)
+    try:
+        start, = _U32.unpack_from(data, 0)
+        count, = _U32.unpack_from(data, 4)
+        offset = 8
+        block_headers, transactions = [], []
+        for _ in range(count):
+            header, txs, offset = decode_block(data, offset, transaction)
+            block_headers.append(header)
+            transactions.append(txs)
+    except (struct.error, IndexError, UnicodeDecodeError) as e:
+        raise WireError(f"truncated or corrupt data: {e}") from e
+    if offset > len(data):
+        raise WireError("truncated data in the last block")
+    if offset < len(data):
+        raise WireError("trailing data after the last block")
+    return start, block_headers, transactions
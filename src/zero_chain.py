@@ -1,152 +1,737 @@
 
-import requests
-from src import transaction
-from src.zero_merkle import ZeroMerkleTree
-from src.util import JsonSerializable, Hasher
-
-
-class BlockHeader(JsonSerializable):
-    def __init__(self, height: int, previous_hash: str, transaction_root: str, difficulty: int, nonce: int=0):
+import concurrent.futures
+import threading
+import time
+import weakref
+from src import metrics, transaction, verifier, wire
+from src.difficulty import DifficultySchedule
+from src.state import BalanceIndex, ChainIndex, Snapshot
+from src.zero_merkle import merkle_tree, root_version
+from src.mempool import Mempool
+from src.miner import meets_difficulty
+from src.network import NDJSON, PeerClient
+from src.parallel_merkle import PARALLEL_THRESHOLD
+from src.util import HashCached, Hasher, PrefixHasher
+
+# metrics of the hot paths, updating them only checks a flag unless metrics are enabled
+POW_HASHES = metrics.counter("zerochain_pow_hashes_total", "Nonces tried by the pow")
+POW_SECONDS = metrics.histogram("zerochain_pow_seconds", "Seconds of each nonce search", ("result",))
+POW_RATE = metrics.gauge("zerochain_pow_hashes_per_second", "Nonces per second of the last nonce search")
+TEMPLATE_MERKLE_SECONDS = metrics.histogram("zerochain_block_merkle_seconds",
+                                            "Seconds to build the transaction root of a new block")
+BLOCKS_ADDED = metrics.counter("zerochain_blocks_added_total", "Mined blocks added to the chain")
+BLOCKS_STALE = metrics.counter("zerochain_blocks_stale_total", "Mined blocks dropped since the tip changed")
+VERIFY_SECONDS = metrics.histogram("zerochain_verify_seconds",
+                                   "Seconds to verify a chain, or the headers or transactions of a sync", ("check",))
+VERIFIED_BLOCKS = metrics.counter("zerochain_verified_blocks_total", "Blocks passed to verification", ("check",))
+
+
+class BlockHeader(HashCached):
+    __slots__ = ("height", "previous_hash", "transaction_root", "nonce", "difficulty", "timestamp")
+    LRU_BY_VALUE = True  # the same headers are downloaded and verified in every sync
+
+    def __init__(self, height: int, previous_hash: str, transaction_root: str, difficulty: int, nonce: int=0,
+                 timestamp: int=0):
         self.height = height
         self.previous_hash = previous_hash
         self.transaction_root = transaction_root
         self.nonce = nonce
-        self.difficulty = difficulty  # the default difficulty is 2
+        self.difficulty = difficulty  # number of leading zero bits of the block hash, set by the DifficultySchedule
+        self.timestamp = timestamp  # milliseconds since the epoch when the block was created
 
 
-class ZeroChain(object):
+class MemoryStore(object):
+    """
+    Keeps the chain in Python lists, see BlockStore for a store on disk.
+    """
     def __init__(self):
-        self.pending_transactions = []
-        self.block_headers = []  # a list of BlockHeader objects, one for each block
-        self.transactions = []  # a list of lists of transactions, one nested list for each block
-        self.difficulty = 2  # pow difficulty level
-        self.nodes = set()  # nodes in the network
-        self.node_ipport = ""  # the "ip:port" of this instance
+        self.headers = []  # a list of BlockHeader objects, one for each block
+        self.transactions = []  # a list of lists of transactions, one nested list for each block, None if pruned
+        self.snapshot = None  # the Snapshot the blocks before it are pruned to
+
+    def __len__(self):
+        return len(self.headers)
+
+    def append(self, block_header, transactions: list):
+        """ :param transactions: None for a block synced without its transactions, which is pruned next """
+        self.headers.append(block_header)
+        self.transactions.append(transactions)
 
-        # Create the genesis block
-        block_head = BlockHeader(0, "", "", self.difficulty)
-        self.pow_add_block(block_head)
+    def truncate(self, height: int):
+        """ Removes all blocks from the given height on. """
+        del self.headers[height:]
+        del self.transactions[height:]
 
-    def pow_add_block(self, block_header):
+    def prune(self, snapshot):
+        """ Drops the transactions of the blocks before the snapshot, the headers are kept. """
+        start = self.snapshot.height if self.snapshot is not None else 0
+        for height in range(start, snapshot.height):
+            self.transactions[height] = None
+        self.snapshot = snapshot
+
+
+class ZeroChain(object):
+    light = False  # a full node, see LightChain
+
+    HEADERS_PAGE = 2000  # max number of headers in one response
+    BLOCKS_PAGE = 100  # max number of blocks in one response
+    SYNC_TIMEOUT = 60.0  # seconds to wait for a neighbor to sync itself
+
+    MAX_BLOCK_TRANSACTIONS = 10000  # max number of transactions in a block
+    MAX_BLOCK_BYTES = 4 << 20  # max total size of the json of the transactions in a block
+    POW_CHECK_EVERY = 1 << 10  # number of nonces the serial pow tries between checks to stop
+    # a pruned chain is pruned to multiples of this height, which are the heights snapshots are served at
+    PRUNE_EVERY = 100
+    # number of full nodes which must send the same snapshot hash for a fast sync, the snapshot is not
+    # committed in the headers so a single node could send any balances
+    SNAPSHOT_QUORUM = 2
+
+    def __init__(self, miner=None, compact_history: bool = False, store=None, mempool=None, schedule=None,
+                 prune_depth: int = None):
+        # the pending transactions, which are included in the next blocks
+        self.mempool = mempool if mempool is not None else Mempool(max_txn_bytes=self.MAX_BLOCK_BYTES)
+        # the blocks of the chain, a MemoryStore or a BlockStore
+        self.store = store if store is not None else MemoryStore()
+        # balances and history of each account, and the block and transaction hash indexes,
+        # brought up to date by update_state()
+        self.state = BalanceIndex(self.store.snapshot)
+        self.index = ChainIndex()
+        # keep the transactions of this many latest blocks only, None to keep all of them
+        self.prune_depth = prune_depth
+        self._snapshot = None  # the last snapshot sent to a peer
+        # guards the chain, the mempool and the indexes, pow and network requests run without it
+        self.lock = threading.RLock()
+        # incremented when the tip of the chain changes, a block being mined on the old tip is stale
+        self.tip_version = 0
+        # incremented when a batch of transactions is added, a block being mined without them may be built again
+        self.pool_version = 0
+        # the difficulty of each block, retargeted toward a block interval
+        self.schedule = schedule if schedule is not None else DifficultySchedule()
+        self.nodes = frozenset()  # nodes in the network, replaced instead of changed so it can be read without the lock
+        self.full_nodes = frozenset()  # the nodes which answered the last tip request as full nodes
+        # node -> (block height, pruned height) of the full nodes at the last tip request
+        self.full_node_tips = {}
+        self.node_ipport = ""  # the "ip:port" of this instance
+        self.peers = PeerClient()  # sends requests to the nodes
+        self.miner = miner  # a ParallelMiner to run pow with, None to run pow in this process
+        self._executor = None  # the process pool of large merkle trees and long syncs, see executor
+        # store the transactions of mined blocks as TransferColumns instead of lists of objects
+        self.compact_history = compact_history
+        self.accounts = transaction.AccountTable()
+
+        # Create the genesis block, unless the store already has a chain. It must be the same on every
+        # node of a network, so it has a fixed timestamp instead of the time the node started at
+        if len(self.store) == 0:
+            block_head = BlockHeader(0, "", "", self.schedule.initial, timestamp=0)
+            self.pow_add_block(block_head)
+
+    @property
+    def executor(self):
+        """
+        The process pool which hashes large merkle trees and verifies long syncs. It is
+        created on first use and kept for the life of the chain, since starting worker
+        processes costs more than hashing most blocks. Shut down by close() or at exit.
+        """
+        with self.lock:
+            if self._executor is None:
+                self._executor = concurrent.futures.ProcessPoolExecutor()
+                self._close_executor = weakref.finalize(self, self._executor.shutdown)
+            return self._executor
+
+    def close(self):
+        """ Shuts down the process pool of the chain, it is started again if needed. """
+        with self.lock:
+            if self._executor is not None:
+                self._close_executor()
+                self._executor = None
+
+    def pow_add_block(self, block_header, txids: list = (), timeout: float = None):
         """
         Run one round of pow to get a valid block and add to chain.
+        :param txids: the hashes of the pending transactions included in the block
+        :param timeout: seconds to run pow for
+        :returns True if the block is added, False if the pow was cancelled or timed out,
+                 or another block was added to the chain meanwhile
         """
+        with self.lock:
+            transactions = [self.mempool.get(txid) for txid in txids]
+        if not self.run_pow(block_header, timeout):
+            return False
+        return self.add_block(block_header, transactions, txids)
 
-        # run pow
-        while self.proof_pow(block_header) is False:
-            block_header.nonce += 1
-
-        self.block_headers.append(block_header)
-        self.transactions.append(self.pending_transactions)
-        # Clear new transaction list
-        self.pending_transactions = []
-
+    def run_pow(self, block_header, timeout: float = None, stop=None):
+        """
+        Searches the nonce of the block_header, without holding the lock.
+        :param timeout: seconds to search before giving up, None to search until found
+        :param stop: a function which is called regularly during the search, the search is dropped if it returns True
+        :returns False if the pow was cancelled, stopped or timed out
+        """
+        start = time.perf_counter()
+        if self.miner is not None:
+            found = self.miner.mine(block_header, timeout, stop)
+            attempts = self.miner.attempts
+        else:
+            found, attempts = self._serial_pow(block_header, timeout, stop)
+        if metrics.REGISTRY.enabled:
+            seconds = time.perf_counter() - start
+            POW_HASHES.inc(attempts)
+            POW_SECONDS.observe(seconds, ("found" if found else "dropped",))
+            if seconds > 0:
+                POW_RATE.set(attempts / seconds)
+        return found
+
+    def _serial_pow(self, block_header, timeout: float, stop):
+        """ :returns (True if a valid nonce was found, number of nonces tried) """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        # only the nonce changes between attempts, so hash the rest of the header once
+        hasher = PrefixHasher(block_header)
+        difficulty = block_header.difficulty
+        start = nonce = block_header.nonce
+        while True:
+            for nonce in range(nonce, nonce + self.POW_CHECK_EVERY):
+                if meets_difficulty(hasher.hash(nonce), difficulty):
+                    block_header.nonce = nonce
+                    return True, nonce - start + 1
+            nonce += 1
+            if stop is not None and stop():
+                return False, nonce - start
+            if deadline is not None and time.monotonic() > deadline:
+                return False, nonce - start
+
+    def add_block(self, block_header, transactions: list, txids: list = ()):
+        """
+        Adds a mined block on top of the chain.
+        :param txids: the hashes of the transactions, which are removed from the pending pool
+        :returns False if the block is stale, i.e. the chain tip is no longer the block it was built on
+        :raises WireError if the block can not be stored, its transactions that can not be encoded are removed
+                from the pending pool so that the next block does not fail the same way
+        """
+        with self.lock:
+            if block_header.height != self.block_height or \
+                    (block_header.height > 0 and block_header.previous_hash != Hasher.object_hash(self.latest_block)):
+                BLOCKS_STALE.inc()
+                return False
+            try:
+                self.store.append(block_header, self.stored_transactions(transactions))
+            except wire.WireError:
+                self.mempool.remove([txid for txid, txn in zip(txids, transactions) if not wire.can_encode(txn)])
+                raise
+            self.tip_version += 1
+            self.update_state()
+            self.prune()
+            # Remove the included transactions from the pending pool, the ones that arrived meanwhile stay
+            self.mempool.remove(txids)
+            BLOCKS_ADDED.inc()
+            return True
 
-    def create_block(self):
+    def block_template(self):
         """
-        Creates a block and include all transactions in self.pending_transactions.
-        :returns the new created block_header
+        Builds the next block from the pending transactions, up to the max block size.
+        :returns (block_header to run pow on, its transactions, their hashes)
+        """
+        with self.lock:
+            txids = self.mempool.select(self.MAX_BLOCK_TRANSACTIONS, self.MAX_BLOCK_BYTES)
+            with TEMPLATE_MERKLE_SECONDS.time():
+                # only a tree as large as the threshold is hashed in the pool, don't start it for others
+                executor = self.executor if len(txids) >= PARALLEL_THRESHOLD else None
+                transaction_root = self.mempool.root_hash(txids, executor)
+            transactions = [self.mempool.get(txid) for txid in txids]
+            block_header = BlockHeader(height = self.block_height,
+                                       previous_hash = Hasher.object_hash(self.latest_block),
+                                       transaction_root = transaction_root,
+                                       difficulty = self.difficulty,
+                                       nonce = 0,
+                                       timestamp = self.schedule.timestamp(self.latest_block))
+        return block_header, transactions, txids
+
+
+    def create_block(self, timeout: float = None):
+        """
+        Creates a block and include the pending transactions in it, up to the max block size.
+        The pow runs without the lock, if another block is added meanwhile the pow is
+        dropped and the block is created again on top of it.
+        :param timeout: seconds to run each round of pow for
+        :returns the new created block_header, None if the pow was cancelled or timed out
         """
 
-        # create transaction merkle tree and get the root
-        transaction_tree = ZeroMerkleTree(self.pending_transactions)
-        transaction_root = transaction_tree.root_hash
-        block_header = BlockHeader(height = self.block_height,
-                                   previous_hash = Hasher.object_hash(self.latest_block),
-                                   transaction_root = transaction_root,
-                                   difficulty = self.difficulty,
-                                   nonce = 0)
-        self.pow_add_block(block_header)
-        return block_header
+        while True:
+            tip_version = self.tip_version
+            block_header, transactions, txids = self.block_template()
+            if not self.run_pow(block_header, timeout, lambda: self.tip_version != tip_version):
+                if self.tip_version != tip_version:
+                    continue
+                return None
+            if self.add_block(block_header, transactions, txids):
+                return block_header
 
     @staticmethod
-    def proof_pow(block_header):
+    def proof_pow(block_header, schedule = None, block_headers: list = None):
         """
         Validates the block_header
         :param block_header:
+        :param schedule: the DifficultySchedule the difficulty and timestamp must follow, None to only check the pow
+        :param block_headers: the headers of the chain the block is added to, which the schedule looks up
         :returns True if the block_header is a valid pow.
         """
-        difficulty = block_header.difficulty
-        return Hasher.object_hash(block_header)[:difficulty] == "0" * difficulty
+        if not meets_difficulty(Hasher.object_hash(block_header), block_header.difficulty):
+            return False
+        return schedule is None or not schedule.check(block_header, block_headers.__getitem__)
 
     def transfer(self, sender, receiver, amount):
         """
         Creates a transfer transaction and added to the new transaction pool.
         :returns the created transaction
+        :raises MempoolError if the transaction is a duplicate or the pool is full
         """
 
         txn = transaction.TransferTxn(sender, receiver, amount)
-        self.pending_transactions.append(txn)
+        with self.lock:
+            self.mempool.add(txn)
         return txn
 
+    def transfer_many(self, transfers):
+        """
+        Creates transfer transactions and adds them to the new transaction pool in one call.
+        :param transfers: (sender, receiver, amount) of each transfer
+        :returns a list of (txid, None) for each added transaction, (None, error) for each rejected one
+        """
+        txns = [transaction.TransferTxn(sender, receiver, amount) for sender, receiver, amount in transfers]
+        with self.lock:
+            results = self.mempool.add_many(txns)
+            if any(error is None for _, error in results):
+                self.pool_version += 1
+            return results
+
+    def stored_transactions(self, transactions: list):
+        """ Returns the form the transactions of a block are kept in self.transactions. """
+        if transactions is None:
+            return None  # pruned
+        if self.compact_history:
+            return transaction.TransferColumns(transactions, self.accounts)
+        return transactions
+
+    def find_block(self, block_id: str):
+        """
+        Finds a block by its hash or height.
+        :returns the height of the block, None if it is not in the chain
+        """
+        if block_id.isascii() and block_id.isdigit():
+            height = int(block_id)
+            return height if height < self.block_height else None
+        with self.lock:
+            self.update_state()
+            return self.index.find_block(block_id)
+
+    def find_transaction(self, txid: str):
+        """
+        Finds a transaction by its hash.
+        :returns (height, position, transaction, merkle proof), None if it is not in the chain
+        """
+        with self.lock:
+            self.update_state()
+            location = self.index.find_transaction(txid)
+            if location is None:
+                return None
+            height, position = location
+            txs = self.transactions[height]
+            version = root_version(self.block_headers[height].transaction_root)
+        # the proof is checked with zero_merkle.verify_proof against the transaction_root
+        return height, position, txs[position], merkle_tree(txs, version).proof(position)
+
     # The following are network related functions.
 
     def add_node(self, new_node: str, propagate: bool):
         """ Adds a new node and propagate to all neighbors if necessary. """
-        # skip if the new_node is already added
-        if new_node in self.nodes:
-            return
-        # skip to add self as a neighbor
-        if new_node == self.node_ipport:
-            return
-        # add the new node to the node set
-        self.nodes.add(new_node)
-        if propagate:
-            # then, propagate the new node to all neighbors, set propagate = False to prevent recursive calls
-            nodes = [n for n in self.nodes]
-            for n in nodes:
-                for m in nodes:
-                    if not m == n:
-                        requests.post(f"http://{n}/register_node", data={"node": m, "propagate": False})
-            # finally, add myself to new_node's neighbor list
-            requests.post(f"http://{new_node}/register_node", data={"node": self.node_ipport, "propagate": True})
+        self.add_nodes([new_node], propagate)
+
+    def add_nodes(self, new_nodes: list, propagate: bool):
+        """
+        Adds new nodes and propagate to all neighbors if necessary.
+        Each neighbor is sent the nodes it does not know yet in one request.
+        """
+        # skip the nodes that are already added, and self
+        delta = set(new_nodes) - self.nodes - {self.node_ipport}
+        while delta:
+            with self.lock:
+                # skip the nodes added by another request meanwhile
+                delta -= self.nodes
+                known = list(self.nodes)
+                # add the new nodes to the node set
+                self.nodes = self.nodes | delta
+            if not delta or not propagate:
+                return
+            # then, send the new nodes to all neighbors, set propagate = False to prevent recursive calls
+            self.peers.post_all(known, "/register_node", {"node": list(delta), "propagate": False})
+            # send myself and all neighbors to the new nodes
+            self.peers.post_all(delta, "/register_node",
+                                {"node": [self.node_ipport] + known + list(delta), "propagate": False})
+            # finally, add the neighbors of the new nodes that are still unknown
+            responses = self.peers.get_all(delta, "/nodes")
+            delta = set()
+            for response in responses.values():
+                if response is None:
+                    continue
+                try:
+                    nodes = response.json()["nodes"]
+                    if not isinstance(nodes, list) or not all(isinstance(n, str) for n in nodes):
+                        raise TypeError("nodes must be a list of strings")
+                except (ValueError, KeyError, TypeError):
+                    continue  # a malformed answer, the other nodes are still added
+                delta.update(nodes)
+            delta -= self.nodes | {self.node_ipport}
 
 
     def sync_self(self):
         """
         Sync with other nodes in the network, replace current chain with
-        the longest valid chain in the network
+        the longest valid chain in the network.
+        Only the headers after the fork point and the missing blocks are downloaded.
         :return: True if current chain is replaced otherwise False
         """
 
+        synced = self.sync_headers()
+        if synced is None:
+            return False
+        longest_node, fork, headers = synced
+        if fork < self.pruned_height:
+            return False  # the blocks after the fork point can not be undone, their transactions are pruned
+        tip = fork + len(headers)
+
+        # then download the missing blocks from a full node which still has them, the longest node first
+        for node in self.block_sources(longest_node, tip):
+            blocks = self.fetch_blocks(node, fork, headers)
+            if blocks is None:
+                continue  # the node does not have the blocks, or they are not the ones of the headers
+            start, transactions, snapshot = blocks
+            with self.lock:
+                if not self.extends_chain(fork, headers):
+                    return False
+                self.replace_blocks(fork, headers, [None] * (start - fork) + transactions, snapshot)
+            return True
+        return False
+
+    def block_sources(self, longest_node: str, tip: int):
+        """
+        :returns the full nodes with at least tip blocks, the longest node first and then the longest chains first
+        """
+        nodes = [node for node, (block_height, _) in self.full_node_tips.items()
+                 if block_height >= tip and node != longest_node]
+        nodes.sort(key=lambda node: self.full_node_tips[node][0], reverse=True)
+        return [longest_node] + nodes if longest_node in self.full_node_tips else nodes
+
+    def fetch_blocks(self, node: str, fork: int, headers: list):
+        """
+        Downloads the transactions of the blocks after the fork point from a node, and verifies them.
+        A pruned chain fetches the state of the blocks it would prune at once instead of their transactions,
+        at the pruned height of the node if the node has pruned deeper.
+        :returns (the height the transactions start at, the transactions, the Snapshot or None),
+                 None if the node can not send them or they are not valid
+        """
+        tip = fork + len(headers)
+        pruned_height = self.full_node_tips.get(node, (0, 0))[1]
+        snapshot = None
+        if self.prune_depth is not None:
+            # peers only serve snapshots at checkpoint heights, or the height they are pruned to
+            height = max(pruned_height, self.checkpoint(tip - self.prune_depth))
+            if fork < height <= tip:
+                snapshot = self.fetch_snapshot(node, height, Hasher.object_hash(headers[height - 1 - fork]))
+        if snapshot is None and pruned_height > fork:
+            return None  # the node has pruned the blocks after the fork point, and its snapshot was refused
+        start = snapshot.height if snapshot is not None else fork
+
+        # download the missing blocks page by page
+        transactions = self.download_blocks(node, start, tip)
+        if transactions is None:
+            return None
+
+        VERIFIED_BLOCKS.inc(len(transactions), ("transactions",))
+        with VERIFY_SECONDS.time(("transactions",)):
+            executor = self.executor if len(transactions) >= verifier.PARALLEL_BLOCKS else None
+            valid = verifier.verify_transactions(headers[start - fork:], transactions, executor=executor)
+        if not valid:
+            return None  # chain validation fail
+        return start, transactions, snapshot
+
+    def download_blocks(self, node: str, start: int, stop: int):
+        """
+        Downloads the transactions of the blocks [start, stop) from a node, page by page.
+        :return: list of transactions of each block, None if the node fails
+        """
+        transactions = []
+        for start in range(start, stop, ZeroChain.BLOCKS_PAGE):
+            end = min(start + ZeroChain.BLOCKS_PAGE, stop)
+            response = self.peers.get(node, "/blocks", params={"from": start, "to": end}, stream=True,
+                                      headers={"Accept": f"{wire.MIMETYPE}, {NDJSON};q=0.8, application/json;q=0.5"})
+            if response is None:
+                return None
+            with response:
+                content_type = response.headers.get("Content-Type", "")
+                try:
+                    # we may need to take care of other types of transactions later
+                    if content_type.startswith(wire.MIMETYPE):
+                        # the transactions are made while decoding, without json dicts in between
+                        _, _, txs = wire.decode_blocks(response.content, transaction.TransferTxn)
+                    else:
+                        if content_type.startswith(NDJSON):
+                            # parse the blocks as they arrive
+                            page = (block["transactions"] for block in self.peers.json_lines(response))
+                        else:
+                            page = response.json()["transactions"]
+                        txs = [[transaction.TransferTxn.from_json(t) for t in tx] for tx in page]
+                    # the blocks of a peer follow the rules of new transfers, so an amount like a float
+                    # infinity can not break the balances, and the wire format of the store holds them
+                    for tx in txs:
+                        for t in tx:
+                            transaction.check_transfer(t.sender, t.receiver, t.amount)
+                except (ValueError, KeyError, TypeError):
+                    return None
+            if len(txs) != end - start:
+                return None
+            transactions.extend(txs)
+        return transactions
+
+    def fetch_snapshot(self, node: str, height: int, block_hash: str):
+        """
+        Downloads the snapshot of the balances after the first height blocks from a node, for a fast sync.
+        The state is not part of the headers, so the snapshot must be anchored to the verified hash of
+        block height - 1, every other full node with the same block must send the same snapshot hash, and
+        at least SNAPSHOT_QUORUM nodes must have sent it.
+        :returns the Snapshot, None if it can not be verified, then the blocks are downloaded instead
+        """
+        response = self.peers.get(node, "/snapshot", params={"height": height})
+        if response is None:
+            return None
+        try:
+            snapshot = Snapshot.from_json(response.json()["snapshot"])
+        except (ValueError, KeyError, TypeError):
+            return None
+        if snapshot.height != height or snapshot.block_hash != block_hash:
+            return None
+        snapshot_hash = Hasher.object_hash(snapshot)
+        agreed = 1
+        others = self.full_nodes - {node}
+        for response in self.peers.get_all(others, "/snapshot", {"height": height, "hash": "True"}).values():
+            if response is None:
+                continue  # the node does not have the blocks
+            try:
+                other = response.json()
+                if other["block_hash"] != block_hash:
+                    continue  # the node is on another chain
+                if other["hash"] != snapshot_hash:
+                    return None
+            except (ValueError, KeyError, TypeError):
+                continue
+            agreed += 1
+        return snapshot if agreed >= self.SNAPSHOT_QUORUM else None
+
+    def longest_node(self, full: bool = False):
+        """
+        Asks every node for its tip, and remembers which nodes are full nodes and how far they are pruned.
+        :param full: only consider full nodes, which can send the transactions of their blocks
+        :returns (the node with the longest chain, its block height), None if no node is longer than this chain
+        """
         longest_node = None
         max_height = 0
-        # find the longest node in the network
-        for node in self.nodes:
-            response = requests.get(f"http://{node}/status")
-            if response.status_code == 200:
-                block_height = response.json()["block_height"]
-                if block_height > self.block_height and block_height > max_height:
-                    longest_node = node
-                    max_height = block_height
-
-        if longest_node is None:
+        full_node_tips = {}
+        for node, response in self.peers.get_all(self.nodes, "/tip").items():
+            if response is None:
+                continue
+            try:
+                tip = response.json()
+                block_height, pruned_height = tip["block_height"], tip.get("pruned_height", 0)
+                if type(block_height) is not int or type(pruned_height) is not int:
+                    raise TypeError("heights must be integers")
+            except (ValueError, KeyError, TypeError):
+                continue  # a malformed answer, the other nodes are still asked
+            if not tip.get("light", False):
+                full_node_tips[node] = (block_height, pruned_height)
+            elif full:
+                continue
+            if block_height > self.block_height and block_height > max_height:
+                longest_node = node
+                max_height = block_height
+        self.full_node_tips = full_node_tips
+        self.full_nodes = frozenset(full_node_tips)
+        return None if longest_node is None else (longest_node, max_height)
+
+    def sync_headers(self):
+        """
+        Downloads the headers of the longest chain in the network after the fork point, and verifies them.
+        :returns (the node, the fork point, the verified headers), None if there is no longer valid chain
+        """
+        longest = self.longest_node(full=not self.light)
+        if longest is None:
             # this node is already the longest node
-            return False
+            return None
+
+        # sync with the longest node, headers first
+        longest_node, max_height = longest
+        fork, headers = self.fetch_headers(longest_node, max_height)
+        if not headers:
+            return None
+        with self.lock:
+            if fork > self.block_height:
+                return None  # the chain was replaced meanwhile
+            previous_header = self.block_headers[fork - 1] if fork > 0 else None
+        VERIFIED_BLOCKS.inc(len(headers), ("headers",))
+        with VERIFY_SECONDS.time(("headers",)):
+            valid = verifier.verify_headers(headers, previous_header=previous_header,
+                                            schedule=self.schedule, ancestors=self.block_headers)
+        if not valid:
+            return None  # chain validation fail
+        return longest_node, fork, headers
+
+    def extends_chain(self, fork: int, headers: list):
+        """
+        Checks if headers downloaded after the fork point still make a longer chain,
+        since blocks may have been mined or synced while they were downloaded.
+        """
+        with self.lock:
+            if fork + len(headers) <= self.block_height:
+                return False
+            return self.pruned_height <= fork <= self.block_height and \
+                (fork == 0 or Hasher.object_hash(self.block_headers[fork - 1]) == headers[0].previous_hash)
 
-        # sync with the longest node
-        response = requests.get(f"http://{longest_node}/fullnode")
-        if response.status_code == 200:
-            block_height = response.json()["block_height"]
-            block_headers = response.json()["block_headers"]
-            transactions = response.json()["transactions"]
-
-            # sanity check
-            if block_height > self.block_height and \
-                    block_height == len(block_headers) and \
-                    len(block_headers) == len(transactions):
-                # replace current node
-                bhs = [BlockHeader.from_json(b) for b in block_headers]
-                # we may need to take care of other types of transactions later
-                txs = [[transaction.TransferTxn.from_json(t) for t in tx] for tx in transactions]
-                if not ZeroChain.verify_chain(bhs, txs):
-                    return False  # chain validation fail
-                self.block_headers = bhs
-                self.transactions = txs
-                return True
-
-        # the longest node is not sound
-        return False
+    def replace_blocks(self, height: int, block_headers: list, transactions: list, snapshot = None):
+        """
+        Replaces the blocks from the given height on with verified blocks.
+        :param transactions: the transactions of each block, None for the blocks before the snapshot
+        :param snapshot: the verified Snapshot of a fast sync, the blocks before it are pruned
+        """
+        with self.lock:
+            self.store.truncate(height)
+            self.state.rollback(height)
+            self.index.rollback(height)
+            for block_header, txs in zip(block_headers, transactions):
+                self.store.append(block_header, self.stored_transactions(txs))
+            if snapshot is not None:
+                self.prune_to(snapshot)
+            self.tip_version += 1
+            self.update_state()
+            self.prune()
+
+    def prune(self):
+        """ Prunes the blocks deeper than prune_depth, up to the last checkpoint height below them. """
+        if self.prune_depth is None:
+            return
+        with self.lock:
+            height = self.checkpoint(self.block_height - self.prune_depth)
+            if height > self.pruned_height:
+                self.prune_to(self.snapshot(height))
+
+    def checkpoint(self, height: int):
+        """ Returns the last multiple of PRUNE_EVERY at or below height, the heights snapshots are served at. """
+        return height // self.PRUNE_EVERY * self.PRUNE_EVERY
+
+    def serves_snapshot(self, height: int):
+        """
+        Tells if peers may ask for the snapshot at height. A snapshot replays the blocks after the
+        pruned height, so only checkpoint heights and the pruned height are served, and the few
+        distinct heights peers ask for are mostly answered from the cache.
+        """
+        return height == self.pruned_height or height == self.checkpoint(height)
+
+    def prune_to(self, snapshot):
+        """
+        Drops the transactions of the blocks before a snapshot of this chain, the headers are kept.
+        The balance index continues from the snapshot, and the pruned transactions are no longer found.
+        """
+        with self.lock:
+            start = self.pruned_height
+            blocks = self.transactions[start:snapshot.height]
+            self.index.prune(start, blocks)
+            self.state.prune(snapshot, blocks)
+            self.store.prune(snapshot)
+
+    def snapshot(self, height: int):
+        """
+        Returns the Snapshot of the balances after the first height blocks.
+        :returns None if height is above the tip, or the blocks before it are pruned beyond the snapshot of the chain
+        """
+        with self.lock:
+            base = self.store.snapshot if self.store.snapshot is not None else Snapshot()
+            if not base.height <= height <= self.block_height:
+                return None
+            if height == base.height:
+                return base
+            block_hash = Hasher.object_hash(self.block_headers[height - 1])
+            cached = self._snapshot
+            if cached is not None and cached.height == height and cached.block_hash == block_hash:
+                return cached
+            blocks = self.transactions[base.height:height]
+        # peers ask for the same snapshot to compare hashes, so the last one is kept
+        self._snapshot = base.advance(block_hash, blocks)
+        return self._snapshot
+
+    def update_state(self):
+        """ Applies the blocks that are not in the balance index and hash indexes yet. """
+        with self.lock:
+            self.state.update(self.transactions)
+            self.index.update(self.block_headers, self.transactions)
+
+    def balance(self, account: str):
+        """ Returns the balance of an account. """
+        with self.lock:
+            self.update_state()
+            return self.state.balance(account)
+
+    def history(self, account: str):
+        """
+        Returns the transfers of an account, oldest first.
+        :returns a list of (height, position, transaction)
+        """
+        with self.lock:
+            self.update_state()
+            return [(height, position, self.transactions[height][position])
+                    for height, position in self.state.account_history(account)]
+
+    def fetch_headers(self, node: str, height: int):
+        """
+        Finds the fork point with a node, and downloads its headers after the fork point.
+        The fork point is searched backwards from the tip of this chain in doubling steps.
+        :param height: the block height of the node
+        :return: (the fork point, list of headers after it), headers is None if the node fails
+        """
+        step = 1
+        start = min(self.block_height, height) - 1
+        while True:
+            probe = self.get_headers(node, start, start + 1)
+            if not probe:
+                return 0, None
+            with self.lock:
+                local = self.block_headers[start].to_json() if start < self.block_height else None
+            if probe[0].to_json() == local:
+                fork = start + 1
+                break
+            if start == 0:
+                fork = 0  # not even the genesis block is shared
+                break
+            start = max(0, start - step)
+            step <<= 1
+        return fork, self.get_headers(node, fork, height)
+
+    def get_headers(self, node: str, start: int, stop: int):
+        """
+        Downloads the headers [start, stop) from a node.
+        :return: list of headers, None if the node fails
+        """
+        headers = []
+        while start + len(headers) < stop:
+            response = self.peers.get(node, "/headers",
+                                      params={"from": start + len(headers),
+                                              "count": min(ZeroChain.HEADERS_PAGE, stop - start - len(headers))})
+            if response is None:
+                return None
+            try:
+                page = [BlockHeader.from_json(b) for b in response.json()["block_headers"]]
+                for block_header in page:
+                    wire.encode_header(block_header.to_json(), bytearray())
+            except (ValueError, KeyError, TypeError):
+                return None  # malformed, or a header the wire format can not hold
+            if len(page) == 0:
+                break
+            headers.extend(page)
+        return headers
 
 
     def sync(self, propagate):
@@ -155,46 +740,56 @@ class ZeroChain(object):
 
         # then, ask all neighbors to sync themselves if necessary
         if propagate:
-            for node in self.nodes:
-                print(f"ask {node} to sync")
-                requests.get(f"http://{node}/sync?propagate=False")
+            print(f"ask {', '.join(self.nodes)} to sync")
+            self.peers.get_all(self.nodes, "/sync", {"propagate": False}, timeout=ZeroChain.SYNC_TIMEOUT)
         # return if this node is replaced
         return replaced
 
 
     @staticmethod
-    def verify_chain(block_headers: list, transactions: list):
+    def verify_chain(block_headers: list, transactions: list, trusted_headers: list = None, workers: int = None,
+                     schedule = None, executor = None):
         """
         Verify if a given chain is valid.
         :param block_headers: list of block headers
-        :param transactions: list of transactions of each block
-        :return: True if the given chain is valid
+        :param transactions: list of transactions of each block, None for a block shared with the trusted chain
+        :param trusted_headers: headers of a verified chain, the pows of blocks shared with it are not verified again
+        :param workers: number of processes to verify blocks with
+        :param schedule: the DifficultySchedule of the chain, the default schedule if it is None
+        :param executor: a long-lived process pool to verify blocks in, e.g. the executor of a chain
+        :return: a VerificationReport, which is True if the given chain is valid
         """
-        if len(block_headers) != len(transactions) and len(block_headers) == 0:
-            return False
+        if schedule is None:
+            schedule = DifficultySchedule()
+        VERIFIED_BLOCKS.inc(len(block_headers), ("chain",))
+        with VERIFY_SECONDS.time(("chain",)):
+            return verifier.verify_chain(block_headers, transactions, trusted_headers, workers, schedule, executor)
 
-        # an valid chain contains only the genesis block
-        if len(block_headers) == 1:
-            return True
 
-        # validate the all the rest of blocks
-        for i in range(len(block_headers)):
-            # check if the block links to the previous block except the genesis block
-            if i > 0:
-                if block_headers[i].previous_hash != Hasher.object_hash(block_headers[i-1]):
-                    return False
+    @property
+    def pending_transactions(self):
+        with self.lock:
+            return list(self.mempool)
 
-            # create transaction merkle tree and get the root
-            if block_headers[i].transaction_root != ZeroMerkleTree(transactions[i]).root_hash:
-                return False
+    @property
+    def block_headers(self):
+        return self.store.headers
 
-            # verify if the proof of work is correct
-            if not ZeroChain.proof_pow(block_headers[i]):
-                return False
+    @property
+    def transactions(self):
+        return self.store.transactions
 
-        # return True if all blcoks are fine
-        return True
+    @property
+    def difficulty(self):
+        """ The difficulty of the next block. """
+        with self.lock:
+            return self.schedule.difficulty(self.block_height, self.block_headers.__getitem__)
 
+    @property
+    def pruned_height(self):
+        """ The number of leading blocks whose transactions are pruned. """
+        snapshot = self.store.snapshot
+        return snapshot.height if snapshot is not None else 0
 
     @property
     def latest_block(self):
@@ -1,8 +1,95 @@
 
 import copy
+import hashlib
+import itertools
+from src import metrics
+from src.parallel_merkle import merkle_root
 from src.util import Hasher
 
+# the seconds each kind of tree takes to build, recorded when metrics are enabled
+BUILD_SECONDS = metrics.histogram("zerochain_merkle_build_seconds", "Seconds to build a merkle tree", ("tree",))
+
+# Transaction roots are versioned by a prefix of the root, so the blocks of older versions still verify.
+# Version 0 has no prefix, it is the ZeroMerkleTree of hex digests.
+# Version 1 is "v1:" and the DigestMerkleTree of raw digests.
+ROOT_VERSION = 1  # the version of new blocks
+ROOT_VERSIONS = (0, 1)
+
+# the first byte of the hashed data of a version 1 node, a leaf is the hash of json which starts with "{"
+_NODE = b"\x01"
+
+
+def root_version(root: str):
+    """ Returns the version of a transaction root, None if the version is unknown. """
+    if not root.startswith("v"):
+        return 0
+    version, separator, _ = root[1:].partition(":")
+    if separator and version.isascii() and version.isdigit() and int(version) in ROOT_VERSIONS:
+        return int(version)
+    return None
+
+
+def leaf_digests(items):
+    """
+    Returns the leaves of a version 1 tree in one batch: the raw digest of the hash of each item.
+    The hash of a transaction is its txid, so the leaves of transactions hashed before cost nothing.
+    """
+    object_hash = Hasher.object_hash
+    return bytes.fromhex("".join([object_hash(item) for item in items]))
+
+
+def transaction_root(items: list, version: int = ROOT_VERSION, workers: int = None, executor = None):
+    """
+    Calculates the transaction root of a block in the given version.
+    :param workers: number of processes to hash a version 0 tree with, see merkle_root
+    :param executor: a long-lived process pool to hash a large version 0 tree in, see merkle_root
+    :returns the root, "" for a block without transactions in every version
+    """
+    if version == 0:
+        return merkle_root(items, encoding="hex", workers=workers, executor=executor)
+    if version == 1:
+        with BUILD_SECONDS.time(("digest",)):
+            return _digest_root(items)
+    raise ValueError(f"unknown transaction root version: {version}")
+
+
+def _digest_root(items: list):
+    """ Calculates the root of a DigestMerkleTree layer by layer, without keeping the layers. """
+    sha256 = hashlib.sha256
+    layer = leaf_digests(items)
+    if not layer:
+        return ""
+    while len(layer) > 32:
+        end = len(layer) & ~63
+        parents = [sha256(_NODE + layer[i:i + 64]).digest() for i in range(0, end, 64)]
+        if len(layer) > end:  # move the last odd item to the upper layer
+            parents.append(layer[end:])
+        layer = b"".join(parents)
+    return f"v{DigestMerkleTree.VERSION}:{layer.hex()}"
+
+
+def merkle_tree(items: list, version: int = ROOT_VERSION):
+    """ Builds the tree of a transaction root version, to create inclusion proofs. """
+    if version == 0:
+        return CompactMerkleTree(items)
+    if version == 1:
+        return DigestMerkleTree(items)
+    raise ValueError(f"unknown transaction root version: {version}")
+
+
+def verify_proof(leaf, proof: list, root: str):
+    """ Verifies an inclusion proof against a transaction root of any version. """
+    version = root_version(root)
+    if version == 0:
+        return CompactMerkleTree.verify_proof(leaf, proof, root)
+    if version == 1:
+        return DigestMerkleTree.verify_proof(leaf, proof, root)
+    return False
+
+
 class MerkleNode:
+    __slots__ = ("left", "right", "hash")
+
     def __init__(self, left, right, hash: str = None):
         self.left = left
         self.right = right
@@ -16,7 +103,8 @@ class ZeroMerkleTree:
     def __init__(self, items: list, size = None):
         self.number_of_nodes = 0
         self.number_of_hashs = 0
-        self.root = self.construct(items, size)
+        with BUILD_SECONDS.time(("zero",)):
+            self.root = self.construct(items, size)
 
     @property
     def root_hash(self):
@@ -48,11 +136,62 @@ class ZeroMerkleTree:
             return MerkleNode(None, None, "")
 
 
+class ZeroMerkleAccumulator:
+    """
+    Computes the root of a ZeroMerkleTree while items are appended one by one.
+
+    Only the roots of the perfect subtrees (peaks) along the right edge of the
+    tree are kept, one for each set bit of the number of items. Because the
+    odd node of a layer is moved up unchanged, the root of the ZeroMerkleTree
+    is the peaks folded from the right: hash(peak_0, hash(peak_1, ...)).
+    With version 1 the peaks are raw digests, and the root is the one of a DigestMerkleTree.
+    """
+
+    def __init__(self, items: list = (), version: int = 0):
+        self.version = version
+        if version == 0:
+            self._leaf, self._node = Hasher.object_hash, lambda left, right: Hasher.hash(left + right)
+        elif version == 1:
+            self._leaf = lambda item: bytes.fromhex(Hasher.object_hash(item))
+            self._node = lambda left, right: hashlib.sha256(_NODE + left + right).digest()
+        else:
+            raise ValueError(f"unknown transaction root version: {version}")
+        self.size = 0
+        self.peaks = []  # (height, hash) of the perfect subtrees, from left to right
+        self._root_hash = ""
+        for item in items:
+            self.append(item)
+
+    def append(self, item):
+        """ Adds an item as the right most leaf. """
+        node = self._node
+        height, hash = 0, self._leaf(item)
+        while self.peaks and self.peaks[-1][0] == height:
+            hash = node(self.peaks.pop()[1], hash)
+            height += 1
+        self.peaks.append((height, hash))
+        self.size += 1
+        self._root_hash = None
+
+    @property
+    def root_hash(self):
+        if self._root_hash is None:
+            hash = self.peaks[-1][1]
+            for _, peak in reversed(self.peaks[:-1]):
+                hash = self._node(peak, hash)
+            self._root_hash = hash if self.version == 0 else f"v{self.version}:{hash.hex()}"
+        return self._root_hash
+
+    def __len__(self):
+        return self.size
+
+
 class BitcoinMerkleTree:
     def __init__(self, items: list, size = None):
         self.number_of_nodes = 0
         self.number_of_hashs = 0
-        self.root = self.construct(items, size)
+        with BUILD_SECONDS.time(("bitcoin",)):
+            self.root = self.construct(items, size)
 
     @property
     def root_hash(self):
@@ -90,7 +229,8 @@ class LibraMerkleTree:
     def __init__(self, items: list, size = None):
         self.number_of_nodes = 0
         self.number_of_hashs = 0
-        self.root = self.construct(items, size)
+        with BUILD_SECONDS.time(("libra",)):
+            self.root = self.construct(items, size)
 
     @property
     def root_hash(self):
@@ -127,13 +267,12 @@ class LibraMerkleTree:
 def BitcoinMerkleTreeLite(items: list, size = None):
     if size is None: size = len(items)
     layer = [Hasher.raw_hash(items[x]) for x in range(size)]
-    if len(layer) & 1 == 1:
-        layer.append(copy.copy(layer[-1]))
+    layer.append(b"")  # room for the duplicated odd item
 
-    items = len(layer)
+    items = size
     while items > 1:
         if items & 1 == 1:
-            layer[items] = copy.copy(layer[items+1])
+            layer[items] = copy.copy(layer[items-1])
             items += 1
         for i in range(0, items, 2):
             layer[i>>1] = Hasher.raw_hash(layer[i], layer[i + 1])
@@ -149,10 +288,9 @@ def BitcoinMerkleTreeLite(items: list, size = None):
 def LibraMerkleTreeLite(items: list, size = None):
     if size is None: size = len(items)
     layer = [Hasher.raw_hash(items[x]) for x in range(size)]
-    if len(layer) & 1 == 1:
-        layer.append(b"")
+    layer.append(b"")  # room for the extra null node
 
-    items = len(layer)
+    items = size
     while items > 1:
         if items & 1 == 1:
             layer[items] = b""
@@ -177,7 +315,7 @@ def ZeroMerkleTreeLite(items: list, size = None):
         for i in range(0, items - 1, 2):
             layer[i>>1] = Hasher.raw_hash(layer[i], layer[i + 1])
         if items & 1 == 1:  # move the last odd item to the upper layer
-            layer[(items+1)>>1] = layer[items-1]
+            layer[items>>1] = layer[items-1]
         items = (items+1)>>1
 
     # return the root
@@ -185,3 +323,197 @@ def ZeroMerkleTreeLite(items: list, size = None):
         return layer[0]
     else:
         return b""
+
+
+class CompactMerkleTree:
+    """
+    A merkle tree which stores the hashes of all layers as 32 byte digests in one bytearray.
+
+    The nodes of a layer are stored next to each other, and the children of
+    node i are nodes 2i and 2i + 1 of the layer below, so no node objects or
+    pointers are needed. The padding of an odd layer follows ZeroMerkleTree
+    ("zero"), BitcoinMerkleTree ("bitcoin") or LibraMerkleTree ("libra"),
+    and root_hash equals the root_hash of the matching tree.
+    """
+
+    DIGEST_SIZE = 32
+    PADDINGS = ("zero", "bitcoin", "libra")
+
+    def __init__(self, items: list, size = None, padding: str = "zero"):
+        if padding not in CompactMerkleTree.PADDINGS:
+            raise ValueError(f"unknown padding: {padding}")
+        if size is None:
+            size = len(items)
+        self.padding = padding
+        self.size = size
+
+        # the offset (in nodes) of each layer, the leaves are layer 0
+        self.offsets = [0]
+        self.counts = [size]
+        while self.counts[-1] > 1:
+            self.offsets.append(self.offsets[-1] + self.counts[-1])
+            self.counts.append((self.counts[-1] + 1) >> 1)
+        self.hashes = bytearray((self.offsets[-1] + self.counts[-1]) * CompactMerkleTree.DIGEST_SIZE)
+        with BUILD_SECONDS.time(("compact",)):
+            self.construct(items)
+
+    def construct(self, items: list):
+        view = memoryview(self.hashes)
+        for x in range(self.size):
+            view[x * 32:x * 32 + 32] = bytes.fromhex(Hasher.object_hash(items[x]))
+
+        for layer in range(len(self.counts) - 1):
+            count = self.counts[layer]
+            for i in range(self.counts[layer + 1]):
+                left = self.node(layer, i << 1)
+                if (i << 1) + 1 < count:
+                    hash = self._hash(left, self.node(layer, (i << 1) + 1))
+                elif self.padding == "zero":  # move the last odd item to the upper layer
+                    hash = left
+                elif self.padding == "bitcoin":  # duplicate the last odd item
+                    hash = self._hash(left, left)
+                else:  # add an extra null node
+                    hash = self._hash(left, None)
+                pos = (self.offsets[layer + 1] + i) * 32
+                view[pos:pos + 32] = hash
+
+    @staticmethod
+    def _hash(left: bytes, right: bytes):
+        # nodes are hashed in the hex form of their children, same as MerkleNode
+        data = left.hex() if right is None else left.hex() + right.hex()
+        return hashlib.sha256(data.encode()).digest()
+
+    def node(self, layer: int, index: int):
+        """ Returns the digest of the index-th node of the layer. """
+        pos = (self.offsets[layer] + index) * 32
+        return bytes(self.hashes[pos:pos + 32])
+
+    @property
+    def root_hash(self):
+        if self.size == 0:
+            return ""
+        return self.node(len(self.counts) - 1, 0).hex()
+
+    def proof(self, index: int):
+        """
+        Creates the inclusion proof of the index-th item.
+        :returns a list of [side, hash] from the leaf to the root, where side tells if the
+                 sibling hash is on the "L"eft or "R"ight, the hash is "" for a null node.
+        """
+        if not 0 <= index < self.size:
+            raise IndexError("merkle tree index out of range")
+        proof = []
+        for layer in range(len(self.counts) - 1):
+            sibling = index ^ 1
+            if sibling < self.counts[layer]:
+                proof.append(["L" if sibling < index else "R", self.node(layer, sibling).hex()])
+            elif self.padding == "bitcoin":
+                proof.append(["R", self.node(layer, index).hex()])
+            elif self.padding == "libra":
+                proof.append(["R", ""])
+            index >>= 1
+        return proof
+
+    @staticmethod
+    def verify_proof(leaf, proof: list, root: str):
+        """
+        Verifies an inclusion proof created by proof().
+        :param leaf: the item to check
+        :param proof: the proof of the item
+        :param root: the expected root hash
+        :returns True if the item is in the tree with the given root.
+        """
+        hash = Hasher.object_hash(leaf)
+        for side, sibling in proof:
+            hash = Hasher.hash(sibling + hash if side == "L" else hash + sibling)
+        return hash == root
+
+    def __len__(self):
+        return self.size
+
+
+class DigestMerkleTree:
+    """
+    The version 1 merkle tree: raw 32 byte digests, hashed layer by layer in one preallocated buffer.
+
+    The leaves are the digests of the items (leaf_digests), and a node is the hash
+    of the 64 bytes of its two children, which lie next to each other in the layer
+    below, so nodes are hashed straight from the buffer. Hex only appears in
+    root_hash and the proofs. Layers are laid out like CompactMerkleTree, and the
+    last odd node of a layer moves up like in ZeroMerkleTree.
+    """
+
+    DIGEST_SIZE = 32
+    VERSION = 1
+
+    def __init__(self, items: list, size = None):
+        if size is None:
+            size = len(items)
+        self.size = size
+
+        # the offset (in nodes) of each layer, the leaves are layer 0
+        self.offsets = [0]
+        self.counts = [size]
+        while self.counts[-1] > 1:
+            self.offsets.append(self.offsets[-1] + self.counts[-1])
+            self.counts.append((self.counts[-1] + 1) >> 1)
+        self.hashes = bytearray((self.offsets[-1] + self.counts[-1]) * DigestMerkleTree.DIGEST_SIZE)
+        with BUILD_SECONDS.time(("digest",)):
+            self.construct(items)
+
+    def construct(self, items: list):
+        sha256 = hashlib.sha256
+        view = memoryview(self.hashes)
+        view[:self.size * 32] = leaf_digests(itertools.islice(items, self.size))
+        for layer in range(len(self.counts) - 1):
+            start = self.offsets[layer] * 32
+            end = start + (self.counts[layer] & ~1) * 32
+            parents = b"".join([sha256(_NODE + view[i:i + 64]).digest() for i in range(start, end, 64)])
+            if self.counts[layer] & 1:  # move the last odd item to the upper layer
+                parents += view[end:end + 32]
+            pos = self.offsets[layer + 1] * 32
+            view[pos:pos + len(parents)] = parents
+
+    def node(self, layer: int, index: int):
+        """ Returns the digest of the index-th node of the layer. """
+        pos = (self.offsets[layer] + index) * 32
+        return bytes(self.hashes[pos:pos + 32])
+
+    @property
+    def root_hash(self):
+        if self.size == 0:
+            return ""
+        return f"v{self.VERSION}:{self.node(len(self.counts) - 1, 0).hex()}"
+
+    def proof(self, index: int):
+        """
+        Creates the inclusion proof of the index-th item.
+        :returns a list of [side, hash] from the leaf to the root, like CompactMerkleTree.proof
+        """
+        if not 0 <= index < self.size:
+            raise IndexError("merkle tree index out of range")
+        proof = []
+        for layer in range(len(self.counts) - 1):
+            sibling = index ^ 1
+            if sibling < self.counts[layer]:
+                proof.append(["L" if sibling < index else "R", self.node(layer, sibling).hex()])
+            index >>= 1
+        return proof
+
+    @staticmethod
+    def verify_proof(leaf, proof: list, root: str):
+        """
+        Verifies an inclusion proof created by proof().
+        :returns True if the item is in the tree with the given root.
+        """
+        try:
+            hash = bytes.fromhex(Hasher.object_hash(leaf))
+            for side, sibling in proof:
+                sibling = bytes.fromhex(sibling)
+                hash = hashlib.sha256(_NODE + sibling + hash if side == "L" else _NODE + hash + sibling).digest()
+        except (TypeError, ValueError):
+            return False  # a malformed proof
+        return f"v{DigestMerkleTree.VERSION}:{hash.hex()}" == root
+
+    def __len__(self):
+        return self.size
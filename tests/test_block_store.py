@@ -0,0 +1,84 @@
+import os
+from src.block_store import BlockStore
+from src.state import Snapshot
+from src.transaction import TransferTxn
+from src.zero_chain import BlockHeader
+
+
+def block(height: int):
+    return BlockHeader(height, "%064x" % height, "", 1, nonce=height), [TransferTxn("a", "b", height + 1)]
+
+
+def fill(store, count: int):
+    for height in range(len(store), count):
+        store.append(*block(height))
+
+
+def segments(path):
+    return sorted(name for name in os.listdir(path) if name.startswith("blocks-"))
+
+
+def test_segments(tmp_path):
+    store = BlockStore(str(tmp_path), segment_blocks=4)
+    fill(store, 10)
+    assert segments(tmp_path) == ["blocks-0.dat", "blocks-1.dat", "blocks-2.dat"]
+    store.close()
+    store = BlockStore(str(tmp_path), segment_blocks=4)
+    assert len(store) == 10
+    assert [h.nonce for h in store.headers] == list(range(10))
+    assert [txs[0].amount for txs in store.transactions] == list(range(1, 11))
+    store.truncate(5)
+    assert len(store) == 5 and segments(tmp_path) == ["blocks-0.dat", "blocks-1.dat"]
+    fill(store, 7)
+    assert store.transactions[6][0].amount == 7
+    store.close()
+
+
+def test_prune_deletes_segments(tmp_path):
+    store = BlockStore(str(tmp_path), segment_blocks=4)
+    fill(store, 10)
+    kept = os.stat(tmp_path / "blocks-1.dat")
+    store.prune(Snapshot(6, "hash"))
+    # the partly pruned segment is not rewritten
+    assert segments(tmp_path) == ["blocks-1.dat", "blocks-2.dat"]
+    assert os.stat(tmp_path / "blocks-1.dat").st_mtime_ns == kept.st_mtime_ns
+    assert store.transactions[5] is None and store.transactions[6][0].amount == 7
+    assert [h.nonce for h in store.headers] == list(range(10))
+    store.prune(Snapshot(8, "hash"))
+    assert segments(tmp_path) == ["blocks-2.dat"]
+    store.close()
+    store = BlockStore(str(tmp_path), segment_blocks=4)
+    assert len(store) == 10 and store.snapshot.height == 8 and store.transactions[9][0].amount == 10
+    store.close()
+
+
+def test_recover(tmp_path):
+    store = BlockStore(str(tmp_path), segment_blocks=4)
+    fill(store, 6)
+    store.close()
+    # a torn record at the tail, and an index which lost its last entries
+    with open(tmp_path / "blocks-1.dat", "ab") as f:
+        f.write(b"\0\0\1")
+    with open(tmp_path / BlockStore.INDEX_FILE, "r+b") as f:
+        f.truncate(16 * 3 + 5)
+    store = BlockStore(str(tmp_path), segment_blocks=4)
+    assert len(store) == 6 and store.transactions[5][0].amount == 6
+    fill(store, 8)
+    assert [h.nonce for h in store.headers] == list(range(8))
+    store.close()
+    # a header written without its transactions is dropped
+    with open(tmp_path / BlockStore.HEADERS_FILE, "r+b") as f:
+        f.truncate(os.path.getsize(tmp_path / BlockStore.HEADERS_FILE) - 1)
+    store = BlockStore(str(tmp_path), segment_blocks=4)
+    assert len(store) == 7
+    store.close()
+
+
+def test_header_cache_is_bounded(tmp_path):
+    store = BlockStore(str(tmp_path))
+    store.HEADER_CACHE = 5
+    fill(store, 20)
+    assert len(store._headers) == 5
+    assert [h.nonce for h in store.headers] == list(range(20))
+    assert len(store._headers) == 5 and list(store._headers) == list(range(15, 20))
+    store.close()
@@ -0,0 +1,120 @@
+import time
+from src import verifier
+from src.bench import LocalNode, fixed_schedule
+from src.difficulty import DifficultySchedule
+from src.parallel_merkle import merkle_root
+from src.transaction import TransferColumns, TransferTxn
+from src.util import Hasher
+from src.zero_chain import BlockHeader, ZeroChain
+from src.zero_merkle import transaction_root, verify_proof
+
+
+def test_same_genesis():
+    first = ZeroChain()
+    time.sleep(0.01)
+    second = ZeroChain()
+    assert first.block_headers[0].timestamp == 0
+    assert Hasher.object_hash(first.latest_block) == Hasher.object_hash(second.latest_block)
+
+
+def test_first_window_skips_genesis():
+    schedule = DifficultySchedule(initial=8, target_interval=1.0, window=4)
+    # blocks on target, long after the fixed timestamp of the genesis block
+    headers = [BlockHeader(0, "", "", 8, timestamp=0)] + \
+              [BlockHeader(h, "", "", 8, timestamp=1_700_000_000_000 + h * 1000) for h in range(1, 8)]
+    assert schedule.difficulty(4, headers.__getitem__) == 8
+    assert schedule.difficulty(8, headers.__getitem__) == 8
+    assert DifficultySchedule(window=2).difficulty(2, headers.__getitem__) == 8
+
+
+class FakeResponse:
+    """ A peer reply with the given json, or a body which is not json. """
+
+    def __init__(self, data=None, text: bool = False):
+        self.data = data
+        self.text = text
+
+    def json(self):
+        if self.text:
+            raise ValueError("not json")
+        return self.data
+
+
+def test_malformed_tips():
+    chain = ZeroChain()
+    replies = {"a": FakeResponse(text=True), "b": FakeResponse({"height": 3}), "c": FakeResponse([1]),
+               "d": FakeResponse({"block_height": "9"}), "e": FakeResponse({"block_height": 5, "light": False}),
+               "f": None}
+    chain.peers.get_all = lambda nodes, path, params=None, timeout=None: replies
+    assert chain.longest_node() == ("e", 5)
+    assert chain.full_nodes == {"e"}
+
+
+def test_malformed_node_lists():
+    chain = ZeroChain()
+    replies = {"a": FakeResponse(text=True), "b": FakeResponse({"nodes": "c:1"}), "c": FakeResponse({"nodes": [1]}),
+               "d": FakeResponse({"nodes": ["x:1"]}), "e": None}
+    chain.peers.post_all = lambda nodes, path, data=None, timeout=None: {}
+    chain.peers.get_all = lambda nodes, path, params=None, timeout=None: \
+        {node: reply for node, reply in replies.items() if node in nodes}
+    chain.add_nodes(["a", "b", "c", "d", "e"], True)
+    assert chain.nodes == {"a", "b", "c", "d", "e", "x:1"}
+
+
+def test_executor_is_kept():
+    chain = ZeroChain()
+    assert chain._executor is None
+    executor = chain.executor
+    assert chain.executor is executor
+    try:
+        items = [TransferTxn("a", "b", i + 1) for i in range(100)]
+        assert merkle_root(items, encoding="hex", threshold=1, executor=executor) == transaction_root(items, 0)
+        headers, transactions = [], []
+        for b in range(verifier.PARALLEL_BLOCKS):
+            txs = [TransferTxn("a", "b", b + 1)]
+            headers.append(BlockHeader(b, "", transaction_root(txs, b % 2), 1))
+            transactions.append(txs)
+        assert verifier.verify_transactions(headers, transactions, workers=2, executor=executor)
+        transactions[-1] = [TransferTxn("a", "b", 0)]
+        assert verifier.verify_transactions(headers, transactions, workers=2, executor=executor).height == len(headers) - 1
+    finally:
+        chain.close()
+    assert chain._executor is None and chain.executor is not executor
+    chain.close()
+
+
+def test_compact_history():
+    schedule = fixed_schedule(4)
+    peer = ZeroChain(schedule=schedule)
+    for b in range(3):
+        peer.transfer_many([("a", "b", b + 1), ("b", "c", "7")])
+        peer.create_block()
+    chain = ZeroChain(schedule=schedule, compact_history=True)
+    node = LocalNode(peer)
+    try:
+        chain.add_nodes([node.address], False)
+        assert chain.sync_self()
+    finally:
+        node.close()
+    chain.transfer("c", "a", 2)
+    chain.create_block()
+    assert all(isinstance(txs, TransferColumns) for txs in chain.transactions[1:])
+    assert ZeroChain.verify_chain(chain.block_headers, chain.transactions, schedule=schedule)
+    assert [chain.balance(a) for a in "abc"] == [-4, -15, 19]
+    assert [(h, p, t.to_json()) for h, p, t in chain.history("c")] == \
+           [(1, 1, {"sender": "b", "receiver": "c", "amount": "7"}), (2, 1, {"sender": "b", "receiver": "c", "amount": "7"}),
+            (3, 1, {"sender": "b", "receiver": "c", "amount": "7"}), (4, 0, {"sender": "c", "receiver": "a", "amount": 2})]
+    txn = chain.transactions[4][0]
+    height, position, found, proof = chain.find_transaction(Hasher.object_hash(txn))
+    assert (height, position) == (4, 0) and verify_proof(found, proof, chain.block_headers[4].transaction_root)
+
+    # a plain node syncs from the compact one
+    other = ZeroChain(schedule=schedule)
+    node = LocalNode(chain)
+    try:
+        other.add_nodes([node.address], False)
+        assert other.sync_self()
+    finally:
+        node.close()
+    assert [t.to_json() for txs in other.transactions for t in txs] == \
+           [t.to_json() for txs in chain.transactions for t in txs]
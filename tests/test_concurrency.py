@@ -0,0 +1,62 @@
+import threading
+from src.bench import fixed_schedule
+from src.util import Hasher
+from src.zero_chain import ZeroChain
+
+
+def test_concurrent_transfers_and_mining(threads: int = 4, txn_count: int = 200, miners: int = 2):
+    """
+    Submits transfers from several threads while others mine blocks and read the chain,
+    then checks no transaction is lost or mined twice.
+    """
+    chain = ZeroChain(schedule=fixed_schedule(4))
+    accepted = [[] for t in range(threads)]
+    errors = []
+    done = threading.Event()
+
+    def submit(t):
+        for i in range(0, txn_count, 10):
+            if i % 20 == 0:
+                for j in range(i, min(i + 10, txn_count)):
+                    accepted[t].append(Hasher.object_hash(chain.transfer(f"s{t}", f"r{j % 7}", j + 1)))
+            else:
+                results = chain.transfer_many((f"s{t}", f"r{j % 7}", j + 1) for j in range(i, min(i + 10, txn_count)))
+                accepted[t].extend(txid for txid, error in results if error is None)
+
+    def mine():
+        while not done.is_set():
+            chain.create_block()
+
+    def read():
+        while not done.is_set():
+            with chain.lock:
+                [h.to_json() for h in chain.block_headers[-10:]]
+                chain.balance("r0")
+
+    def run(target, *args):
+        try:
+            target(*args)
+        except Exception as e:
+            errors.append(e)
+
+    workers = [threading.Thread(target=run, args=(mine,)) for m in range(miners)] + \
+              [threading.Thread(target=run, args=(read,))]
+    submitters = [threading.Thread(target=run, args=(submit, t)) for t in range(threads)]
+    for w in workers + submitters:
+        w.start()
+    for w in submitters:
+        w.join()
+    done.set()
+    for w in workers:
+        w.join()
+    assert not errors
+    while len(chain.mempool):
+        chain.create_block()
+
+    txids = [txid for a in accepted for txid in a]
+    mined = [Hasher.object_hash(t) for txs in chain.transactions for t in txs]
+    assert len(txids) == threads * txn_count, "a transfer was rejected"
+    assert sorted(mined) == sorted(txids), "a transaction is lost or mined twice"
+    assert ZeroChain.verify_chain(chain.block_headers, chain.transactions, schedule=chain.schedule)
+    for t in range(threads):
+        assert chain.balance(f"s{t}") == -sum(range(1, txn_count + 1))
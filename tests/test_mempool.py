@@ -0,0 +1,59 @@
+import pytest
+from src.mempool import Mempool, MempoolFullError, amount_priority
+from src.transaction import TransferTxn
+from src.zero_merkle import transaction_root
+
+
+def transfers(start: int, count: int):
+    return [TransferTxn("a", "b", i) for i in range(start, start + count)]
+
+
+def pool_root(pool):
+    return transaction_root(list(pool), pool.root_version)
+
+
+def test_evicts_oldest():
+    pool = Mempool(max_count=3)
+    txids = [pool.add(txn) for txn in transfers(1, 5)]
+    assert list(pool.transactions) == txids[2:]
+    assert pool.root_hash(list(pool.transactions)) == pool_root(pool)
+
+
+def test_reject():
+    pool = Mempool(max_count=3, eviction="reject")
+    for txn in transfers(1, 3):
+        pool.add(txn)
+    with pytest.raises(MempoolFullError):
+        pool.add(TransferTxn("a", "b", 4))
+    with pytest.raises(ValueError):
+        Mempool(eviction="newest")
+
+
+def test_amount_priority():
+    pool = Mempool(max_count=3, priority=amount_priority)
+    for amount in (5, "x", 7):
+        pool.add(TransferTxn("a", "b", amount))
+    pool.add(TransferTxn("a", "b", 6))
+    assert sorted(txn.amount for txn in pool) == [5, 6, 7]
+    with pytest.raises(MempoolFullError):
+        pool.add(TransferTxn("a", "b", 1))
+
+
+def test_root_after_block():
+    pool = Mempool()
+    for txn in transfers(1, 5):
+        pool.add(txn)
+    # a block takes the whole pool, more transactions arrive while it is mined
+    txids = pool.select(10, 1 << 20)
+    assert pool.root_hash(txids) == pool_root(pool)
+    for txn in transfers(10, 3):
+        pool.add(txn)
+    pool.remove(txids)
+    assert pool._tree is not None and len(pool._tree) == 3
+    assert pool.root_hash(list(pool.transactions)) == pool_root(pool)
+
+    # a block takes part of the pool, the root of the rest is rebuilt when it is needed
+    pool.remove(list(pool.transactions)[:1])
+    assert pool.root_hash(list(pool.transactions)) == pool_root(pool)
+    pool.remove(list(pool.transactions))
+    assert len(pool._tree) == 0
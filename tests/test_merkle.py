@@ -0,0 +1,90 @@
+import concurrent.futures
+import hashlib
+import pytest
+from src.parallel_merkle import merkle_root
+from src.transaction import TransferTxn
+from src.util import Hasher
+from src.zero_merkle import BitcoinMerkleTree, LibraMerkleTree, ZeroMerkleTree
+from src.zero_merkle import BitcoinMerkleTreeLite, LibraMerkleTreeLite, ZeroMerkleTreeLite
+from src.zero_merkle import CompactMerkleTree, DigestMerkleTree, ZeroMerkleAccumulator
+from src.zero_merkle import merkle_tree, root_version, transaction_root, verify_proof
+
+SIZES = list(range(40)) + [1000, 1025]
+TREES = {"zero": ZeroMerkleTree, "bitcoin": BitcoinMerkleTree, "libra": LibraMerkleTree}
+LITE_TREES = {"zero": ZeroMerkleTreeLite, "bitcoin": BitcoinMerkleTreeLite, "libra": LibraMerkleTreeLite}
+
+
+def transfers(count: int):
+    return [TransferTxn(f"s{i % 7}", f"r{i % 11}", i + 1) for i in range(count)]
+
+
+def digest_root(items: list):
+    """ The version 1 root built from its definition: raw digests, the last odd node moves up. """
+    layer = [bytes.fromhex(Hasher.object_hash(item)) for item in items]
+    if not layer:
+        return ""
+    while len(layer) > 1:
+        up_layer = [hashlib.sha256(b"\x01" + layer[i] + layer[i + 1]).digest() for i in range(0, len(layer) - 1, 2)]
+        if len(layer) & 1 == 1:
+            up_layer.append(layer[-1])
+        layer = up_layer
+    return f"v1:{layer[0].hex()}"
+
+
+@pytest.mark.parametrize("size", SIZES)
+@pytest.mark.parametrize("padding", CompactMerkleTree.PADDINGS)
+def test_compact_tree(padding, size):
+    items = transfers(size)
+    tree = CompactMerkleTree(items, padding=padding)
+    root = TREES[padding](items).root_hash
+    assert tree.root_hash == root
+    for index, item in enumerate(items):
+        assert CompactMerkleTree.verify_proof(item, tree.proof(index), root)
+    if size > 1:
+        assert not CompactMerkleTree.verify_proof(items[0], tree.proof(1), root)
+
+
+@pytest.mark.parametrize("size", SIZES)
+@pytest.mark.parametrize("padding", CompactMerkleTree.PADDINGS)
+def test_merkle_root(padding, size):
+    items = transfers(size)
+    assert merkle_root(items, padding=padding, encoding="hex", workers=1) == TREES[padding](items).root_hash
+    data = [Hasher.object_hash(item).encode() for item in items]
+    assert merkle_root(data, padding=padding, encoding="raw", workers=1) == LITE_TREES[padding](data)
+
+
+@pytest.mark.parametrize("size", [2, 3, 17, 1000, 1025])
+@pytest.mark.parametrize("padding", CompactMerkleTree.PADDINGS)
+def test_parallel_merkle_root(padding, size):
+    items = transfers(size)
+    with concurrent.futures.ThreadPoolExecutor(4) as executor:
+        root = merkle_root(items, padding=padding, encoding="hex", workers=4, threshold=1, executor=executor)
+    assert root == TREES[padding](items).root_hash
+
+
+@pytest.mark.parametrize("size", SIZES)
+def test_digest_tree(size):
+    items = transfers(size)
+    tree = DigestMerkleTree(items)
+    root = digest_root(items)
+    assert tree.root_hash == root
+    assert transaction_root(items, 1) == root
+    assert (ZeroMerkleAccumulator(items, version=1).root_hash if items else "") == root
+    for index, item in enumerate(items):
+        assert verify_proof(item, tree.proof(index), root)
+    if size > 1:
+        assert not verify_proof(items[0], tree.proof(1), root)
+
+
+@pytest.mark.parametrize("size", SIZES)
+def test_versions(size):
+    items = transfers(size)
+    root = ZeroMerkleTree(items).root_hash
+    assert transaction_root(items, 0) == root
+    assert (ZeroMerkleAccumulator(items).root_hash if items else "") == root
+    tree = merkle_tree(items, 0)
+    for index, item in enumerate(items):
+        assert verify_proof(item, tree.proof(index), root)
+    assert root_version(root) == 0
+    if items:
+        assert root_version(transaction_root(items, 1)) == 1
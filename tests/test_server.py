@@ -0,0 +1,29 @@
+import pytest
+from src import server
+from src.bench import build_chain
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(server, "zeroChain", build_chain(5, 2, 4))
+    return server.app.test_client()
+
+
+def test_paging(client):
+    headers = client.get("/headers?from=3").get_json()["block_headers"]
+    assert [h["height"] for h in headers] == [3, 4, 5]
+    blocks = client.get("/blocks?from=2&to=4").get_json()
+    assert [h["height"] for h in blocks["block_headers"]] == [2, 3]
+
+
+@pytest.mark.parametrize("path", ["/headers?from=-3", "/headers?count=-1", "/blocks?from=-3", "/blocks?to=-1"])
+def test_negative_range(client, path):
+    assert client.get(path).status_code == 400
+
+
+def test_snapshot_checkpoints(client, monkeypatch):
+    assert client.get("/snapshot").get_json()["height"] == 0
+    assert client.get("/snapshot?height=3").status_code == 400
+    monkeypatch.setattr(server.zeroChain, "PRUNE_EVERY", 2)
+    assert client.get("/snapshot?height=4&hash=True").get_json()["height"] == 4
+    assert client.get("/snapshot?height=8").status_code == 404
@@ -0,0 +1,51 @@
+from src.bench import LocalNode, fixed_schedule
+from src.state import BalanceIndex, Snapshot
+from src.transaction import TransferTxn
+from src.util import Hasher
+from src.zero_chain import BlockHeader, ZeroChain
+from src.zero_merkle import transaction_root
+
+
+def test_invalid_amounts():
+    index = BalanceIndex()
+    index.apply_block([TransferTxn("a", "b", 5), TransferTxn("a", "b", float("inf")),
+                       TransferTxn("a", "b", float("nan")), TransferTxn("a", "b", "x"), TransferTxn("b", "a", "2")])
+    assert index.balance("a") == -3 and index.balance("b") == 3
+    assert index.height == 1 and len(index.account_history("a")) == 5
+    snapshot = Snapshot().advance("hash", [[TransferTxn("a", "b", float("-inf")), TransferTxn("a", "b", 1)]])
+    assert snapshot.balances == {"a": -1, "b": 1}
+
+
+def test_block_applied_at_once():
+    index = BalanceIndex()
+    index.apply_block([TransferTxn("a", "b", 1)])
+    try:
+        index.apply_block([TransferTxn("a", "b", 2), None])
+    except AttributeError:
+        pass
+    assert index.height == 1 and index.balance("b") == 1 and index.account_history("b") == [(0, 0)]
+
+
+def test_sync_rejects_invalid_amount():
+    schedule = fixed_schedule(4)
+    peer = ZeroChain(schedule=schedule)
+    for b in range(3):
+        peer.transfer("a", "b", b + 1)
+        peer.create_block()
+    # a block no node would mine, with an infinite amount
+    transactions = [TransferTxn("a", "b", float("inf"))]
+    block_header = BlockHeader(peer.block_height, Hasher.object_hash(peer.latest_block),
+                               transaction_root(transactions), peer.difficulty,
+                               timestamp=schedule.timestamp(peer.latest_block))
+    assert peer.run_pow(block_header) and peer.add_block(block_header, transactions)
+
+    chain = ZeroChain(schedule=schedule)
+    node = LocalNode(peer)
+    try:
+        chain.add_nodes([node.address], False)
+        assert not chain.sync_self()
+    finally:
+        node.close()
+    assert chain.block_height == 1 and chain.balance("b") == 0
+    chain.transfer("a", "b", 1)
+    assert chain.create_block() is not None
@@ -0,0 +1,105 @@
+import pytest
+from src import wire
+from src.mempool import Mempool, MempoolError
+from src.transaction import TransferTxn
+from src.zero_chain import BlockHeader
+from src.zero_merkle import transaction_root
+
+DIGEST = "ab" * 32
+
+
+def round_trip(block_headers, transactions):
+    data = wire.encode_blocks(7, block_headers, transactions)
+    start, headers, txs = wire.decode_blocks(data)
+    assert start == 7
+    assert headers == [h.to_json() for h in block_headers]
+    assert txs == [[t.to_json() for t in ts] for ts in transactions]
+    return data
+
+
+@pytest.mark.parametrize("amount", [0, -1, 5, (1 << 63) - 1, -(1 << 63), "12", "", "3.5", 2.5, -0.0, True, False])
+def test_amounts(amount):
+    header = BlockHeader(1, DIGEST, DIGEST, 2, 3, 4)
+    txns = [TransferTxn("a", "b", amount)]
+    round_trip([header], [txns])
+    # the type is part of the transaction hash, so it must come back unchanged
+    _, _, txs = wire.decode_blocks(wire.encode_blocks(0, [header], [txns]))
+    assert type(txs[0][0]["amount"]) is type(amount)
+
+
+@pytest.mark.parametrize("value", ["", DIGEST, "v1:" + DIGEST, "v0:" + DIGEST, "v255:" + DIGEST,
+                                   # not in the canonical form, so sent as text
+                                   "AB" * 32, "v01:" + DIGEST, "v256:" + DIGEST, "v²:" + DIGEST, "v1:" + "ab" * 31,
+                                   "genesis", "é" * 10])
+def test_hashes(value):
+    round_trip([BlockHeader(0, value, value, 0)], [[]])
+
+
+def test_versioned_roots():
+    txns = [TransferTxn("a", "b", i) for i in range(5)]
+    headers = [BlockHeader(0, "", transaction_root(txns, 0), 1), BlockHeader(1, DIGEST, transaction_root(txns, 1), 1)]
+    assert headers[1].transaction_root.startswith("v1:")
+    data = round_trip(headers, [txns, txns])
+    # a versioned digest takes 34 bytes instead of its 67 characters
+    assert len(data) < len(wire.encode_blocks(7, [BlockHeader(0, "", "x" * 67, 1)] * 2, [txns, txns]))
+
+
+def test_text():
+    round_trip([BlockHeader(0, "", "", 0)], [[TransferTxn("é" * 100, "", 1), TransferTxn("x" * 0xFFFF, "y", 2)]])
+
+
+def test_truncated():
+    data = wire.encode_blocks(0, [BlockHeader(0, DIGEST, "v1:" + DIGEST, 1)] * 2,
+                              [[TransferTxn("sender", "receiver", "100"), TransferTxn("a", "b", 1)]] * 2)
+    for size in range(len(data)):
+        with pytest.raises(wire.WireError):
+            wire.decode_blocks(data[:size])
+
+
+def test_trailing():
+    data = wire.encode_blocks(0, [BlockHeader(0, DIGEST, DIGEST, 1)], [[TransferTxn("a", "b", 1)]])
+    with pytest.raises(wire.WireError):
+        wire.decode_blocks(data + b"\0")
+
+
+def test_corrupt():
+    data = bytearray(wire.encode_blocks(0, [BlockHeader(0, "", "", 1)], [[TransferTxn("a", "b", 1)]]))
+    data[-9] = 9  # the amount tag
+    with pytest.raises(wire.WireError):
+        wire.decode_blocks(data)
+
+
+@pytest.mark.parametrize("txn", [TransferTxn("x" * 0x10000, "b", 1), TransferTxn("a", "é" * 0x8000, 1),
+                                 TransferTxn("a", "b", "9" * 0x10000), TransferTxn("a", "b", 1 << 63),
+                                 TransferTxn("a", "b", -(1 << 63) - 1), TransferTxn("a", "b", None),
+                                 TransferTxn("a", "b", [1])])
+def test_oversize_transaction(txn):
+    with pytest.raises(wire.WireError):
+        wire.encode_blocks(0, [BlockHeader(0, "", "", 1)], [[txn]])
+    assert not wire.can_encode(txn)
+    # the pool refuses what a block could not hold
+    with pytest.raises(MempoolError):
+        Mempool().add(txn)
+
+
+@pytest.mark.parametrize("header", [BlockHeader(1 << 64, "", "", 1), BlockHeader(0, "", "", 1 << 32),
+                                    BlockHeader(0, "", "", 1, nonce=-1), BlockHeader(0, "", "", 1, timestamp=1 << 64),
+                                    BlockHeader(0, "x" * 0x10000, "", 1)])
+def test_oversize_header(header):
+    with pytest.raises(wire.WireError):
+        wire.encode_blocks(0, [header], [[]])
+
+
+def test_bool_header_fields():
+    for header in (BlockHeader(True, "", "", 1), BlockHeader(0, "", "", True), BlockHeader(0, "", "", 1, nonce=False),
+                   BlockHeader(0, "", "", 1, timestamp=1.0)):
+        with pytest.raises(wire.WireError):
+            wire.encode_blocks(0, [header], [[]])
+
+
+def test_decode_to_transactions():
+    txns = [TransferTxn("a", "b", 1), TransferTxn("é", "c", "2"), TransferTxn("d", "e", 2.5)]
+    data = wire.encode_blocks(0, [BlockHeader(0, "", "", 1)], [txns])
+    _, _, txs = wire.decode_blocks(data, TransferTxn)
+    assert [type(t) for t in txs[0]] == [TransferTxn] * 3
+    assert [t.hash() for t in txs[0]] == [t.hash() for t in txns]